@@ -194,6 +194,48 @@ class TestLinker(tests.TestCase):
 
 
 
+class TestLinkCache(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(content=(
+			'foo', 'bar', 'foo:bar', 'foo:dus', 'foo:bar:baz', 'foo:other', 'Bar:Dus'))
+		layout = MultiFileLayout(self.setUpFolder('layout'), 'html')
+		cache = LinkCache(notebook.index)
+
+		def get_linker(source, cache):
+			return ExportLinker(notebook, layout,
+				source=source, output=layout.page_file(source),
+				usebase=True, cache=cache
+			)
+
+		links = ('bar', 'Bar', 'dus', 'Dus:bar', ':bar', '+baz', 'baz',
+			'bar:baz#heading', 'foo:dus', 'new', '+new', '#heading')
+		sources = (Path('foo:bar'), Path('foo:dus'), Path('foo:bar:baz'),
+			Path('bar'), Path('foo:new'), Path('new:page'))
+		for source in sources:
+			linker = get_linker(source, None)
+			cachedlinker = get_linker(source, cache)
+			for link in links:
+				wanted = linker.link(link)
+				self.assertEqual(cachedlinker.link(link), wanted)
+				self.assertEqual(cachedlinker.link(link), wanted) # cached
+
+		self.assertGreater(cache.hits, cache.misses)
+
+		# Floating links are shared between pages in the same namespace
+		hits = cache.hits
+		get_linker(Path('foo:other'), cache).link('dus')
+		self.assertEqual(cache.hits, hits + 1)
+
+		# Changes in the index invalidate the cache
+		self.assertEqual(get_linker(Path('foo:bar'), cache).link('Baz'), './Baz.html')
+		page = notebook.get_page(Path('foo:baz'))
+		page.parse('wiki', 'test 123\n')
+		notebook.store_page(page)
+		self.assertEqual(get_linker(Path('foo:bar'), None).link('Baz'), './baz.html')
+		self.assertEqual(get_linker(Path('foo:bar'), cache).link('Baz'), './baz.html')
+
+
 class TestExportTemplateContext(tests.TestCase):
 
 	def setUp(self):
@@ -321,6 +363,38 @@ class TestExportTemplateContext(tests.TestCase):
 
 
 
+class TestExportIndex(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+		pages = AllPages(notebook)
+		calls = []
+
+		def index_generator(namespace=None):
+			calls.append(namespace)
+			return pages.index(namespace)
+
+		index = ExportIndex(index_generator)
+		allpaths = list(pages.index())
+		self.assertEqual(index.list_pages(), allpaths)
+		self.assertEqual(list(index()), allpaths)
+
+		# Collapsed index gives same pages as filtering the full index
+		page = Path('Parent:Daughter:Granddaughter')
+		expanded = [page] + list(page.parents())
+		self.assertEqual(
+			index.list_pages(None, expanded),
+			[p for p in allpaths if p.parent in expanded]
+		)
+		self.assertEqual(
+			index.list_pages(Path('Parent'), expanded),
+			[p for p in pages.index(Path('Parent')) if p.parent in expanded]
+		)
+
+		# Index is walked once per namespace
+		self.assertEqual(calls, [None, Path('Parent')])
+
+
 class TestPageProxyWithFormattedHeading(tests.TestCase):
 
 	CONTENT = {
@@ -422,6 +496,88 @@ class TestMultiFileExporter(tests.TestCase):
 		self.assertIn('<li><a href="./roundtrip.html" title="roundtrip" class="page">roundtrip</a></li>', text)
 
 
+def _read_files(folder):
+	files = {}
+	for file in folder.walk():
+		if isinstance(file, File):
+			files[file.relpath(folder)] = file.read_binary()
+	return files
+
+
+@tests.slowTest
+class TestParallelMultiFileExporter(tests.TestCase):
+
+	# Exporting with worker processes should give exactly the same output
+
+	def runTest(self):
+		from zim.notebook import Notebook
+
+		folder = self.setUpFolder('notebook', mock=tests.MOCK_ALWAYS_REAL)
+		self.setUpNotebook(content=tests.FULL_NOTEBOOK, folder=folder)
+		notebook = Notebook.new_from_dir(folder)
+		notebook.index.check_and_update()
+		output = self.setUpFolder('output', mock=tests.MOCK_ALWAYS_REAL)
+
+		results = []
+		for name, jobs in (('serial', None), ('parallel', 2)):
+			exporter = build_notebook_exporter(output.folder(name), 'html', 'Default', index_page='Index', jobs=jobs)
+			pages = [p.name for p in exporter.export_iter(AllPages(notebook)) if isinstance(p, Path)]
+			results.append((pages, _read_files(output.folder(name))))
+
+		serial, parallel = results
+		self.assertGreater(len(serial[0]), 10)
+		self.assertEqual(parallel[0], serial[0])
+		self.assertEqual(sorted(parallel[1]), sorted(serial[1]))
+		for path in serial[1]:
+			self.assertEqual(parallel[1][path], serial[1][path], path)
+
+
+class TestIncrementalMultiFileExporter(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+		output = self.setUpFolder('output', mock=tests.MOCK_ALWAYS_REAL)
+		folder = output.folder('incremental')
+
+		def export():
+			exporter = build_notebook_exporter(folder, 'html', 'Default', index_page='Index', incremental=True)
+			exporter.export(AllPages(notebook))
+
+		def assertSameAsFullExport():
+			reference = output.folder('full')
+			if reference.exists():
+				reference.remove_children()
+			exporter = build_notebook_exporter(reference, 'html', 'Default', index_page='Index')
+			exporter.export(AllPages(notebook))
+			files = _read_files(folder)
+			self.assertIn('_manifest.json', files)
+			files.pop('_manifest.json')
+			self.assertEqual(files, _read_files(reference))
+
+		# First export includes all pages
+		export()
+		assertSameAsFullExport()
+
+		# Unchanged pages are skipped, changed pages are exported
+		skipped = folder.file('Parent/Son.html')
+		skipped.write('SKIPPED')
+		changed = notebook.get_page(Path('Test:foo'))
+		changed.parse('wiki', '====== Foo ======\nSome new content\n')
+		notebook.store_page(changed)
+		export()
+		self.assertEqual(skipped.read(), 'SKIPPED')
+		self.assertIn('Some new content', folder.file('Test/foo.html').read())
+
+		# Removed pages are removed from the output, missing output
+		# is exported again
+		self.assertTrue(folder.file('TrashMe/sub_page_1.html').exists())
+		notebook.delete_page(Path('TrashMe:sub page 1'))
+		skipped.remove()
+		export()
+		self.assertFalse(folder.file('TrashMe/sub_page_1.html').exists())
+		assertSameAsFullExport()
+
+
 class TestSingleFileExporter(tests.TestCase):
 
 	def runTest(self):
@@ -552,6 +708,8 @@ class TestExportCommand(tests.TestCase):
 			'--root-url', '/foo/',
 			'--index-page', 'myindex',
 			'--overwrite',
+			'--jobs', '4',
+			'--incremental',
 		)
 		exp = cmd.get_exporter(None)
 		self.assertIsInstance(exp, MultiFileExporter)
@@ -561,6 +719,15 @@ class TestExportCommand(tests.TestCase):
 		self.assertIsNotNone(exp.document_root_url)
 		self.assertIsNotNone(exp.format)
 		self.assertIsNotNone(exp.index_page)
+		self.assertEqual(exp.jobs, 4)
+		self.assertTrue(exp.incremental)
+
+		cmd = ExportCommand('export')
+		cmd.parse_options(self.notebookfolder.path,
+			'--output', self.tmpfolder.folder('output').path,
+			'--jobs', '0',
+		)
+		self.assertRaises(UsageError, cmd.get_exporter, None)
 
 
 		## Full notebook, single page
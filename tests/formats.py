@@ -100,6 +100,19 @@ class TestFormatMixin(object):
 				#~ print('\n' + '>'*80 + '\n' + string + '\n' + '<'*80 + '\n')
 			self.assertNoTextMissing(string, reftree)
 
+	def testDumpIter(self):
+		reftree = tests.new_parsetree_from_xml(self.reference_xml)
+		linker = StubLinker(tests.TEST_DATA_FOLDER.folder('formats'))
+		dumper = self.format.Dumper(linker=linker)
+		wanted = dumper.dump(reftree)
+
+		iter = dumper.dump_iter(reftree)
+		lines = [next(iter)]
+		self.assertGreater(len(dumper.context), 1) # first line before end of tree
+		lines.extend(iter)
+		self.assertEqual(lines, wanted)
+		self.assertEqual(lines, ''.join(lines).splitlines(True))
+
 	_nonalpha_re = re.compile(r'\W')
 
 	def assertNoTextMissing(self, text, tree):
@@ -607,6 +620,128 @@ hmmm
 				newtree = self.format.Parser().parse(wiki)
 				self.assertEqual(newtree.tostring(), xml)
 
+	def testDumpIterFileOutput(self):
+		tree = self.format.Parser().parse('Some text\n\n* item')
+		tree.meta['Creation-Date'] = '2020-01-01'
+		dumper = self.format.Dumper()
+		lines = list(dumper.dump_iter(tree, file_output=True))
+		self.assertEqual(lines, dumper.dump(tree, file_output=True))
+		self.assertTrue(lines[0].startswith('Content-Type: text/x-zim-wiki\n'))
+		self.assertIn('Creation-Date: 2020-01-01\n', lines[0])
+		self.assertEqual(lines[1:], ['\n', 'Some text\n', '\n', '* item\n'])
+
+
+class TestCompactParseTree(tests.TestCase):
+
+	def setUp(self):
+		self.format = get_format('wiki')
+
+	def testFullNotebook(self):
+		for name, text in tests.FULL_NOTEBOOK:
+			file_input = text.startswith('Content-Type')
+			tree = self.format.Parser().parse(text, file_input=file_input)
+			compact = self.format.Parser().parse(text, file_input=file_input, compact=True)
+			self.assertIsInstance(compact, CompactParseTree)
+
+			self.assertEqual(list(compact.iter_tokens()), list(tree.iter_tokens()))
+			self.assertEqual(dict(compact.meta), dict(tree.meta))
+			self.assertEqual(compact.hascontent, tree.hascontent)
+			self.assertEqual(compact.get_heading_level(), tree.get_heading_level())
+			self.assertEqual(compact.get_heading_text(), tree.get_heading_text())
+			self.assertEqual(
+				[h.to_wiki_link() for h in compact.iter_href()],
+				[h.to_wiki_link() for h in tree.iter_href()]
+			)
+			self.assertEqual(sorted(compact.iter_tag_names()), sorted(tree.iter_tag_names()))
+			self.assertEqual(''.join(compact.iter_text()), ''.join(tree.iter_text()))
+			self.assertEqual(compact.count('a'), tree.count('a'))
+
+			dumper = self.format.Dumper()
+			self.assertEqual(dumper.dump(compact), dumper.dump(tree))
+
+			self.assertEqual(compact.tostring(), tree.tostring())
+			self.assertEqual(compact.to_parsetree().tostring(), tree.tostring())
+			self.assertEqual(tree.to_compact().tostring(), tree.tostring())
+
+			copy = compact.copy()
+			self.assertEqual(list(copy.iter_tokens()), list(compact.iter_tokens()))
+			self.assertEqual(dict(copy.meta), dict(compact.meta))
+
+	def testHrefOrder(self):
+		text = tests.TEST_DATA_FOLDER.file('formats/wiki.txt').read()
+		tree = self.format.Parser().parse(text)
+		compact = self.format.Parser().parse(text, compact=True)
+		self.assertEqual(
+			[h.to_wiki_link() for h in compact.iter_href(include_anchors=True)],
+			[h.to_wiki_link() for h in tree.iter_href(include_anchors=True)]
+		)
+
+
+class TestWikiScanner(tests.TestCase):
+
+	CASES = (
+		"\t* a [[A]]\n* b @t\n\t\t[ ] c [[C|lab @x]]\n",
+		"'''\nverb [[NoLink]] @notag\n'''\nafter [[L]]\n",
+		"{{{code: lang=python\nprint('@no [[no]]')\n}}}\ntext\n",
+		"|h [[H]]|h2|\n|---|---|\n|c [[C]] @z|d|\n\nx\n",
+		"== Head [[HL]] @ht ==\nbody\n",
+		"see http://x.com/a_b. and www.q.org [[Foo]]] and ''[[code]]''\n",
+		"{{./img.png?href=Target}} {{id: anchor1}} {{./x.png|alt @tag}}\n",
+		"//emph [[E]]// **b @s** __mark__ ~~st~~ x_{sub} y^{sup}",
+		"\t\tindented @i\n\t\t\tdeeper [[D]]\n\tshallow\n",
+		"para\n\n\n   \n\t\npara2 @p",
+	)
+
+	def assertSameContent(self, text, file_input=False):
+		from zim.formats.wiki import Parser, Scanner
+		tree = Parser().parse(text, file_input=file_input)
+		facets = Scanner().scan(text, file_input=file_input)
+
+		self.assertEqual(
+			[h.to_wiki_link() for h in facets.iter_href(include_anchors=True)],
+			[h.to_wiki_link() for h in tree.iter_href(include_anchors=True)]
+		)
+		self.assertEqual(
+			[h.to_wiki_link() for h in facets.iter_href()],
+			[h.to_wiki_link() for h in tree.iter_href()]
+		)
+		self.assertEqual(sorted(facets.iter_tag_names()), sorted(tree.iter_tag_names()))
+		self.assertEqual(
+			''.join(facets.iter_text()).split(),
+			''.join(tree.iter_text()).split()
+		)
+		self.assertEqual(dict(facets.meta), dict(tree.meta))
+
+	def testFullNotebook(self):
+		for name, text in tests.FULL_NOTEBOOK:
+			self.assertSameContent(text, file_input=text.startswith('Content-Type'))
+
+	def testCases(self):
+		for text in self.CASES:
+			self.assertSameContent(text)
+
+	def testFormatData(self):
+		text = tests.TEST_DATA_FOLDER.file('formats/wiki.txt').read()
+		self.assertSameContent(text)
+
+	def testBackwardVersion(self):
+		text = 'Content-Type: text/x-zim-wiki\nWiki-Format: zim 0.26\n\n' \
+			'foo [[Bar]] @baz\n\n\tindented [[Verbatim]]\n'
+		self.assertSameContent(text, file_input=True)
+
+	def testHeadingsAndTasks(self):
+		from zim.formats.wiki import Scanner
+		facets = Scanner().scan(
+			'== Head ==\n[ ] task one\n\t[*] task two\n* bullet\n'
+		)
+		self.assertEqual(facets.headings, [(5, 'Head')])
+		self.assertEqual(facets.tasks, [
+			(0, UNCHECKED_BOX, 'task one'),
+			(1, CHECKED_BOX, 'task two'),
+		])
+		self.assertTrue(facets.hascontent)
+		self.assertFalse(Scanner().scan('').hascontent)
+
 
 class TestWikiListParsing(tests.TestCase):
 
@@ -864,6 +999,82 @@ dus ja.
 		self.assertListParsing(text, xml)
 
 
+class SinglePassEngineMixin(object):
+
+	def setUp(self):
+		import zim.formats.wiki
+		default = zim.formats.wiki.default_parser_engine
+		zim.formats.wiki.default_parser_engine = 'single-pass'
+
+		def restore():
+			zim.formats.wiki.default_parser_engine = default
+
+		self.addCleanup(restore)
+		super().setUp()
+
+
+class TestWikiFormatSinglePass(SinglePassEngineMixin, TestWikiFormat):
+	pass
+
+
+class TestWikiListParsingSinglePass(SinglePassEngineMixin, TestWikiListParsing):
+	pass
+
+
+class TestSinglePassWikiParser(tests.TestCase):
+
+	def assertSameBuilderCalls(self, text, **kwarg):
+		from zim.formats.wiki import WikiParser, SinglePassWikiParser
+
+		wanted = tests.MockObject(methods=('start', 'text', 'end', 'append'))
+		WikiParser(**kwarg)(wanted, text)
+		result = tests.MockObject(methods=('start', 'text', 'end', 'append'))
+		SinglePassWikiParser(**kwarg)(result, text)
+		self.assertEqual(result.allMethodCalls, wanted.allMethodCalls)
+
+	def testFullNotebook(self):
+		for name, text in tests.FULL_NOTEBOOK:
+			self.assertSameBuilderCalls(text)
+
+	def testTestData(self):
+		text = tests.TEST_DATA_FOLDER.file('formats/wiki.txt').read()
+		self.assertSameBuilderCalls(text)
+
+	def testBackwardCompatibility(self):
+		text = 'foo\n\n\tindented\n\tverbatim\n\nbar www.example.com\n'
+		self.assertSameBuilderCalls(text, backward_url_parsing=True)
+		self.assertSameBuilderCalls(text,
+			backward_indented_blocks=True, backward_url_parsing=True)
+
+	def testEdgeCases(self):
+		for text in (
+			'\n\n  \n',
+			'foo\n\t\n  ',
+			'-----\nfoo\n-----\n',
+			'|a|b|\n\n|c|d|\n',
+			"\t'''\n\tverbatim\n\t'''\nfoo",
+			"'''\nnot closed\n",
+			'* a\n\t* b\n\tc\n\t\td\n1. e\n',
+			'\t\t* a\n\t\t\t* b\n\t* c\n',
+			'    spaces\n        * list\n',
+			'== heading\n== heading ==\ntext',
+		):
+			self.assertSameBuilderCalls(text)
+
+	def testSelectEngine(self):
+		from zim.formats.wiki import Parser
+		text = tests.TEST_DATA_FOLDER.file('formats/wiki.txt').read()
+		self.assertEqual(
+			Parser(engine='single-pass').parse(text).tostring(),
+			Parser(engine='regex').parse(text).tostring()
+		)
+		self.assertRaises(ValueError, Parser, engine='foo')
+		self.assertEqual(
+			get_parser('wiki', engine='single-pass').parse(text).tostring(),
+			Parser().parse(text).tostring()
+		)
+
+
 class TestHtmlFormat(tests.TestCase, TestFormatMixin):
 
 	def setUp(self):
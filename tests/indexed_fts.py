@@ -4,6 +4,7 @@ import tests
 
 from zim.plugins import PluginManager
 from zim.plugins import indexed_fts
+from zim.notebook import Path
 
 @tests.skipIf(
 	indexed_fts.IndexedFTSPlugin.check_dependencies()[0] == False,
@@ -27,3 +28,83 @@ class TestIndexedFTS(tests.TestCase):
 		)
 
 
+	def testBM25Ranking(self):
+		'''Check ranking and snippets of Indexed Full Text Search plugin'''
+		from zim.search import SearchSelection, Query
+
+		plugin = PluginManager.load_plugin('indexed_fts')
+		plugin.preferences['ranking'] = indexed_fts.RANK_BM25
+		self.addCleanup(plugin.preferences.__setitem__, 'ranking', indexed_fts.RANK_COUNT)
+		notebook = self.setUpNotebook(content={
+			'Few': 'apple pear pear pear pear\n',
+			'Many': 'apple apple apple apple pear\n',
+			'None': 'banana\n',
+		})
+		notebook.index.check_and_update()
+
+		selection = SearchSelection(notebook)
+		selection.search(Query('content:apple'))
+		self.assertEqual({p.name for p in selection}, {'Few', 'Many'})
+		self.assertGreater(selection.scores[Path('Many')], selection.scores[Path('Few')])
+
+		plugin.preferences['max_results'] = 1
+		self.addCleanup(plugin.preferences.__setitem__, 'max_results', 0)
+		selection.search(Query('content:apple'))
+		self.assertEqual({p.name for p in selection}, {'Many'})
+
+		snippets = plugin.get_snippets(notebook, Query('banana or pea*'), [Path('None'), Path('Few')])
+		self.assertEqual(snippets, {
+			'None': '<b>banana</b>',
+			'Few': 'apple <b>pear</b> <b>pear</b> <b>pear</b> <b>pear</b>',
+		})
+
+	def testTrigramIndex(self):
+		'''Check substring search with the trigram index'''
+		from zim.search import SearchSelection, Query
+
+		plugin = PluginManager.load_plugin('indexed_fts')
+		for key in ('prefix_index', 'trigram_index'):
+			plugin.preferences[key] = True
+			self.addCleanup(plugin.preferences.__setitem__, key, False)
+		notebook = self.setUpNotebook(content={
+			'Foo': 'foo bar foobar\n',
+			'Boo': 'Boo baz\n',
+			'CJK': '汉字汉字 foo汉字\n',
+		})
+		notebook.index.check_and_update()
+		self.assertEqual(
+			notebook.index.get_property(indexed_fts.FTSIndexer.PLUGIN_NAME),
+			indexed_fts.FTSIndexer.db_format(True, True)
+		)
+
+		selection = SearchSelection(notebook)
+		for query, wanted in (
+			('content:foo*', {'Foo': 2, 'CJK': 1}),
+			('content:*oo', {'Foo': 1, 'Boo': 1}),
+			('content:f*r', {'Foo': 1}),
+			('content:*a*', {'Foo': 2, 'Boo': 1}),
+			('content:汉字', {'CJK': 3}),
+			('content:字', {'CJK': 3}),
+		):
+			selection.search(Query(query))
+			self.assertEqual(
+				{p.name: s for p, s in selection.scores.items()}, wanted,
+				'Wrong result for: %s' % query
+			)
+
+		# Updates need to remove the old text from the trigram table
+		page = notebook.get_page(Path('Boo'))
+		page.get_parsetree()
+		page.parse('wiki', 'Baz\n')
+		notebook.store_page(page)
+		selection.search(Query('content:*oo'))
+		self.assertEqual({p.name for p in selection}, {'Foo'})
+
+		# Changing options re-builds the tables
+		plugin.preferences['trigram_index'] = False
+		self.assertFalse(notebook.index.is_uptodate)
+		notebook.index.check_and_update()
+		self.assertEqual(
+			notebook.index.get_property(indexed_fts.FTSIndexer.PLUGIN_NAME),
+			indexed_fts.FTSIndexer.db_format(True, False)
+		)
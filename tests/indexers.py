@@ -6,6 +6,7 @@ from tests import os_native_path
 
 import os
 import sqlite3
+import threading
 
 from zim.base.naturalsort import natural_sort_key
 
@@ -17,6 +18,7 @@ from zim.notebook.index.files import FilesIndexer, TestFilesDBTable, FilesIndexC
 from zim.notebook.index.pages import PagesIndexer, TestPagesDBTable, PagesViewInternal
 from zim.notebook.index.links import LinksIndexer
 from zim.notebook.index.tags import TagsIndexer
+from zim.notebook.index.words import WordsIndexer
 from zim.formats.wiki import Parser as WikiParser
 
 
@@ -173,9 +175,8 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 
 		# 2. Check and update after new files appear
 		signals.clear()
-		self.create_files(
-			self.FILES_UPDATE + self.FILES_CHANGE
-		)
+		self.create_files(self.FILES_UPDATE)
+		self.change_files(self.FILES_CHANGE)
 		check_and_update_all()
 
 		files = set(f for f in self.FILES_UPDATE if not is_dir(f))
@@ -211,6 +212,10 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 			else:
 				self.root.file(name).write(self.PAGE_TEXT)
 
+	def change_files(self, files):
+		for name in files:
+			self.root.file(name).write(self.PAGE_TEXT + 'changed\n')
+
 	def remove_files(self, files):
 		for name in reversed(files):
 			if is_dir(name):
@@ -219,6 +224,57 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 				self.root.child(name).remove()
 
 
+class TestFilesIndexerUnchangedContent(tests.TestCase):
+
+	def runTest(self):
+		root = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		file = root.file('foo.txt')
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+
+		update_iter = buildUpdateIter(root)
+		db, indexer = update_iter.db, update_iter.files
+		for i in update_iter:
+			pass
+		node_id, = db.execute('SELECT id FROM files WHERE path=?', ('foo.txt',)).fetchone()
+
+		signals = tests.SignalLogger(indexer)
+
+		# Only mtime changes after initial index - no signal, but mtime updated
+		file._set_mtime(file.mtime() + 10)
+		indexer.update_file(node_id, file)
+		self.assertEqual(signals['file-row-changed'], [])
+		mtime, = db.execute('SELECT mtime FROM files WHERE id=?', (node_id,)).fetchone()
+		self.assertEqual(mtime, file.mtime())
+
+		# Content changes - signal, and digest recorded again when indexing
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 456\n')
+		indexer.update_file(node_id, file)
+		self.assertEqual(len(signals['file-row-changed']), 1)
+		file._set_mtime(file.mtime() + 10)
+		indexer.update_file(node_id, file)
+		self.assertEqual(len(signals['file-row-changed']), 1)
+
+		# Digest taken from etag after write
+		text, etag = file.read_with_etag()
+		etag = file.write_with_etag('Content-Type: text/x-zim-wiki\n\ntest 789\n', etag)
+		indexer.update_file(node_id, file, etag)
+		self.assertEqual(len(signals['file-row-changed']), 2)
+		file._set_mtime(file.mtime() + 10)
+		indexer.update_file(node_id, file)
+		self.assertEqual(len(signals['file-row-changed']), 2)
+
+		# Attachments are not read, only mtime is checked
+		attachment = root.file('foo/image.png')
+		attachment.write_binary(b'\x89PNG 123')
+		indexer.interactive_add_file(attachment)
+		node_id, = db.execute('SELECT id FROM files WHERE path=?', ('foo/image.png',)).fetchone()
+		attachment._set_mtime(attachment.mtime() + 10)
+		indexer.update_file(node_id, attachment)
+		self.assertEqual(len(signals['file-row-changed']), 4)
+		digest, = db.execute('SELECT digest FROM files WHERE id=?', (node_id,)).fetchone()
+		self.assertIsNone(digest)
+
+
 class TestFilesIndexerRobustForFolderMtime(TestFilesIndexer):
 	# Like TestFilesIndexer but explicitly hack the folder mtime in the database
 	# to not detect the folder structure change by mtime. Ensure robustness when
@@ -341,7 +397,7 @@ class TestPagesIndexer(TestPagesDBTable, tests.TestCase):
 		db = sqlite3.connect(':memory:')
 		db.row_factory = sqlite3.Row
 
-		file_indexer = tests.MockObject(methods=('connect',))
+		file_indexer = tests.MockObject(methods=('connect', 'set_node_digest'))
 
 		indexer = PagesIndexer(db, layout, file_indexer)
 
@@ -607,6 +663,41 @@ class TestTagsIndexer(tests.TestCase):
 		self.assertEqual(tagsources, wantedsources)
 
 
+class TestWordsIndexer(tests.TestCase):
+
+	def runTest(self):
+		# Two indexers on the same database, e.g. one in a background thread
+		db = sqlite3.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		indexer1 = WordsIndexer(db, tests.MockObject(methods=('connect',)))
+		indexer2 = WordsIndexer(db, tests.MockObject(methods=('connect',)))
+
+		indexer1.on_page_changed(None, {'id': 2}, WikiParser().parse('foo bar foo'))
+		indexer1.update()
+		self.assertWords(db, [('bar', 2, 1), ('foo', 2, 2)])
+
+		indexer2.on_page_changed(None, {'id': 2}, WikiParser().parse('bar'))
+		indexer2.update()
+		self.assertWords(db, [('bar', 2, 1)])
+		self.assertEqual([r[0] for r in db.execute('SELECT word FROM words')], ['bar'])
+
+		indexer1.on_page_changed(None, {'id': 3}, WikiParser().parse('foo'))
+		indexer1.update()
+		self.assertWords(db, [('bar', 2, 1), ('foo', 3, 1)])
+
+		indexer1.on_page_row_delete(None, {'id': 2})
+		indexer1.update()
+		self.assertEqual([r[0] for r in db.execute('SELECT word FROM words')], ['foo'])
+
+	def assertWords(self, db, wanted):
+		rows = [tuple(r) for r in db.execute(
+			'SELECT words.word, wordsources.source, wordsources.count '
+			'FROM wordsources JOIN words ON wordsources.word=words.id '
+			'ORDER BY words.word, wordsources.source'
+		)]
+		self.assertEqual(rows, wanted)
+
+
 from zim.notebook.index import IndexUpdateIter
 
 
@@ -648,3 +739,214 @@ class TestFullIndexer(TestFilesIndexer):
 		# 3. Check and update after files disappear
 		self.remove_files(self.FILES_UPDATE)
 		update_iter.check_and_update()
+
+
+
+@tests.slowTest
+class TestParallelIndexer(TestFullIndexer):
+
+	# Parallel update should result in exactly the same tables
+
+	TABLES = (
+		('files', 'id'),
+		('pages', 'id'),
+		('links', 'source, target'),
+		('tags', 'id'),
+		('tagsources', 'source, tag'),
+	)
+
+	def runTest(self):
+		self.root = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		self.create_files(self.FILES)
+
+		serial_iter = buildUpdateIter(self.root)
+		serial_iter.update()
+
+		parallel_iter = buildUpdateIter(self.root)
+		parallel_iter.update(jobs=2)
+		self.assertTrue(parallel_iter.is_uptodate())
+
+		for table, order in self.TABLES:
+			wanted = self.dump_table(serial_iter.db, table, order)
+			self.assertTrue(len(wanted) > 0, table)
+			self.assertEqual(self.dump_table(parallel_iter.db, table, order), wanted)
+
+	def dump_table(self, db, table, order):
+		return [tuple(r) for r in db.execute('SELECT * FROM %s ORDER BY %s' % (table, order))]
+
+
+class TestScannerIndexer(TestParallelIndexer):
+
+	# Scanning page content should result in the same tables as parsing
+
+	def runTest(self):
+		from zim.notebook.index.base import IndexerBase
+
+		class MockIndexer(IndexerBase):
+			pass
+
+		self.root = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		self.create_files(self.FILES)
+
+		scan_iter = buildUpdateIter(self.root)
+		self.assertTrue(scan_iter.pages.use_scanner)
+		scan_iter.update()
+
+		parse_iter = buildUpdateIter(self.root)
+		indexer = MockIndexer(parse_iter.db)
+		parse_iter.add_indexer(indexer)
+		self.assertFalse(parse_iter.pages.use_scanner)
+		parse_iter.update()
+
+		for table, order in self.TABLES:
+			wanted = self.dump_table(parse_iter.db, table, order)
+			self.assertTrue(len(wanted) > 0, table)
+			self.assertEqual(self.dump_table(scan_iter.db, table, order), wanted)
+
+		parse_iter.remove_indexer(indexer)
+		self.assertTrue(parse_iter.pages.use_scanner)
+
+
+@tests.slowTest
+class TestIndexUpdateThread(tests.TestCase):
+
+	PAGES = {
+		'foo': 'test 123\n[[bar]]\n@tagfoo\n',
+		'foo:sub': 'test 123\n[[foo]]\n',
+		'bar': 'test 123\n@tagbar @tagfoo\n',
+	}
+
+	def runTest(self):
+		folder = self.setUpFolder('notebook', mock=tests.MOCK_ALWAYS_REAL)
+		layout = FilesLayout(folder)
+		for name, text in self.PAGES.items():
+			file, x = layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\n' + text)
+
+		dbfolder = self.setUpFolder('db', mock=tests.MOCK_ALWAYS_REAL)
+		dbfolder.touch()
+		index = Index(dbfolder.file('index.db').path, layout)
+		self.assertIsNone(Index(':memory:', layout).update_thread())
+
+		signals = tests.SignalLogger(index.update_iter.pages, lambda n, o, a: a[0]['name'])
+		changed = tests.SignalLogger(index)
+
+		thread = index.update_thread()
+		self.assertIsNotNone(thread)
+		thread.update()
+		self.assertIsNone(thread.error)
+
+		# Listeners of main iter got the signals
+		self.assertEqual(
+			set(signals['page-row-inserted']),
+			{'foo', 'foo:sub', 'bar'}
+		)
+		self.assertEqual(
+			set(signals['page-changed']),
+			{'foo', 'foo:sub', 'bar'}
+		)
+		self.assertEqual(len(changed['changed']), 1)
+
+		# Data is the same as for an update in the main thread
+		self.assertTrue(index.is_uptodate)
+		other = buildUpdateIter(folder)
+		other.update()
+		for table in ('pages', 'links', 'tags', 'tagsources'):
+			self.assertEqual(
+				sorted(tuple(r) for r in index._db.execute('SELECT * FROM %s' % table)),
+				sorted(tuple(r) for r in other.db.execute('SELECT * FROM %s' % table)),
+			)
+
+
+@tests.slowTest
+class TestIndexUpdateThreadCancel(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder('notebook', mock=tests.MOCK_ALWAYS_REAL)
+		layout = FilesLayout(folder)
+		for name in ('foo', 'bar', 'baz'):
+			file, x = layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+
+		dbfolder = self.setUpFolder('db', mock=tests.MOCK_ALWAYS_REAL)
+		dbfolder.touch()
+		index = Index(dbfolder.file('index.db').path, layout)
+		signals = tests.SignalLogger(index.update_iter.pages, lambda n, o, a: a[0]['name'])
+
+		# Cancel while the thread is half way, the thread then commits
+		# pages that the main loop did not see yet
+		thread = index.update_thread()
+		inserted = threading.Event()
+
+		def on_page_row_inserted(o, row):
+			inserted.set()
+			thread._stop.wait(5)
+
+		thread.update_iter.pages.connect('page-row-inserted', on_page_row_inserted)
+		main_iter = iter(thread)
+		next(main_iter)
+		self.assertTrue(inserted.wait(5))
+		main_iter.close()
+
+		# Listeners of main iter got signals for all committed pages
+		names = set(r[0] for r in index._db.execute('SELECT name FROM pages WHERE id > 1'))
+		self.assertTrue(len(names) > 0)
+		self.assertEqual(set(signals['page-row-inserted']), names)
+
+
+@tests.slowTest
+class TestIndexWALAndReadOnlyConnection(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder('notebook', mock=tests.MOCK_ALWAYS_REAL)
+		layout = FilesLayout(folder)
+		for name in ('foo', 'bar', 'baz'):
+			file, x = layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+
+		dbfolder = self.setUpFolder('db', mock=tests.MOCK_ALWAYS_REAL)
+		dbfolder.touch()
+		index = Index(dbfolder.file('index.db').path, layout)
+		mode = index._db.execute('PRAGMA journal_mode').fetchone()[0]
+		self.assertEqual(mode.lower(), 'wal')
+
+		# Updates are committed in batches, nothing left pending after
+		index.update_iter.commit_batch_size = 2
+		index.update()
+		self.assertFalse(index._db.in_transaction)
+		self.assertEqual(index._db.batch_size, 1)
+
+		# Reader sees committed data, but can not write
+		ro = index.get_readonly_connection()
+		self.assertIs(index.get_readonly_connection(), ro)
+		self.assertEqual(
+			ro.execute('SELECT count(*) FROM pages WHERE id > 1').fetchone()[0], 3
+		)
+		with self.assertRaises(sqlite3.OperationalError):
+			ro.execute('DELETE FROM pages')
+
+		# Reader does not block on an open write transaction
+		index._db.execute('DELETE FROM tags')
+		self.assertTrue(index._db.in_transaction)
+		self.assertEqual(
+			ro.execute('SELECT count(*) FROM pages WHERE id > 1').fetchone()[0], 3
+		)
+		index._db.rollback()
+
+		# Single file updates are visible to readers, also while
+		# commits are batched for an update
+		index._db.set_batch(100)
+		file, x = layout.map_page(Path('new'))
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		index.update_file(file)
+		self.assertFalse(index._db.in_transaction)
+		reader = index._db_connect_readonly()
+		self.assertEqual(
+			reader.execute('SELECT count(*) FROM pages WHERE id > 1').fetchone()[0], 4
+		)
+		reader.close()
+		index._db.set_batch(1)
+
+		# Memory index falls back to the main connection
+		memindex = Index(':memory:', layout)
+		self.assertIs(memindex.get_readonly_connection(), memindex._db)
@@ -160,6 +160,10 @@ class TestPagesView(tests.TestCase):
 		for page in pages.walk(section):
 			self.assertTrue(page.ischild(section))
 
+		self.assertEqual(pages.n_walk(), len(names))
+		self.assertEqual(pages.n_walk(section), len(list(pages.walk(section))))
+		self.assertEqual(pages.n_walk(Path('Foo:Child1:GrandChild1')), 0)
+
 	def testPreviousAndNext(self):
 		# Mix of caps and small letters to trigger issues with sorting
 		names = ('AAA', 'BBB', 'ccc', 'ddd', 'EEE', 'FFF', 'ggg', 'hhh')
@@ -1008,3 +1008,61 @@ class TestTrash(tests.TestCase):
 		self.assertFalse(helper.trash(dir))
 
 		# How can we cause gio to give an error and test that case ??
+
+
+from zim.newfs.helpers import InotifyTreeWatcher, InotifyNotSupportedError
+
+try:
+	InotifyTreeWatcher(LocalFolder(os.getcwd()))
+except InotifyNotSupportedError:
+	inotify_supported = False
+else:
+	inotify_supported = True
+
+@tests.slowTest
+@tests.skipUnless(inotify_supported, 'inotify not supported on this platform')
+class TestInotifyTreeWatcher(tests.TestCase):
+
+	def setUp(self):
+		self.root = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		self.root.folder('sub').touch()
+		self.watcher = InotifyTreeWatcher(self.root)
+		self.watcher.start(mainloop=False)
+		self.addCleanup(self.watcher.stop)
+		self.signals = tests.SignalLogger(self.watcher, lambda n, o, a: a[0].relpath(self.root) if a else None)
+
+	def process_events(self):
+		while self.watcher.process_events(timeout=0.1):
+			pass
+
+	def runTest(self):
+		file = self.root.file('sub/foo.txt')
+		with open(file.path, 'w') as fh:
+			fh.write('test 123\n')
+		self.process_events()
+		self.assertIn('sub/foo.txt', self.signals['created'])
+		self.assertIn('sub/foo.txt', self.signals['changed'])
+
+		# new folders are watched as well
+		self.signals.clear()
+		os.mkdir(self.root.folder('new').path)
+		self.process_events()
+		self.assertEqual(self.signals['created'], ['new'])
+		self.root.file('new/bar.txt').touch()
+		self.process_events()
+		self.assertIn('new/bar.txt', self.signals['created'])
+
+		# hidden files are ignored
+		self.signals.clear()
+		self.root.file('.hidden').touch()
+		self.process_events()
+		self.assertEqual(self.signals['created'], [])
+
+		# removed
+		os.unlink(file.path)
+		self.process_events()
+		self.assertEqual(self.signals['removed'], ['sub/foo.txt'])
+
+		self.watcher.stop()
+		self.assertFalse(self.watcher.running)
+		self.assertEqual(self.watcher.process_events(), 0)
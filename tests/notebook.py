@@ -8,7 +8,10 @@ from tests import os_native_path
 
 
 import os
+import gc
+import json
 import time
+import sqlite3
 
 from zim.fs import adapt_from_oldfs
 from zim.newfs import LocalFile, LocalFolder, Folder, FileChangedError
@@ -21,6 +24,8 @@ from zim.parse.links import is_interwiki_keyword_re
 from zim.notebook import *
 from zim.notebook.notebook import NotebookConfig, IndexNotUptodateError, PageExistsError
 from zim.notebook.layout import FilesLayout, FILE_TYPE_PAGE_SOURCE, FILE_TYPE_ATTACHMENT
+from zim.notebook.operations import ongoing_operation
+from zim.notebook.parsetreecache import ParseTreeCache
 
 
 class TestNotebookInfo(tests.TestCase):
@@ -610,6 +615,25 @@ class TestNotebookSharedProperty(tests.TestCase):
 		self.assertTrue(notebook.cache_dir.ischild(notebook.folder))
 
 
+@tests.slowTest
+class TestNotebookParseCacheProperty(tests.TestCase):
+
+	def _create_notebook(self, parse_cache):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		config = NotebookConfig(folder.file('notebook.zim'))
+		config['Notebook']['parse_cache'] = parse_cache
+		config.write()
+		return Notebook.new_from_dir(folder)
+
+	def testDefaultOff(self):
+		notebook = self._create_notebook(parse_cache=False)
+		self.assertIsNone(notebook.parse_cache)
+
+	def testOn(self):
+		notebook = self._create_notebook(parse_cache=True)
+		self.assertIsInstance(notebook.parse_cache, ParseTreeCache)
+
+
 @tests.slowTest
 class TestEmptyNotebookFolderNotRemoved(tests.TestCase):
 	# Due to "clenup" on removing tmp files an emty folder can be removed
@@ -1619,6 +1643,26 @@ class TestIndexBackgroundCheck(tests.TestCase):
 		notebook.index.stop_background_check()
 
 
+class TestIndexCheckFilesAsync(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL)
+		notebook.index.check_and_update()
+		self.assertEqual(notebook.pages.n_all_pages(), 0)
+
+		# Change made outside of zim, e.g. as reported by InotifyTreeWatcher
+		file = notebook.folder.file('Foo.txt')
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		notebook.index.check_files_async(notebook, [file])
+		while notebook.index.background_check.running:
+			tests.gtk_process_events()
+		while ongoing_operation(notebook):
+			tests.gtk_process_events()
+
+		self.assertTrue(notebook.index.is_uptodate)
+		self.assertEqual([p.name for p in notebook.pages.list_pages()], ['Foo'])
+
+
 class TestBackgroundSave(tests.TestCase):
 
 	def runTest(self):
@@ -1642,6 +1686,200 @@ class TestBackgroundSave(tests.TestCase):
 		self.assertEqual(signals['stored-page'], [(page,)]) # post handler happened as well
 
 
+class TestStorePageIndexUpdate(tests.TestCase):
+
+	def setUp(self):
+		self.parsed = []
+		orig_parse = WikiParser.parse
+		def parse(parser, *arg, **kwarg):
+			self.parsed.append(arg[0])
+			return orig_parse(parser, *arg, **kwarg)
+		WikiParser.parse = parse
+		self.addCleanup(setattr, WikiParser, 'parse', orig_parse)
+
+	def testStoredTreeIsIndexed(self):
+		notebook = self.setUpNotebook()
+		page = notebook.get_page(Path('Page1'))
+		page.parse('wiki', 'test [[Foo]] @tag1\n')
+		self.parsed[:] = []
+		notebook.store_page(page)
+		self.assertEqual(self.parsed, []) # index did not parse again
+		self.assertIsNone(page._last_stored_tree) # not kept alive after indexing
+		links = [l.target.name for l in notebook.links.list_links(page)]
+		self.assertEqual(links, ['Foo'])
+		self.assertEqual([t.name for t in notebook.tags.list_tags(page)], ['tag1'])
+
+	def testTreeIgnoredForChangedFile(self):
+		notebook = self.setUpNotebook()
+		page = notebook.get_page(Path('Page1'))
+		page.source_file.write('Content-Type: text/x-zim-wiki\n\ntest [[Bar]]\n')
+		tree = WikiParser().parse('test [[Foo]]\n')
+		etag = ('bogus mtime', 'bogus md5')
+		notebook.index.update_file(page.source_file, tree, etag)
+		links = [l.target.name for l in notebook.links.list_links(page)]
+		self.assertEqual(links, ['Bar'])
+
+
+class TestPageLRUCache(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(
+			mock=tests.MOCK_ALWAYS_REAL,
+			content={'Page%i' % i: 'test 123\n' for i in range(5)}
+		)
+
+	def testKeepsPagesAlive(self):
+		lru = self.notebook.page_lru
+		page = self.notebook.get_page(Path('Page1'))
+		page_id = id(page)
+		del page
+		gc.collect()
+		self.assertIn('Page1', self.notebook._page_cache)
+		self.assertEqual(id(self.notebook.get_page(Path('Page1'))), page_id)
+		self.assertEqual((lru.hits, lru.misses), (1, 1))
+
+	def testBoundedByEntries(self):
+		lru = self.notebook.page_lru
+		lru.max_entries = 2
+		for i in range(5):
+			self.notebook.get_page(Path('Page%i' % i))
+		self.notebook.get_page(Path('Page3')) # Page3 most recent
+		self.notebook.get_page(Path('Page0'))
+		gc.collect()
+		self.assertEqual(len(lru), 2)
+		self.assertEqual(set(self.notebook._page_cache.keys()), {'Page3', 'Page0'})
+
+	def testBoundedByMemory(self):
+		lru = self.notebook.page_lru
+		for i in range(3):
+			self.notebook.get_page(Path('Page%i' % i)).get_parsetree()
+		self.notebook.get_page(Path('Page0')) # re-estimate now trees are loaded
+		self.assertGreater(lru.memory, 0)
+		lru.max_memory = lru.memory * 2 // 3 # room for two pages
+		self.notebook.get_page(Path('Page1'))
+		self.assertLessEqual(lru.memory, lru.max_memory)
+		self.assertNotIn('Page2', lru) # least recently used
+		self.assertIn('Page0', lru)
+
+	def testPagesReadOnceCountForMemory(self):
+		lru = self.notebook.page_lru
+		lru.max_memory = 1
+		for i in range(5):
+			self.notebook.get_page(Path('Page%i' % i)).get_parsetree()
+		self.assertLessEqual(len(lru), 2)
+
+	def testCachedPageChecksSource(self):
+		page = self.notebook.get_page(Path('Page1'))
+		page.get_parsetree()
+		id1 = id(page)
+		page.source_file.write('Content-Type: text/x-zim-wiki\n\nnew text\n')
+		del page
+		page = self.notebook.get_page(Path('Page1'))
+		self.assertEqual(id(page), id1)
+		self.assertIn('new text', page.dump('plain')[0])
+
+
+class TestParseTreeCache(tests.TestCase):
+
+	def setUp(self):
+		self.parsed = []
+		orig_parse = WikiParser.parse
+		def parse(parser, *arg, **kwarg):
+			self.parsed.append(arg[0])
+			return orig_parse(parser, *arg, **kwarg)
+		WikiParser.parse = parse
+		self.addCleanup(setattr, WikiParser, 'parse', orig_parse)
+
+		self.notebook = self.setUpNotebook(
+			mock=tests.MOCK_ALWAYS_REAL,
+			content={'Page1': 'test **123**\n', 'Page2': 'foo [[bar]]\n'}
+		)
+		dbpath = self.notebook.cache_dir.file('parsetree.db').path
+		self.notebook.parse_cache = ParseTreeCache(dbpath)
+		self.addCleanup(self.notebook.parse_cache.close)
+		self.parsed[:] = [] # ignore parsing by the index
+
+	def getParseTree(self, name):
+		# New page object to bypass the page cache
+		self.notebook._page_cache.clear()
+		return self.notebook.get_page(Path(name)).get_parsetree()
+
+	def testParseTreeFromCache(self):
+		cache = self.notebook.parse_cache
+		tree = self.getParseTree('Page1')
+		self.assertEqual(len(self.parsed), 1)
+		self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+		self.parsed[:] = []
+		cached = self.getParseTree('Page1')
+		self.assertEqual(self.parsed, [])
+		self.assertEqual((cache.hits, cache.misses), (1, 1))
+		self.assertEqual(cached.tostring(), tree.tostring())
+		self.assertEqual(dict(cached.meta), dict(tree.meta))
+
+		# Etag from cache is valid for storing the page
+		self.notebook._page_cache.clear()
+		page = self.notebook.get_page(Path('Page1'))
+		page.get_parsetree()
+		self.assertEqual(cache.hits, 2)
+		page.parse('wiki', 'new text\n')
+		self.notebook.store_page(page)
+
+		# Changed file invalidates the entry
+		self.parsed[:] = []
+		tree = self.getParseTree('Page1')
+		self.assertEqual(len(self.parsed), 1)
+		self.assertIn('new text', tree.tostring())
+
+	def testSameSizeAndMtimeChangeInvalidates(self):
+		cache = self.notebook.parse_cache
+		self.getParseTree('Page1')
+		file = self.notebook.get_page(Path('Page1')).source_file
+		mtime = file.mtime()
+		text = file.read()
+		file.write(text.replace('123', '456'))
+		file._set_mtime(mtime) # e.g. on a file system with 1 sec resolution
+
+		self.parsed[:] = []
+		tree = self.getParseTree('Page1')
+		self.assertEqual(len(self.parsed), 1)
+		self.assertIn('456', tree.tostring())
+
+	def testStoredAsJSON(self):
+		self.getParseTree('Page2')
+		self.notebook.parse_cache.close()
+		db = sqlite3.connect(self.notebook.parse_cache.dbpath)
+		data, = db.execute('SELECT data FROM parsetrees').fetchone()
+		db.close()
+		self.assertIn('tokens', json.loads(data.decode('UTF-8')))
+
+	def testCacheSurvivesReopen(self):
+		dbpath = self.notebook.parse_cache.dbpath
+		self.getParseTree('Page2')
+		self.notebook.parse_cache.close()
+
+		self.notebook.parse_cache = ParseTreeCache(dbpath)
+		self.addCleanup(self.notebook.parse_cache.close)
+		self.parsed[:] = []
+		self.getParseTree('Page2')
+		self.assertEqual(self.parsed, [])
+
+	def testLRUEviction(self):
+		cache = self.notebook.parse_cache
+		self.getParseTree('Page1')
+		self.getParseTree('Page2')
+		page1 = self.notebook.get_page(Path('Page1'))
+		self.assertIsNotNone(cache.get(page1.source_file, page1.format)) # touch Page1
+
+		cache.max_size = cache._total - 1 # one entry too much
+		file, folder = self.notebook.layout.map_page(Path('Page3'))
+		file.write('Content-Type: text/x-zim-wiki\n\ntest\n')
+		self.getParseTree('Page3')
+		page2 = self.notebook.get_page(Path('Page2'))
+		self.assertIsNone(cache.get(page2.source_file, page2.format))
+		self.assertIsNotNone(cache.get(page1.source_file, page1.format))
+
+
 class TestFilesLayout(tests.TestCase):
 
 	def _test_page_vs_not_a_page(self, folder, layout, pagefile, notapagefile):
@@ -19,6 +19,7 @@ from zim.parse.simpletree import *
 from zim.parse.tokenlist import EndOfTokenListError, TokenBuilder, TokenParser, \
 	collect_until_end_token, filter_token, reverseTopLevelLists, \
 	testTokenStream, tokens_to_text, topLevelLists
+from zim.parse.tokenarray import TokenArray, TokenArrayBuilder, FrozenAttrib
 from zim.formats import ParseTreeBuilder, PARAGRAPH
 
 
@@ -470,6 +471,57 @@ class TestTokenParser(tests.TestCase):
 		self.assertEqual(revtokens, tokens)
 
 
+class TestTokenArray(tests.TestCase):
+
+	def testBuilder(self):
+		tree = tests.new_parsetree()
+		builder = TokenArrayBuilder()
+		TokenParser(builder).parse(tree.iter_tokens())
+		array = builder.get_tokenarray()
+
+		self.assertEqual(list(array.iter_tokens()), list(tree.iter_tokens()))
+		self.assertEqual(len(array), len(list(tree.iter_tokens())))
+		self.assertEqual(''.join(array.iter_text()), ''.join(tree.iter_text()))
+
+		newtree = ParseTreeBuilder()
+		TokenParser(newtree).parse(array)
+		self.assertEqual(newtree.get_parsetree().tostring(), tree.tostring())
+
+	def testSharedTokens(self):
+		array = TokenArray([
+			('zim-tree', None),
+			('link', {'href': 'Foo'}), ('T', 'Foo'), (END, 'link'),
+			('T', ' and '),
+			('link', {'href': 'Foo'}), ('T', 'again\n'), (END, 'link'),
+			(END, 'zim-tree'),
+		])
+		tokens = list(array)
+		self.assertEqual(tokens[0], ('zim-tree', None))
+		self.assertIs(tokens[1][1], tokens[5][1])
+		self.assertIs(tokens[3], tokens[7])
+		self.assertIsInstance(tokens[1][1], FrozenAttrib)
+		with self.assertRaises(TypeError):
+			tokens[1][1]['href'] = 'Bar'
+
+		attrib = tokens[1][1].copy()
+		attrib['href'] = 'Bar'
+		self.assertEqual(list(array)[1], ('link', {'href': 'Foo'}))
+
+		self.assertEqual(
+			list(array.iter_start_tokens('link')),
+			[('link', {'href': 'Foo'})] * 2
+		)
+
+	def testPickle(self):
+		import pickle
+		array = TokenArray([
+			('zim-tree', None), ('h', {'level': 1}), ('T', 'Head\n'), (END, 'h'), (END, 'zim-tree')
+		])
+		newarray = pickle.loads(pickle.dumps(array))
+		self.assertEqual(newarray, array)
+		self.assertIs(list(newarray)[1][1], list(array)[1][1])
+
+
 class TestFunctions(tests.TestCase):
 
 	def testCollectTokens(self):
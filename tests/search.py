@@ -3,6 +3,11 @@
 
 import tests
 
+import io
+import re
+import sys
+import json
+
 from zim.search import *
 from zim.notebook import Path
 from zim.plugins import indexed_fts
@@ -261,6 +266,306 @@ class TestSearchIndexed(TestSearch):
 		TestSearch.runTest(self)
 
 
+class TestSearchWordsIndex(tests.TestCase):
+	'''Test content search using the words index gives the same
+	results as searching the page contents
+	'''
+
+	QUERIES = (
+		'foo', 'foo bar', '+TODO -bar', 'TODO or bar', 'TODO not bar',
+		'content:foo', 'content:foo*', 'content:*oo', 'content:*o*',
+		'content:f*o', 'content:*f*o*', 'content:"foo bar"', 'content:foo-bar', '-content:foo',
+		'content:-foo', 'content:"foo" or -content:bar', 'content:汉字',
+		'content:字', 'Namespace: "TaskList" fix',
+	)
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+		page = self.notebook.get_page(Path('Test:CJK'))
+		page.parse('wiki', '汉字汉字 foo汉字 foo-bar f-o\n')
+		self.notebook.store_page(page)
+		self.notebook.index.check_and_update()
+
+	def search(self, string):
+		results = SearchSelection(self.notebook)
+		results.search(Query(string))
+		return set(results), results.scores
+
+	def testSameResults(self):
+		with_index = [self.search(q) for q in self.QUERIES]
+
+		orig = SearchSelection._content_index_patterns
+		SearchSelection._content_index_patterns = lambda s, string: ([], False)
+		self.addCleanup(setattr, SearchSelection, '_content_index_patterns', orig)
+		without_index = [self.search(q) for q in self.QUERIES]
+
+		for query, (results, scores), (wanted, wantedscores) in \
+			zip(self.QUERIES, with_index, without_index):
+			self.assertEqual(results, wanted, 'Results differ for: %s' % query)
+			if not '*' in query:
+				# wildcards can match across punctuation, so counts may differ
+				self.assertEqual(scores, wantedscores, 'Scores differ for: %s' % query)
+
+		self.assertIn(Path('Test:CJK'), with_index[self.QUERIES.index('content:字')][0])
+
+	def testPagesNotOpened(self):
+		opened = []
+		orig = self.notebook.get_page
+		def get_page(path):
+			opened.append(path)
+			return orig(path)
+		self.notebook.get_page = get_page
+
+		results, scores = self.search('content:foo')
+		self.assertTrue(results)
+		self.assertEqual(opened, [])
+
+		self.notebook.index.flag_reindex() # fall back to reading pages
+		results, scores = self.search('content:foo')
+		self.assertFalse(self.notebook.index.is_uptodate)
+		self.assertTrue(opened)
+
+	def testInverseTermRemovesContentMatches(self):
+		# Pages that match on name first must still be removed from AND
+		# results when their content does not match
+		results, scores = self.search('-bar')
+		self.assertTrue(results)
+		for path in results:
+			text = ''.join(self.notebook.get_page(path).dump('plain'))
+			self.assertIsNone(re.search(r'\bbar\b', text, re.I), 'Page contains "bar": %s' % path)
+
+	def testUnusedWordsRemoved(self):
+		db = self.notebook.index._db
+		def words():
+			return set(r[0] for r in db.execute('SELECT word FROM words'))
+
+		self.assertIn('汉字汉字', words())
+		self.assertIn('foo', words())
+
+		page = self.notebook.get_page(Path('Test:CJK'))
+		page.parse('wiki', 'foo uniquewordxyz\n')
+		self.notebook.store_page(page)
+		self.assertNotIn('汉字汉字', words()) # only used in this page
+		self.assertIn('foo', words()) # still used in other pages
+		self.assertIn('uniquewordxyz', words())
+
+		self.notebook.delete_page(Path('Test:CJK'))
+		self.assertNotIn('uniquewordxyz', words())
+		self.assertIn('foo', words())
+
+
+class TestSearchParallel(tests.TestCase):
+	'''Test content search with worker processes gives the same
+	results as a serial search
+	'''
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL, content=tests.FULL_NOTEBOOK)
+		self.notebook.index.flag_reindex() # force reading page contents
+
+	def search(self, string, jobs=None, callback=None):
+		results = SearchSelection(self.notebook)
+		results.search(Query(string), callback=callback, jobs=jobs)
+		return results
+
+	def testSameResults(self):
+		for query in TestSearchWordsIndex.QUERIES:
+			wanted = self.search(query)
+			results = self.search(query, jobs=2)
+			self.assertEqual(set(results), set(wanted), 'Results differ for: %s' % query)
+			self.assertEqual(results.scores, wanted.scores, 'Scores differ for: %s' % query)
+
+	def testCallbackAndCancel(self):
+		wanted = []
+		self.search('content:foo', callback=lambda s, p: wanted.append(p) or True)
+
+		seen = []
+		self.search('content:foo', jobs=2, callback=lambda s, p: seen.append(p) or True)
+		self.assertEqual(seen, wanted) # same order
+
+		seen = []
+		def callback(selection, path):
+			seen.append(path)
+			return path is None
+		results = self.search('content:foo', jobs=2, callback=callback)
+		self.assertTrue(results.cancelled)
+		self.assertEqual(seen, wanted[:len(seen)])
+		self.assertLess(len(seen), len(wanted))
+
+
+class TestSearchPlan(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+
+	def testOrderBySelectivity(self):
+		selection = SearchSelection(self.notebook)
+		selection.search(Query('Name: *a* -Name: *foo* Tag: tags'))
+		wanted = set(selection)
+
+		labels = [step[1] for step in selection.plan]
+		self.assertEqual(labels, ['AND', 'tag: tags', 'name: *a*', 'NOT name: *foo*'])
+		self.assertEqual(selection.plan[1][2], 2) # estimate for tag
+		self.assertEqual(len(selection.format_plan()), len(labels))
+
+		# Same results when typed in a different order
+		selection.search(Query('Tag: tags Name: *a* -Name: *foo*'))
+		self.assertEqual(set(selection), wanted)
+
+	def testInverseDoesNotWalk(self):
+		walked = []
+		orig = self.notebook.pages.walk
+		def walk(*a):
+			walked.append(a)
+			return orig(*a)
+		self.notebook.pages.walk = walk
+
+		selection = SearchSelection(self.notebook)
+		selection.search(Query('-Name: *tags Tag: tags'))
+		self.assertTrue(selection)
+		self.assertNotIn(Path('Test:tags'), selection)
+		self.assertEqual(walked, [])
+
+
+class TestSearchCache(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+		self.cache = get_search_cache(self.notebook.index)
+
+	def search(self, string):
+		selection = SearchSelection(self.notebook)
+		selection.search(Query(string))
+		return selection
+
+	def testCachedResults(self):
+		wanted = self.search('foo')
+		selection = self.search('foo')
+		self.assertEqual(selection.plan[0][1], 'cached')
+		self.assertEqual(set(selection), set(wanted))
+		self.assertEqual(selection.scores, wanted.scores)
+		self.assertEqual(self.cache.hits, 1)
+
+		# Order of AND terms does not matter
+		self.search('foo -bar')
+		selection = self.search('-bar foo')
+		self.assertEqual(self.cache.hits, 2)
+
+		# Changing the index invalidates the cache
+		page = self.notebook.get_page(Path('Test:New'))
+		page.parse('wiki', 'foo\n')
+		self.notebook.store_page(page)
+		selection = self.search('foo')
+		self.assertEqual(self.cache.hits, 2)
+		self.assertIn(Path('Test:New'), selection)
+
+	def testRefinedResults(self):
+		for previous, query in (
+			('foo', 'foo bar'),
+			('TODO', 'TODO -bar'),
+			('Tag: tags', 'Tag: tags Name: *a*'),
+			('foo or bar', 'foo or bar TODO'),
+			('foo', 'foo nonexistingword foo'),
+		):
+			self.cache.clear()
+			wanted = self.search(query)
+			self.cache.clear()
+			self.search(previous)
+			refined = self.cache.refined
+			selection = self.search(query)
+			self.assertEqual(self.cache.refined, refined + 1)
+			self.assertEqual(set(selection), set(wanted), 'Results differ for: %s' % query)
+			self.assertEqual(selection.scores, wanted.scores, 'Scores differ for: %s' % query)
+
+	def testLRU(self):
+		self.cache.max_entries = 2
+		for query in ('foo', 'bar', 'baz', 'foo'):
+			self.search(query)
+		self.assertEqual(self.cache.hits, 0)
+
+
+class TestSearchStats(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+
+	def testStats(self):
+		selection = SearchSelection(self.notebook)
+		selection.search(Query('"foo bar"')) # phrase needs parsing
+		stats = selection.stats
+		self.assertGreater(stats['pages_scanned'], 0)
+		self.assertEqual(stats['pages_parsed'], stats['pages_scanned'])
+		self.assertIsNone(stats['cache'])
+		self.assertIn('content', stats['phases'])
+		self.assertGreaterEqual(stats['elapsed'], stats['phases']['content'])
+
+		selection.search(Query('foo'))
+		stats = selection.stats
+		self.assertEqual(stats['pages_parsed'], 0)
+		self.assertGreater(stats['index_hits'], 0)
+
+		selection.search(Query('foo'))
+		self.assertEqual(selection.stats['cache'], 'hit')
+		self.assertEqual(selection.stats['pages_scanned'], 0)
+
+	def testSnippets(self):
+		selection = SearchSelection(self.notebook)
+		selection.search(Query('foo'))
+		snippets = selection.get_snippets(selection)
+		self.assertTrue(snippets)
+		for name, snippet in snippets.items():
+			self.assertIn('foo', snippet.lower())
+
+
+class TestSearchCommand(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(
+			mock=tests.MOCK_ALWAYS_REAL, content=tests.FULL_NOTEBOOK)
+
+	def run_command(self, *args):
+		from zim.main import build_command
+		cmd = build_command(('--search', self.notebook.folder.path) + args)
+		with tests.LoggingFilter('zim', 'Searching for'):
+			stdout = sys.stdout
+			sys.stdout = io.StringIO()
+			try:
+				cmd.run()
+				return sys.stdout.getvalue().splitlines()
+			finally:
+				sys.stdout = stdout
+
+	def testJSON(self):
+		selection = SearchSelection(self.notebook)
+		selection.search(Query('foo'))
+
+		lines = self.run_command('foo', '--format', 'json', '--snippets')
+		records = [json.loads(line) for line in lines]
+		stats = records.pop()['stats']
+		self.assertEqual(
+			set(r['page'] for r in records),
+			set(p.name for p in selection)
+		)
+		self.assertEqual(stats['results'], len(selection))
+		self.assertTrue(all(r['score'] > 0 for r in records))
+		self.assertTrue(all('foo' in r['snippet'].lower() for r in records if r['snippet']))
+
+	def testLimit(self):
+		lines = self.run_command('foo', '--limit', '2', '--with-scores')
+		self.assertEqual(len(lines), 2)
+		scores = [int(line.split('\t')[0]) for line in lines]
+		self.assertEqual(scores, sorted(scores, reverse=True))
+
+	def testStream(self):
+		wanted = self.run_command('foo*')
+		lines = self.run_command('foo*', '--stream')
+		self.assertEqual(sorted(lines), sorted(wanted))
+
+		lines = self.run_command('foo*', '--stream', '--limit', '1')
+		self.assertEqual(len(lines), 1)
+		self.assertIn(lines[0], wanted)
+
+
 class TestUnicode(tests.TestCase):
 
 	def runTest(self):
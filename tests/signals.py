@@ -76,6 +76,24 @@ class TestEmitter(tests.TestCase):
 		emitter.emit('first', seq)
 		self.assertEqual(seq, ['CLOSURE', 'NORMAL', 'AFTER'])
 
+	def testEmitExcluding(self):
+		emitter = Emitter()
+		seen = []
+
+		class Listener(object):
+			def __init__(self, name):
+				self.name = name
+
+			def on_bar(self, o, a):
+				seen.append((self.name, a))
+
+		one, two = Listener('one'), Listener('two')
+		emitter.connect('bar', one.on_bar)
+		emitter.connect('bar', two.on_bar)
+		emitter.emit_excluding('bar', [one], 'test')
+		self.assertEqual(seen, [('two', 'test')])
+		self.assertEqual(emitter.state, 'DO bar test') # default handler is not excluded
+
 
 class Emitter(SignalEmitter):
 
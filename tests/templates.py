@@ -779,6 +779,34 @@ class TestTemplate(tests.TestCase):
 		self.assertEqual(output, [])
 
 
+class TestTemplateCache(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		file = folder.file('template.html')
+		file.write('[% foo %]\n')
+
+		def process(templ):
+			output = []
+			templ.process(output, {'foo': 'FOO'})
+			return ''.join(output)
+
+		# Same file gives same parse result and compiled template
+		templ1 = Template(file)
+		templ2 = Template(file)
+		self.assertIs(templ1.parts, templ2.parts)
+		self.assertIs(templ1._get_processor(), templ2._get_processor())
+		self.assertEqual(process(templ1), 'FOO\n')
+		self.assertEqual(process(templ1), 'FOO\n')
+
+		# Changed file is parsed again
+		file.write('[% foo %] [% foo %]\n')
+		templ3 = Template(file)
+		self.assertIsNot(templ3.parts, templ1.parts)
+		self.assertEqual(process(templ3), 'FOO FOO\n')
+		self.assertEqual(process(templ1), 'FOO\n') # old object not affected
+
+
 class TestTemplateInclude(tests.TestCase):
 
 	def setUp(self):
@@ -798,6 +826,23 @@ class TestTemplateInclude(tests.TestCase):
 		templ.process(output, {})
 		self.assertEqual(output, ['INCLUDED TEXT ', 'Test'])
 
+	def testProcessIter(self):
+		self.file.write('[% foo="Test" %][% INCLUDE "include.html" %]')
+		templ = Template(self.file)
+
+		def on_process(templ, output, context):
+			context['foo'] = 'Signal'
+			output.append('HEAD ')
+
+		templ.connect('process', on_process)
+		output = []
+		templ.process(output, {})
+		self.assertEqual(output, ['HEAD ', 'INCLUDED TEXT ', 'Test'])
+
+		iter = templ.process_iter({})
+		self.assertEqual(next(iter), 'HEAD ')
+		self.assertEqual(list(iter), ['INCLUDED TEXT ', 'Test'])
+
 	def testIncludeFromParentDirNotAllowed(self):
 		# test 'INCLUDE path' does not allow include from ../../ something
 		self.file.write('[% foo="Test" %][% INCLUDE "../passwd.txt" %]')
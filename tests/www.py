@@ -7,12 +7,15 @@ import tests
 
 import sys
 import os
+import threading
 from io import BytesIO
 import logging
 import wsgiref.validate
 import wsgiref.handlers
 import base64
 
+from concurrent.futures import ThreadPoolExecutor
+
 from zim.www import WWWInterface
 from zim.notebook import Path
 
@@ -178,3 +181,66 @@ class TestWWWInterfaceTemplateResources(TestWWWInterface):
 	def runTest(self):
 		'Test WWW interface with a template with resources.'
 		TestWWWInterface.runTest(self)
+
+
+class TestWWWInterfaceRenderError(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(content={'Foo': 'test 123\n'})
+		notebook.index.check_and_update()
+		interface = WWWInterface(notebook, template='Default')
+
+		def render_page_iter(page):
+			raise ValueError('Render failed')
+			yield ''
+
+		interface.render_page_iter = render_page_iter
+
+		for command in ('HEAD', 'GET'):
+			environ = {
+				'REQUEST_METHOD': command,
+				'SCRIPT_NAME': '',
+				'PATH_INFO': '/Foo.html',
+				'QUERY_STRING': '',
+			}
+			status = []
+			with tests.LoggingFilter('zim.www', 'Unexpected error'):
+				body = b''.join(interface(environ, lambda s, h: status.append(s)))
+			self.assertEqual(status, ['500 Internal Server Error'])
+			if command == 'GET':
+				self.assertEqual(body, b'Internal Server Error')
+
+
+@tests.slowTest
+class TestThreadPoolServer(tests.TestCase):
+
+	def runTest(self):
+		from urllib.request import urlopen
+		from zim.www import make_server, ThreadPoolWSGIServer
+
+		notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL, content=tests.FULL_NOTEBOOK)
+		notebook.index.check_and_update()
+		httpd = make_server(notebook, port=0, public=False, threads=4)
+		self.assertIsInstance(httpd, ThreadPoolWSGIServer)
+		thread = threading.Thread(target=httpd.serve_forever)
+		thread.start()
+
+		url = 'http://localhost:%i' % httpd.server_port
+		paths = ['/', '/Test/', '/Test/foo.html', '/roundtrip.html', '/Parent/Daughter.html'] * 4
+		try:
+			with ThreadPoolExecutor(8) as pool:
+				responses = list(pool.map(lambda p: urlopen(url + p).read(), paths))
+		finally:
+			httpd.shutdown()
+			httpd.server_close()
+			thread.join()
+
+		for path, body in zip(paths, responses):
+			self.assertIn(b'<html', body, path)
+
+		# Rendering in request threads gives the same result
+		self.assertEqual(responses[:5], responses[5:10])
+		self.assertIn(b'Granddaughter', responses[4])
+
+		# Index views of the notebook still work in the main thread
+		self.assertEqual(notebook.pages.lookup_from_user_input('Test:Foo'), Path('Test:foo'))
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Measure export throughput with the index() template function, with the
+# index walked for each page or shared between pages of the export
+#
+# Usage: time_export.py [NOTEBOOK] [N_PAGES]
+#
+# Without a notebook, a new one is generated in a temporary folder by
+# "tools/create_large_test_notebook.py". Only the first N_PAGES pages are
+# exported (default 100), but the index covers the whole notebook.
+
+import sys
+sys.path.insert(0, '.')
+
+import os
+import time
+import tempfile
+import subprocess
+
+from itertools import islice
+
+from zim.base import MovingWindowIter
+from zim.newfs import LocalFolder, LocalFile
+from zim.notebook import Notebook, init_notebook
+from zim.export import build_notebook_exporter
+from zim.export.selections import AllPages
+
+
+TEMPLATE = 'data/templates/html/Default_with_index.html'
+
+
+def create_notebook(root):
+	path = os.path.join(root, 'notebook')
+	subprocess.run(
+		[sys.executable, 'tools/create_large_test_notebook.py', path],
+		stdout=subprocess.DEVNULL, check=True
+	)
+	init_notebook(LocalFolder(path))
+	return path
+
+
+def time_export(notebook, output, n_pages, shared_index):
+	pages = AllPages(notebook)
+	exporter = build_notebook_exporter(output, 'html', LocalFile(os.path.abspath(TEMPLATE)))
+	if not shared_index:
+		exporter._get_export_index = lambda pages: pages.index # walk for each page
+
+	start = time.time()
+	for prev, page, next in islice(MovingWindowIter(pages), n_pages):
+		exporter.export_page(notebook, page, pages, prevpage=prev, nextpage=next)
+	return time.time() - start
+
+
+def main(path, n_pages):
+	notebook = Notebook.new_from_dir(LocalFolder(path))
+	start = time.time()
+	notebook.index.check_and_update()
+	print('Notebook: %s (%i pages, index update %.1f sec)' % (
+		path, notebook.pages.n_all_pages(), time.time() - start))
+	print('')
+	print('Index\tTime [sec]\tmsec/page')
+	with tempfile.TemporaryDirectory() as output:
+		for name, shared_index in (('walk', False), ('shared', True)):
+			t = time_export(notebook, LocalFolder(output).folder(name), n_pages, shared_index)
+			print('%s\t%.2f\t\t%.1f' % (name, t, 1E+3 * t / n_pages))
+
+
+if __name__ == '__main__':
+	n_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+	if len(sys.argv) > 1:
+		main(sys.argv[1], n_pages)
+	else:
+		with tempfile.TemporaryDirectory() as root:
+			main(create_notebook(root), n_pages)
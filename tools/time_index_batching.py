@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+# Measure index update throughput for different commit batch sizes
+#
+# Usage: time_index_batching.py [N_PAGES]
+
+import sys
+sys.path.insert(0, '.')
+
+import os
+import time
+import tempfile
+
+from zim.newfs import LocalFolder
+from zim.notebook.layout import FilesLayout
+from zim.notebook.index import Index, IndexUpdateIter
+
+
+content = '''\
+Content-Type: text/x-zim-wiki
+Wiki-Format: zim 0.26
+
+====== Page {i} ======
+Some **test** data with a @tag{tag} and a link to [[Page {link}]]
+
+[ ] A task for page {i}
+'''
+
+
+def setup(root, n_pages):
+	folder = LocalFolder(root).folder('notebook')
+	for i in range(n_pages):
+		subfolder = folder.folder('Section_%i' % (i // 100))
+		subfolder.file('Page_%i.txt' % i).write(
+			content.format(i=i, tag=i % 10, link=(i * 7) % n_pages)
+		)
+	return folder
+
+
+def time_update(folder, dbpath, batch_size):
+	if os.path.exists(dbpath):
+		os.remove(dbpath)
+	for ext in ('-wal', '-shm'):
+		if os.path.exists(dbpath + ext):
+			os.remove(dbpath + ext)
+
+	index = Index(dbpath, FilesLayout(folder))
+	index.update_iter.commit_batch_size = batch_size
+	index.update_iter.commit_max_delay = None
+	start = time.time()
+	index.update()
+	return time.time() - start
+
+
+if __name__ == '__main__':
+	n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+	batch_sizes = (1, 10, IndexUpdateIter.COMMIT_BATCH_SIZE, 1000)
+
+	with tempfile.TemporaryDirectory() as root:
+		folder = setup(root, n_pages)
+		dbpath = os.path.join(root, 'index.db')
+
+		print("Pages: %i" % n_pages)
+		print('')
+		print("Batch\tTime [sec]\tPages/sec")
+		for batch_size in batch_sizes:
+			t = time_update(folder, dbpath, batch_size)
+			print("%i\t%.2f\t\t%.0f" % (batch_size, t, n_pages / t))
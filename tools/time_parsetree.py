@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+# Compare memory use and throughput of ParseTree and CompactParseTree
+#
+# Usage: time_parsetree.py [FILE]
+#
+# Defaults to the "tests/data/formats/wiki.txt" test data
+
+import sys
+sys.path.insert(0, '.')
+
+import gc
+import timeit
+import tracemalloc
+
+import zim.formats
+from zim.formats import StubLinker
+
+
+N_TREES = 100
+REPS = 5
+PASSES = 100
+
+
+def measure_memory(parse, text):
+	# Keep a number of trees alive, so shared data is accounted for
+	gc.collect()
+	tracemalloc.start()
+	trees = [parse(text) for i in range(N_TREES)]
+	size, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return size / N_TREES
+
+
+def measure_time(func):
+	result = timeit.Timer(func).repeat(REPS, PASSES)
+	return 1E+3 * min(result) / PASSES
+
+
+def main(file):
+	with open(file) as fh:
+		text = fh.read()
+
+	parser = zim.formats.get_parser('wiki')
+	dumper = zim.formats.get_dumper('wiki')
+	html_dumper = zim.formats.get_dumper('html', linker=StubLinker())
+
+	variants = (
+		('ParseTree', lambda t: parser.parse(t)),
+		('CompactParseTree', lambda t: parser.parse(t, compact=True)),
+	)
+
+	print('Input: %s (%i bytes)' % (file, len(text)))
+	print('')
+	print('Tree\tMemory [kB/tree]')
+	for name, parse in variants:
+		print('%s\t%.1f' % (name, measure_memory(parse, text) / 1024))
+
+	print('')
+	print('Tree\tParse\tTokens\tCopy\tWiki\tHTML [msec/pass]')
+	for name, parse in variants:
+		tree = parse(text)
+		print('%s\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f' % (
+			name,
+			measure_time(lambda: parse(text)),
+			measure_time(lambda: sum(1 for t in tree.iter_tokens())),
+			measure_time(lambda: tree.copy()),
+			measure_time(lambda: dumper.dump(tree)),
+			measure_time(lambda: html_dumper.dump(tree)),
+		))
+
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		main(sys.argv[1])
+	else:
+		main('tests/data/formats/wiki.txt')
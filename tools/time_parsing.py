@@ -6,18 +6,21 @@
 import sys
 sys.path.insert(0, '.')
 
+import os
+
 import zim.formats
-import zim.fs
+from zim.newfs import LocalFile
 import tests
 
 def setup():
-	global parser, dumper
-	parser = zim.formats.get_parser('wiki')
+	global parser, single_pass_parser, dumper
+	parser = zim.formats.get_parser('wiki', engine='regex')
+	single_pass_parser = zim.formats.get_parser('wiki', engine='single-pass')
 	dumper = zim.formats.get_dumper('wiki')
 
 	global wikitext, parsetree
-	wikitext = zim.fs.File('tests/data/formats/wiki.txt').read()
-	xml = zim.fs.File('tests/data/formats/parsetree.xml').read().rstrip('\n')
+	wikitext = LocalFile(os.path.abspath('tests/data/formats/wiki.txt')).read()
+	xml = LocalFile(os.path.abspath('tests/data/formats/parsetree.xml')).read().rstrip('\n')
 	parsetree = tests.new_parsetree_from_xml(xml)
 
 	global smalltext, smalltree
@@ -29,6 +32,10 @@ def timeParsing():
 	parser.parse(wikitext)
 
 
+def timeParsingSinglePass():
+	single_pass_parser.parse(wikitext)
+
+
 def timeDumping():
 	dumper.dump(parsetree)
 
@@ -37,6 +44,10 @@ def timeParsingSmall():
 	parser.parse(smalltext)
 
 
+def timeParsingSmallSinglePass():
+	single_pass_parser.parse(smalltext)
+
+
 def timeDumpingSmall():
 	dumper.dump(smalltree)
 
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+# Load test for the web server: replays requests with a number of
+# concurrent clients and reports throughput and latency percentiles
+#
+# Usage: time_www.py [OPTIONS] [NOTEBOOK]
+#
+# Without "--url" a local server is started for NOTEBOOK, once for each
+# number of threads given with "--threads". Without a notebook, a new
+# one is generated in a temporary folder by
+# "tools/create_large_test_notebook.py".
+#
+# Requests are replayed from a file with one URL path per line, e.g.
+# taken from an access log, or else for all pages in the notebook.
+
+import sys
+sys.path.insert(0, '.')
+
+import os
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from itertools import cycle, islice
+from urllib.request import urlopen
+from urllib.error import URLError, HTTPError
+from wsgiref.simple_server import WSGIRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+from zim.newfs import LocalFolder, LocalFile
+from zim.notebook import Notebook, init_notebook, encode_filename
+from zim.parse.encode import url_encode
+from zim.www import make_server
+
+
+TEMPLATE = 'data/templates/html/Default.html'
+
+
+def create_notebook(root):
+	path = os.path.join(root, 'notebook')
+	subprocess.run(
+		[sys.executable, 'tools/create_large_test_notebook.py', path],
+		stdout=subprocess.DEVNULL, check=True
+	)
+	init_notebook(LocalFolder(path))
+	return path
+
+
+def open_notebook(path):
+	notebook = Notebook.new_from_dir(LocalFolder(path))
+	start = time.time()
+	notebook.index.check_and_update()
+	print('Notebook: %s (%i pages, index update %.1f sec)' % (
+		path, notebook.pages.n_all_pages(), time.time() - start))
+	return notebook
+
+
+def list_paths(notebook):
+	# Same URLs as used by WWWLinker, placeholders without children
+	# are skipped because they give "404 Not Found"
+	paths = ['/']
+	for path in notebook.pages.walk():
+		if path.hascontent or path.haschildren:
+			paths.append(url_encode('/' + encode_filename(path.name) + '.html'))
+	return paths
+
+
+def read_paths(file):
+	with open(file) as fh:
+		return [line.strip() for line in fh if line.strip()]
+
+
+def percentile(values, p):
+	# Nearest rank on a sorted list
+	i = max(0, int(round(p / 100.0 * len(values))) - 1)
+	return values[min(i, len(values) - 1)]
+
+
+def fetch(url):
+	# Returns the latency and whether the request was successful, the
+	# latency is None if no response was received
+	start = time.time()
+	try:
+		with urlopen(url) as response:
+			response.read()
+	except HTTPError as error:
+		error.read()
+		return time.time() - start, False
+	except (URLError, OSError):
+		return None, False
+	else:
+		return time.time() - start, True
+
+
+def replay(url, paths, n_requests, clients):
+	urls = [url + p for p in islice(cycle(paths), n_requests)]
+	start = time.time()
+	with ThreadPoolExecutor(clients) as pool:
+		results = list(pool.map(fetch, urls))
+	total = time.time() - start
+
+	latencies = sorted(t for t, ok in results if t is not None)
+	errors = len([ok for t, ok in results if not ok])
+	return total, latencies, errors
+
+
+def report(name, total, latencies, errors):
+	if latencies:
+		p50, p90, p99 = (1E+3 * percentile(latencies, p) for p in (50, 90, 99))
+		tmax = 1E+3 * latencies[-1]
+	else:
+		p50 = p90 = p99 = tmax = float('nan')
+	n = len(latencies)
+	print('%s\t%i\t%i\t%.1f\t\t%.1f\t%.1f\t%.1f\t%.1f' % (
+		name, n, errors, n / total, p50, p90, p99, tmax))
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+	def log_message(self, *args):
+		pass # do not log each request to stderr
+
+
+def run_local(notebook, paths, threads, n_requests, clients):
+	template = LocalFile(os.path.abspath(TEMPLATE))
+	httpd = make_server(notebook, port=0, public=False, threads=threads, template=template)
+	httpd.RequestHandlerClass = QuietRequestHandler
+	thread = threading.Thread(target=httpd.serve_forever)
+	thread.start()
+	try:
+		url = 'http://localhost:%i' % httpd.server_port
+		replay(url, paths[:clients], clients, clients) # warm up
+		return replay(url, paths, n_requests, clients)
+	finally:
+		httpd.shutdown()
+		httpd.server_close()
+		thread.join()
+
+
+def main(args, notebook_path):
+	notebook = open_notebook(notebook_path) if notebook_path else None
+	if args.paths:
+		paths = read_paths(args.paths)
+	else:
+		paths = list_paths(notebook)
+	n_requests = args.requests or len(paths)
+	print('Requests: %i, clients: %i' % (n_requests, args.clients))
+	print('')
+	print('Threads\tN\tErrors\tRequests/sec\tp50\tp90\tp99\tmax [msec]')
+
+	if args.url:
+		report('-', *replay(args.url.rstrip('/'), paths, n_requests, args.clients))
+	else:
+		for threads in args.threads:
+			report(str(threads), *run_local(notebook, paths, threads, n_requests, args.clients))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Load test for the zim web server')
+	parser.add_argument('notebook', nargs='?', help='notebook folder')
+	parser.add_argument('--url', help='test a running server instead of a local instance')
+	parser.add_argument('--paths', help='file with URL paths to request, one per line')
+	parser.add_argument('-t', '--threads', default='1,4',
+		type=lambda s: [int(t) for t in s.split(',')],
+		help='comma separated numbers of server threads to test (default "1,4")')
+	parser.add_argument('-c', '--clients', type=int, default=40,
+		help='number of concurrent clients (default 40)')
+	parser.add_argument('-n', '--requests', type=int, default=0,
+		help='number of requests (default one per path)')
+	args = parser.parse_args()
+
+	if args.url and not (args.notebook or args.paths):
+		parser.error('need NOTEBOOK or --paths with --url')
+
+	if args.notebook or args.url:
+		main(args, args.notebook)
+	else:
+		with tempfile.TemporaryDirectory() as root:
+			main(args, create_notebook(root))
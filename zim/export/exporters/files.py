@@ -2,6 +2,7 @@
 # Copyright 2008-2014 Jaap Karssenberg <jaap.karssenberg@gmail.com>
 
 from functools import partial
+from collections import deque
 
 import logging
 
@@ -14,11 +15,12 @@ from zim.notebook import Path
 from zim.formats import get_format
 
 from zim.export.exporters import Exporter, createIndexPage
-from zim.export.linker import ExportLinker
-from zim.export.template import ExportTemplateContext
+from zim.export.linker import ExportLinker, LinkCache
+from zim.export.template import ExportTemplateContext, ExportIndex
+from zim.export.manifest import ExportManifest, export_key, page_key, attachments_digests
 
 from zim.fs import adapt_from_oldfs
-from zim.newfs import FileNotFoundError, LocalFolder
+from zim.newfs import FileNotFoundError, LocalFolder, LocalFile
 
 
 
@@ -37,15 +39,18 @@ class FilesExporterBase(Exporter):
 		self.format = get_format(format) # XXX
 		self.document_root_url = document_root_url
 
-	def export_attachments_iter(self, notebook, page):
+	def export_attachments_iter(self, notebook, page, unchanged=()):
 		# XXX FIXME remove need for notebook here
 		# XXX what to do with folders that do not map to a page ?
+		# Files with a basename in "unchanged" are skipped if they exist
 		source = notebook.get_attachments_dir(page)
 		target = self.layout.attachments_dir(page)
 		try:
 			for file in source.list_files():
-					yield file
 					targetfile = target.file(file.basename)
+					if file.basename in unchanged and targetfile.exists():
+						continue
+					yield file
 					if targetfile.exists():
 						targetfile.remove() # Export does overwrite by default
 					file.copyto(targetfile)
@@ -76,15 +81,23 @@ class FilesExporterBase(Exporter):
 class MultiFileExporter(FilesExporterBase):
 	'''Exporter that exports each page to a single file'''
 
-	def __init__(self, layout, template, format, index_page=None, document_root_url=None):
+	def __init__(self, layout, template, format, index_page=None, document_root_url=None, jobs=None, incremental=False):
 		'''Constructor
 		@param layout: a L{ExportLayout} to map pages to files
 		@param template: a L{Template} object
 		@param format: the format for the file content
 		@param index_page: a page to output the index or C{None}
 		@param document_root_url: optional URL for the document root
+		@param jobs: if larger than 1, pages are rendered by a pool of
+		C{jobs} worker processes, see L{export_iter()}
+		@param incremental: if C{True} only pages that changed since
+		the previous export are exported, see L{export_iter()}
 		'''
 		FilesExporterBase.__init__(self, layout, template, format, document_root_url)
+		self.jobs = jobs
+		self.incremental = incremental
+		self._export_index = None
+		self._link_cache = None
 		if index_page:
 			if isinstance(index_page, str):
 				self.index_page = Path(Path.makeValidPageName(index_page))
@@ -95,28 +108,119 @@ class MultiFileExporter(FilesExporterBase):
 		# TODO make index_page generic special page in output selection
 
 	def export_iter(self, pages):
-		self.export_resources()
+		'''Export pages while yielding page objects and attachment
+		files that are exported
+
+		If C{jobs} was set, pages are rendered and written by a pool of
+		worker processes that open the notebook with a read-only index
+		connection. The main process still iterates the pages, so
+		previous and next pages are the same as for a serial export,
+		and it copies the attachments and writes the index page. Pages
+		are yielded in the same order as for a serial export, with a
+		bounded number of pages in flight. The output is the same as
+		for a serial export.
+
+		If C{incremental} was set, a manifest in the output folder is
+		used to skip pages for which none of the inputs changed since
+		the previous export, see L{zim.export.manifest} for details.
+		Skipped pages are still yielded, but their attachments are
+		not. Output files of pages and attachments that are no longer
+		part of the export are removed. The index page is always
+		exported.
+
+		@param pages: a L{PageSelection} object
+		'''
+		self._export_index = None # do not re-use from a previous export
+		self._link_cache = None
+		if self.incremental:
+			manifest = ExportManifest(
+				self.layout.manifest_file(),
+				self.layout.relative_root,
+				export_key(self, pages)
+			)
+		else:
+			manifest = None
 
-		for prev, page, next in MovingWindowIter(pages):
-			yield page
-			try:
-				self.export_page(pages.notebook, page, pages, prevpage=prev, nextpage=next)
-					# XXX FIXME remove need for notebook here
-				for file in self.export_attachments_iter(pages.notebook, page):
-					yield file
-					# XXX FIXME remove need for notebook here
-			except:
-				raise
-				logger.exception('Error while exporting: %s', page.name)
+		if not (manifest and manifest.matches):
+			self.export_resources()
+
+		worker_args = self._get_worker_args(pages) if self.jobs and self.jobs > 1 else None
+		if worker_args:
+			logger.debug('Exporting pages using %i processes', self.jobs)
+			yield from self._export_pages_parallel(pages, worker_args, manifest)
+		else:
+			for prev, page, next in MovingWindowIter(pages):
+				yield page
+				state = self._check_page(manifest, pages, page, prev, next) if manifest else None
+				if state is False:
+					continue # unchanged
+				try:
+					context = self.export_page(pages.notebook, page, pages, prevpage=prev, nextpage=next)
+						# XXX FIXME remove need for notebook here
+					for file in self._export_page_attachments_iter(manifest, pages, page, prev, next, state, context.used_full_index):
+						yield file
+						# XXX FIXME remove need for notebook here
+				except:
+					raise
+					logger.exception('Error while exporting: %s', page.name)
 
 		if self.index_page:
 			try:
 				logger.info('Export index: %s', self.index_page)
 				yield self.index_page
 				self.export_index(self.index_page, pages)
+				if manifest:
+					index_page = pages.prefix + self.index_page if pages.prefix else self.index_page
+					manifest.add_page(index_page, None, [self.layout.page_file(index_page)])
 			except:
 				logger.exception('Error while exporting index')
 
+		if manifest:
+			for file in manifest.stale_files():
+				logger.info('Remove stale export file: %s', file)
+				file.remove()
+			manifest.write()
+
+		if self._link_cache:
+			self._link_cache.log_stats()
+
+	def _check_page(self, manifest, pages, page, prevpage, nextpage):
+		# Returns False after keeping the manifest entry if the page is
+		# unchanged, else the state for _export_page_attachments_iter()
+		attachments = attachments_digests(pages.notebook, page)
+		used_full_index = manifest.used_full_index(page)
+		key = page_key(
+			pages.notebook, page, prevpage, nextpage, attachments,
+			manifest.full_index_key(pages) if used_full_index else None
+		)
+		if manifest.page_changed(page, key):
+			return (key, attachments, used_full_index)
+		else:
+			manifest.keep_page(page)
+			return False
+
+	def _export_page_attachments_iter(self, manifest, pages, page, prevpage, nextpage, state, used_full_index):
+		# Copy attachments after exporting a page and update the manifest
+		if manifest is None:
+			yield from self.export_attachments_iter(pages.notebook, page)
+			return
+
+		key, attachments, checked_full_index = state
+		unchanged = set(
+			name for name, digest in attachments.items()
+				if not manifest.attachment_changed(page, name, digest)
+		)
+		yield from self.export_attachments_iter(pages.notebook, page, unchanged)
+
+		if used_full_index != checked_full_index:
+			key = page_key(
+				pages.notebook, page, prevpage, nextpage, attachments,
+				manifest.full_index_key(pages) if used_full_index else None
+			)
+		target = self.layout.attachments_dir(page)
+		files = [self.layout.page_file(page)] + [target.file(name) for name in sorted(attachments)]
+		manifest.add_page(page, key, files, attachments, used_full_index)
+
 	def export_page(self, notebook, page, pages, prevpage=None, nextpage=None):
 		# XXX FIXME remove need for notebook here
 
@@ -129,7 +233,8 @@ class MultiFileExporter(FilesExporterBase):
 			layout=self.layout,
 			output=file,
 			usebase=self.format.info['usebase'],
-			document_root_url=self.document_root_url
+			document_root_url=self.document_root_url,
+			cache=self._get_link_cache(notebook)
 		)
 		dumper_factory = self.format.Dumper # XXX
 
@@ -142,13 +247,105 @@ class MultiFileExporter(FilesExporterBase):
 			up=None, # TODO
 			prevpage=prevpage, nextpage=nextpage,
 			links={'index': self.index_page},
-			index_generator=pages.index,
+			index_generator=self._get_export_index(pages),
 			index_page=page,
 		)
 
-		lines = []
-		self.template.process(lines, context)
-		file.writelines(lines)
+		file.writelines(self.template.process_iter(context))
+		return context
+
+	def _get_export_index(self, pages):
+		# Share the index between all pages of the same export, also
+		# used in worker processes, which only call export_page()
+		if self._export_index is None \
+		or self._export_index.index_generator != pages.index:
+			self._export_index = ExportIndex(pages.index)
+		return self._export_index
+
+	def _get_link_cache(self, notebook):
+		# Share resolved links between all pages of the same export
+		if self._link_cache is None \
+		or self._link_cache.index is not notebook.index:
+			self._link_cache = LinkCache(notebook.index)
+		return self._link_cache
+
+	def _get_worker_args(self, pages):
+		# Returns the arguments for _init_export_worker(), or None if
+		# the pages can not be exported by worker processes
+		from zim.export.selections import AllPages, SinglePage, SubPages
+		from zim.plugins import PluginManager
+
+		if not isinstance(pages.notebook.folder, LocalFolder) \
+		or pages.notebook.index.dbpath == ':memory:':
+			logger.info('Notebook not on disk, exporting in a single process')
+			return None
+		elif not LocalFile(self.template.filename).exists():
+			logger.info('Template not on disk, exporting in a single process')
+			return None
+		elif type(pages) is AllPages:
+			selection = (AllPages, None)
+		elif type(pages) in (SinglePage, SubPages):
+			selection = (type(pages), pages.page.name)
+		else:
+			logger.info('Selection not supported by worker processes, exporting in a single process')
+			return None
+
+		return (
+			pages.notebook.folder.path,
+			pages.notebook.index.dbpath,
+			selection,
+			(
+				self.layout,
+				self.template.filename,
+				self.format.__name__.rsplit('.', 1)[-1],
+				self.index_page.name if self.index_page else None,
+				self.document_root_url,
+			),
+			list(PluginManager()),
+		)
+
+	def _export_pages_parallel(self, pages, worker_args, manifest=None):
+		from concurrent.futures import ProcessPoolExecutor
+
+		executor = ProcessPoolExecutor(
+			max_workers=self.jobs,
+			initializer=_init_export_worker,
+			initargs=worker_args
+		)
+		window = self.jobs * 4
+		queue = deque()
+
+		def finish():
+			page, prev, next, state, future = queue.popleft()
+			yield page
+			if future is not None:
+				used_full_index = future.result() # raises errors from the worker
+				yield from self._export_page_attachments_iter(manifest, pages, page, prev, next, state, used_full_index)
+
+		try:
+			for prev, page, next in MovingWindowIter(pages):
+				state = self._check_page(manifest, pages, page, prev, next) if manifest else None
+				if state is False:
+					future = None # unchanged, only keep order for yielding
+				else:
+					future = executor.submit(
+						_export_page_in_worker,
+						page.name,
+						prev.name if prev else None,
+						next.name if next else None,
+					)
+				queue.append((page, prev, next, state, future))
+				while len(queue) > window:
+					yield from finish()
+
+			while queue:
+				yield from finish()
+		finally:
+			# Cancelled or failed, do not leave work behind in the pool
+			for page, prev, next, state, future in queue:
+				if future is not None:
+					future.cancel()
+			executor.shutdown(wait=True)
 
 	def export_index(self, index_page, pages):
 		if pages.prefix:
@@ -158,6 +355,42 @@ class MultiFileExporter(FilesExporterBase):
 		self.export_page(pages.notebook, page, pages)
 
 
+_export_worker = None # exporter and selection in a worker process
+
+
+def _init_export_worker(folder, dbpath, selection, exporter_args, plugins):
+	# Runs in a worker process of MultiFileExporter._export_pages_parallel()
+	# to build the objects used to export pages in this process
+	global _export_worker
+	from zim.plugins import PluginManager
+	from zim.notebook import Notebook
+	from zim.templates import Template
+
+	PluginManager().load_plugins_from_preferences(plugins) # no-op if forked
+	notebook = Notebook.new_from_dir(LocalFolder(folder), index_readonly=True)
+	if notebook.index.dbpath != dbpath:
+		raise AssertionError('Worker process found a different index: %s' % notebook.index.dbpath)
+	klass, name = selection
+	pages = klass(notebook) if name is None else klass(notebook, Path(name))
+
+	layout, template_file, format, index_page, document_root_url = exporter_args
+	template = Template(LocalFile(template_file))
+	exporter = MultiFileExporter(layout, template, format, index_page, document_root_url)
+	_export_worker = (exporter, pages)
+
+
+def _export_page_in_worker(name, prevname, nextname):
+	# Runs in a worker process, only picklable arguments and return values
+	# Returns whether the full index was used, see zim.export.manifest
+	exporter, pages = _export_worker
+	notebook = pages.notebook
+	page = notebook.get_page(Path(name))
+	prevpage = notebook.get_page(Path(prevname)) if prevname else None
+	nextpage = notebook.get_page(Path(nextname)) if nextname else None
+	context = exporter.export_page(notebook, page, pages, prevpage=prevpage, nextpage=nextpage)
+	return context.used_full_index
+
+
 class SingleFileExporter(FilesExporterBase):
 	'''Exporter that exports all page to the same file'''
 
@@ -166,12 +399,14 @@ class SingleFileExporter(FilesExporterBase):
 	def export_iter(self, pages):
 		self.export_resources()
 
+		link_cache = LinkCache(pages.notebook.index)
 		linker_factory = partial(ExportLinker,
 			notebook=pages.notebook,
 			layout=self.layout,
 			output=self.layout.file,
 			usebase=self.format.info['usebase'],
-			document_root_url=self.document_root_url
+			document_root_url=self.document_root_url,
+			cache=link_cache
 		)
 		dumper_factory = self.format.Dumper # XXX
 
@@ -187,13 +422,10 @@ class SingleFileExporter(FilesExporterBase):
 			index_page=None,
 		)
 
-		lines = []
-		self.template.process(lines, context)
 		if self.layout.file.exists():
 			self.layout.file.remove() # export does overwrite by default
-		self.layout.file.writelines(lines)
+		self.layout.file.writelines(self.template.process_iter(context))
 
-		# TODO incremental write to save memory on large notebooks...
 		# TODO also yield while exporting main page
 
 		for page in pages:
@@ -201,6 +433,8 @@ class SingleFileExporter(FilesExporterBase):
 			for file in self.export_attachments_iter(pages.notebook, page):
 				yield file
 
+		link_cache.log_stats()
+
 
 #~ class StaticFileExporter(SingleFileExporter):
 
@@ -43,6 +43,13 @@ class ExportLayout(object):
 		'''
 		raise NotImplementedError
 
+	def manifest_file(self):
+		'''Returns the file for the manifest of an incremental export,
+		see L{zim.export.manifest}
+		@returns: a L{File} object
+		'''
+		raise NotImplementedError
+
 
 class DirLayoutBase(ExportLayout):
 
@@ -66,6 +73,9 @@ class DirLayoutBase(ExportLayout):
 	def resources_dir(self):
 		return self.dir.folder('_resources')
 
+	def manifest_file(self):
+		return self.dir.file('_manifest.json')
+
 
 class MultiFileLayout(DirLayoutBase):
 	'''Layout that maps pages to files in a folder similar to how a
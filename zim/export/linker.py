@@ -10,6 +10,8 @@ import logging
 
 logger = logging.getLogger('zim.exporter')
 
+from functools import partial
+
 #~ import base64
 
 from .layouts import ExportLayout
@@ -17,11 +19,68 @@ from .layouts import ExportLayout
 from zim.parse.encode import url_decode, url_encode
 from zim.formats import BaseLinker
 from zim.newfs import SEP, LocalFile, LocalFolder
-from zim.notebook import interwiki_link, encode_filename, HRef, PageNotFoundError
+from zim.notebook import interwiki_link, encode_filename, HRef, PageNotFoundError, \
+	HREF_REL_ABSOLUTE, HREF_REL_FLOATING
+from zim.notebook.index import IndexNotFoundError
 from zim.parse.links import link_type
 from zim.formats import BaseLinker
 
 
+class LinkCache(object):
+	'''Cache for page links resolved by an L{ExportLinker}
+
+	Resolving a page link needs several lookups in the index. Heavily
+	cross-linked notebooks resolve the same links from many pages, so
+	use one object for all linkers of an export to re-use the resolved
+	paths. Floating and absolute links are shared between pages in
+	the same namespace, relative links only within the same page. The
+	cache is cleared when the index of the notebook changes.
+
+	@ivar hits: number of links that were found in the cache
+	@ivar misses: number of links that had to be resolved
+	'''
+
+	def __init__(self, index):
+		'''Constructor
+		@param index: the L{Index} of the notebook, used to check
+		whether cached results are still valid
+		'''
+		self.index = index
+		self.hits = 0
+		self.misses = 0
+		self._generation = index.generation
+		self._cache = {}
+
+	def lookup(self, key, resolve):
+		'''Returns the cached result for C{key}, or calls C{resolve}
+		to get the result and caches it
+		@param key: a hashable key for the link, including everything
+		the result depends on
+		@param resolve: a function without arguments that resolves
+		the link
+		'''
+		if self.index.generation != self._generation:
+			self._generation = self.index.generation
+			self._cache = {}
+
+		try:
+			result = self._cache[key]
+		except KeyError:
+			self.misses += 1
+			result = resolve()
+			self._cache[key] = result
+		else:
+			self.hits += 1
+		return result
+
+	def log_stats(self, level=logging.INFO):
+		'''Log the number of lookups and the hit rate'''
+		total = self.hits + self.misses
+		if total:
+			logger.log(level, 'Resolved %i page links, %i from cache (%.0f%%)',
+				total, self.hits, 100.0 * self.hits / total)
+
+
 class ExportLinker(BaseLinker):
 	'''This object translate links in zim pages to (relative) URLs.
 	This is used when exporting data to resolve links.
@@ -33,7 +92,7 @@ class ExportLinker(BaseLinker):
 	'''
 
 	def __init__(self, notebook, layout, source=None, output=None,
-						usebase=False, document_root_url=None
+						usebase=False, document_root_url=None, cache=None
 	):
 		'''Contructor
 		@param notebook: the source L{Notebook} for resolving links
@@ -42,6 +101,8 @@ class ExportLinker(BaseLinker):
 		@param output: is a L{File} object for the destination file
 		@param usebase: if C{True} the format allows returning relative paths
 		@param document_root_url: optional URL for the document root
+		@param cache: optional L{LinkCache} shared by the linkers of
+		an export
 		'''
 		self.notebook = notebook
 		self.layout = layout
@@ -56,6 +117,8 @@ class ExportLinker(BaseLinker):
 		self.usebase = usebase
 
 		self.document_root_url = document_root_url
+		self.cache = cache
+		self._source_in_index = None
 
 		#~ self._icons = {} # memorize them because the occur often in one page
 
@@ -153,16 +216,49 @@ class ExportLinker(BaseLinker):
 		if not href.names:
 			return '#' + href.anchor if href.anchor else ''
 
+		if self.cache is None:
+			path = self._resolve_page_link(link, href)
+		else:
+			key = (self._link_scope(href), href.rel, href.names)
+			path = self.cache.lookup(key, partial(self._resolve_page_link, link, href))
+
+		if path is None:
+			return ''
+		else:
+			url = self.page_object(path)
+			return url + '#' + href.anchor if href.anchor else url
+
+	def _resolve_page_link(self, link, href):
 		try:
 			if self.source:
-				path = self.notebook.pages.resolve_link(self.source, href)
+				return self.notebook.pages.resolve_link(self.source, href)
 			else:
-				path = self.notebook.pages.lookup_from_user_input(link)
+				return self.notebook.pages.lookup_from_user_input(link)
 		except ValueError:
-			return ''
+			return None
+
+	def _link_scope(self, href):
+		# Returns the part of the source that determines how a link
+		# resolves: absolute links do not depend on the source, floating
+		# links only on the namespace of the source if it is indexed
+		if self.source is None:
+			return None
+		elif href.rel == HREF_REL_ABSOLUTE or self.source.isroot:
+			return ':'
+		elif href.rel == HREF_REL_FLOATING and self._source_indexed():
+			return self.source.parent.name + ':'
 		else:
-			url = self.page_object(path)
-			return url + '#' + href.anchor if href.anchor else url
+			return self.source.name
+
+	def _source_indexed(self):
+		if self._source_in_index is None:
+			try:
+				self.notebook.pages.lookup_by_pagename(self.source)
+			except IndexNotFoundError:
+				self._source_in_index = False
+			else:
+				self._source_in_index = True
+		return self._source_in_index
 
 	def _link_file(self, link):
 		try:
@@ -0,0 +1,267 @@
+
+'''This module defines the manifest used for incremental exports.
+
+The manifest is a json file in the export folder that records for each
+exported page a key for all inputs of the export page and the output
+files written for the page. When exporting again, pages with the same
+key are not rendered again.
+
+The key for a page includes:
+  - the content of the source file
+  - the previous and next page
+  - the targets of links from the page and the sources of links to
+    the page as recorded in the index
+  - the entries in the index branch of the page, and the full index
+    if the template used it for this page
+  - the names and content of attachments
+
+In addition the manifest records a key for the export as a whole:
+zim version, format, template, layout and options. If any of these
+changes, all pages are exported again.
+
+File modification times are not part of any key, so a fresh checkout
+of the notebook does not trigger a full export.
+'''
+
+import hashlib
+import json
+import os
+
+import logging
+
+logger = logging.getLogger('zim.export')
+
+
+from zim import __version__ as ZIM_VERSION
+
+from zim.newfs import FileNotFoundError, File, LocalFile
+from zim.notebook import LINK_DIR_FORWARD, LINK_DIR_BACKWARD
+from zim.notebook.index import IndexNotFoundError
+
+
+MANIFEST_VERSION = 1
+
+
+def _digest(data):
+	if isinstance(data, str):
+		data = data.encode('UTF-8')
+	return hashlib.sha1(data).hexdigest()
+
+
+def _json_digest(obj):
+	return _digest(json.dumps(obj, sort_keys=True, separators=(',', ':')))
+
+
+def _file_digest(file):
+	try:
+		return _digest(file.read_binary())
+	except FileNotFoundError:
+		return None
+
+
+def _folder_digest(folder):
+	# Digest of the relative paths and content of all files in a folder
+	if folder is None or not folder.exists():
+		return None
+	entries = []
+	for file in folder.walk():
+		if isinstance(file, File):
+			entries.append((file.relpath(folder), _file_digest(file)))
+	return _json_digest(sorted(entries))
+
+
+def export_key(exporter, pages):
+	'''Returns a key for the settings of an export job
+	@param exporter: a L{MultiFileExporter} object
+	@param pages: a L{PageSelection} object
+	@returns: a string
+	'''
+	layout = exporter.layout
+	template = exporter.template
+	home = pages.notebook.get_home_page()
+	return _json_digest([
+		ZIM_VERSION,
+		exporter.format.__name__,
+		template.filename,
+		_file_digest(LocalFile(template.filename)),
+		_folder_digest(template.resources_dir),
+		layout.__class__.__name__,
+		getattr(layout, 'ext', None),
+		getattr(layout, 'namespace', None) and layout.namespace.name,
+		exporter.index_page and exporter.index_page.name,
+		exporter.document_root_url,
+		home and home.name,
+		pages.notebook.name,
+		os.environ.get('USER'), # generator.user
+	])
+
+
+def attachments_digests(notebook, page):
+	'''Returns the digests of the attachments of a page
+	@param notebook: a L{Notebook} object
+	@param page: a L{Path} object
+	@returns: a dict mapping file basenames to digests
+	'''
+	attachments = {}
+	try:
+		for file in notebook.get_attachments_dir(page).list_files():
+			attachments[file.basename] = _file_digest(file)
+	except FileNotFoundError:
+		pass
+	return attachments
+
+
+def page_key(notebook, page, prevpage, nextpage, attachments, full_index=None):
+	'''Returns a key for all inputs used to export a page
+	@param notebook: a L{Notebook} object
+	@param page: a L{Page} object
+	@param prevpage: the previous L{Path} or C{None}
+	@param nextpage: the next L{Path} or C{None}
+	@param attachments: a dict as returned by L{attachments_digests()}
+	@param full_index: a key for the full index if the template used
+	it for this page, see L{ExportManifest.full_index_key()}
+	@returns: a string
+	'''
+	try:
+		links = sorted(set(
+			l.target.name for l in notebook.links.list_links(page, LINK_DIR_FORWARD)))
+		backlinks = sorted(set(
+			l.source.name for l in notebook.links.list_links(page, LINK_DIR_BACKWARD)))
+	except IndexNotFoundError:
+		links, backlinks = None, None
+
+	branch = []
+	for path in [page] + list(page.parents()):
+		try:
+			branch.append([p.name for p in notebook.pages.list_pages(path)])
+		except IndexNotFoundError:
+			branch.append(None)
+
+	return _json_digest([
+		_file_digest(page.source_file) if page.source_file else None,
+		prevpage and prevpage.name,
+		nextpage and nextpage.name,
+		links,
+		backlinks,
+		branch,
+		attachments,
+		full_index,
+	])
+
+
+class ExportManifest(object):
+	'''Manifest of an incremental export
+
+	The manifest from a previous export is read when this object is
+	constructed. While exporting, pages are added to the manifest with
+	L{add_page()} or L{keep_page()}. After exporting, L{stale_files()}
+	gives the output files of the previous export that are no longer
+	part of the export and L{write()} writes the new manifest.
+	'''
+
+	def __init__(self, file, root, key):
+		'''Constructor
+		@param file: a L{File} object for the manifest
+		@param root: a L{Folder} object, the root for relative paths
+		of output files, typically the C{relative_root} of the layout
+		@param key: the key for the export settings, see L{export_key()}
+		'''
+		self.file = file
+		self.root = root
+		self.key = key
+		self.matches = False # True if previous export used the same key
+		self._old_pages = {}
+		self._pages = {}
+		self._full_index_key = None
+
+		try:
+			data = json.loads(file.read())
+			if data.get('version') != MANIFEST_VERSION:
+				raise ValueError('Unsupported manifest version')
+			old_pages = data['pages']
+		except FileNotFoundError:
+			logger.info('No export manifest found, exporting all pages')
+		except (ValueError, KeyError, TypeError):
+			logger.warning('Invalid export manifest, exporting all pages: %s', file)
+		else:
+			self._old_pages = old_pages
+			self.matches = data.get('key') == key
+			if not self.matches:
+				logger.info('Export settings changed, exporting all pages')
+
+	def full_index_key(self, pages):
+		'''Returns a key for the full index of the selection, the
+		key is computed only once per export
+		@param pages: a L{PageSelection} object
+		@returns: a string
+		'''
+		if self._full_index_key is None:
+			self._full_index_key = _json_digest([p.name for p in pages.index()])
+		return self._full_index_key
+
+	def used_full_index(self, page):
+		'''Returns C{True} if the template used the full index for
+		C{page} in the previous export
+		'''
+		return bool(self._old_pages.get(page.name, {}).get('full_index'))
+
+	def page_changed(self, page, key):
+		'''Returns C{True} if C{page} needs to be exported again
+		@param page: a L{Path} object
+		@param key: the current key for the page, see L{page_key()}
+		'''
+		if not self.matches:
+			return True
+		old = self._old_pages.get(page.name)
+		if old is None or old['key'] != key:
+			return True
+		else:
+			# Also export again if output was removed by the user
+			return not all(self.root.file(p).exists() for p in old['files'])
+
+	def attachment_changed(self, page, basename, digest):
+		'''Returns C{True} if an attachment needs to be copied again'''
+		old = self._old_pages.get(page.name, {}).get('attachments', {})
+		return not self.matches or old.get(basename) != digest
+
+	def keep_page(self, page):
+		'''Add a page that was not exported again to the manifest'''
+		self._pages[page.name] = self._old_pages[page.name]
+
+	def add_page(self, page, key, files, attachments=None, full_index=False):
+		'''Add an exported page to the manifest
+		@param page: a L{Path} object
+		@param key: the key for the page or C{None} for pages that
+		are always exported again, e.g. the index page
+		@param files: list of L{File} objects for output files
+		@param attachments: a dict as returned by L{attachments_digests()}
+		@param full_index: C{True} if the template used the full index
+		'''
+		self._pages[page.name] = {
+			'key': key,
+			'files': [f.relpath(self.root) for f in files],
+			'attachments': attachments or {},
+			'full_index': full_index,
+		}
+
+	def stale_files(self):
+		'''Returns a list of L{File} objects for output files of the
+		previous export that are not part of the new manifest
+		'''
+		current = set()
+		for entry in self._pages.values():
+			current.update(entry['files'])
+
+		stale = set()
+		for entry in self._old_pages.values():
+			stale.update(p for p in entry['files'] if p not in current)
+
+		return [self.root.file(p) for p in sorted(stale)]
+
+	def write(self):
+		'''Write the manifest file'''
+		self.file.write(json.dumps({
+			'version': MANIFEST_VERSION,
+			'key': self.key,
+			'pages': self._pages,
+		}, sort_keys=True, indent=1))
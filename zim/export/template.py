@@ -144,6 +144,8 @@ class ExportTemplateContext(dict):
 		the C{index()} function. This method should take a single
 		argument for the root namespace to show.
 		See the definition of L{Index.walk()} or L{PageSelection.index()}.
+		Can also be an L{ExportIndex} object, use this to share the
+		index between pages in the same export.
 		@param index_page: the current page to show in the index if any
 		'''
 		# TODO get rid of need of notebook here!
@@ -151,8 +153,11 @@ class ExportTemplateContext(dict):
 		self._content = content
 		self._linker_factory = linker_factory
 		self._dumper_factory = partial(dumper_factory, template_options=template_options)
+		if index_generator and not isinstance(index_generator, ExportIndex):
+			index_generator = ExportIndex(index_generator)
 		self._index_generator = index_generator or content
 		self._index_page = index_page
+		self.used_full_index = False # set by index(), see zim.export.manifest
 
 		self.linker = linker_factory()
 
@@ -274,10 +279,6 @@ class ExportTemplateContext(dict):
 		builder = ParseTreeBuilder()
 		builder.start(FORMATTEDTEXT)
 		builder.start(PARAGRAPH)
-		if self._index_page:
-			expanded = [self._index_page] + list(self._index_page.parents())
-		else:
-			expanded = []
 		stack = []
 
 		if isinstance(namespace, PageProxy):
@@ -285,12 +286,17 @@ class ExportTemplateContext(dict):
 		elif isinstance(namespace, str):
 			namespace = Path(namespace)
 
-		for path in self._index_generator(namespace):
+		if self._index_page and collapse:
+			# Only the branch of the current path
+			expanded = [self._index_page] + list(self._index_page.parents())
+			paths = self._index_generator.list_pages(namespace, expanded)
+		else:
+			self.used_full_index = True
+			paths = self._index_generator.list_pages(namespace)
+
+		for path in paths:
 			logger.info(path)
-			if self._index_page and collapse \
-			and not path.parent in expanded:
-				continue # skip since it is not part of current path
-			#elif ignore_empty and not (path.hascontent or path.haschildren): - bug,  should be page.hascontent,  page.haschildren
+			#if ignore_empty and not (path.hascontent or path.haschildren): - bug,  should be page.hascontent,  page.haschildren
 			#	continue # skip since page is empty
 
 			if not stack:
@@ -357,6 +363,60 @@ class ExportTemplateContext(dict):
 		return self.linker.resource(link)
 
 
+class ExportIndex(object):
+	'''Cache for the pages shown by the C{index()} function of the
+	L{ExportTemplateContext}
+
+	Walking the whole index for each exported page makes exporting a
+	notebook quadratic in the number of pages. This object walks the
+	index only once per namespace and groups the pages by parent, so
+	the entries of a collapsed index can be looked up for each page.
+
+	Use one object for all pages of an export, it assumes the notebook
+	does not change while exporting.
+	'''
+
+	def __init__(self, index_generator):
+		'''Constructor
+		@param index_generator: a generator function, see
+		L{PageSelection.index()}
+		'''
+		self.index_generator = index_generator
+		self._cache = {}
+
+	def __call__(self, namespace=None):
+		return iter(self.list_pages(namespace))
+
+	def list_pages(self, namespace=None, expanded=None):
+		'''Returns the pages in the index
+		@param namespace: the namespace as a L{Path}, or C{None}
+		@param expanded: a list of L{Path} objects or C{None}, if given
+		only pages that have their parent in this list are returned
+		@returns: a list of L{Path} objects in the order of the
+		index generator
+		'''
+		paths, children = self._get_index(namespace)
+		if expanded is None:
+			return paths
+		else:
+			positions = set()
+			for path in expanded:
+				positions.update(children.get(path.name, ()))
+			return [paths[i] for i in sorted(positions)]
+
+	def _get_index(self, namespace):
+		key = namespace.name if namespace else None
+		try:
+			return self._cache[key]
+		except KeyError:
+			paths = list(self.index_generator(namespace))
+			children = {} # parent name -> positions in "paths"
+			for i, path in enumerate(paths):
+				children.setdefault(path.parent.name, []).append(i)
+			self._cache[key] = (paths, children)
+			return paths, children
+
+
 class ExportTemplatePageIter(object):
 
 	def __init__(self, special=None, content=None):
@@ -416,8 +476,7 @@ class ParseTreeProxy(object):
 	def heading(self):
 		head, body = self._split_head()
 		if head:
-			lines = self._dumper.dump(head)
-			return ''.join(lines)
+			return ''.join(self._dumper.dump_iter(head))
 		else:
 			return ''
 
@@ -426,8 +485,7 @@ class ParseTreeProxy(object):
 		try:
 			head, body = self._split_head()
 			if body:
-				lines = self._dumper.dump(body)
-				return ''.join(lines)
+				return ''.join(self._dumper.dump_iter(body))
 			else:
 				return ''
 		except:
@@ -438,8 +496,7 @@ class ParseTreeProxy(object):
 	def content(self):
 		try:
 			if self._tree:
-				lines = self._dumper.dump(self._tree)
-				return ''.join(lines)
+				return ''.join(self._dumper.dump_iter(self._tree))
 			else:
 				return ''
 		except:
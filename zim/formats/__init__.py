@@ -85,7 +85,8 @@ logger = logging.getLogger('zim.formats')
 
 from zim.parse.encode import url_decode, url_encode, URL_ENCODE_READABLE, URL_ENCODE_DATA
 from zim.parse.links import link_type, is_url_re, is_www_link_re
-from zim.parse.tokenlist import TokenParser, topLevelLists, collect_until_end_token
+from zim.parse.tokenlist import TokenParser, iterTopLevelLists, collect_until_end_token, tokens_to_text
+from zim.parse.tokenarray import TokenArray, TokenArrayBuilder
 from zim.parse.builder import Builder
 
 from zim.config import ConfigDict
@@ -395,23 +396,27 @@ class ParseTree(object):
 		return ParseTree().fromstring(self.tostring())
 
 	def iter_tokens(self):
-		return iter(topLevelLists(self._get_tokens(self._etree.getroot())))
+		return iterTopLevelLists(self._get_tokens(self._etree.getroot()))
 
 	def _get_tokens(self, node):
-		tokens = [(node.tag, node.attrib.copy())]
+		# Generator, avoids building and copying a list per level
+		yield (node.tag, node.attrib.copy())
 
 		if node.text:
 			for t in node.text.splitlines(True):
-				tokens.append((TEXT, t))
+				yield (TEXT, t)
 
 		for child in node:
-			tokens.extend(self._get_tokens(child)) # recurs
+			yield from self._get_tokens(child) # recurs
 			if child.tail:
 				for t in child.tail.splitlines(True):
-					tokens.append((TEXT, t))
+					yield (TEXT, t)
 
-		tokens.append((END, node.tag))
-		return tokens
+		yield (END, node.tag)
+
+	def to_compact(self):
+		'''Returns a L{CompactParseTree} with the same content and meta data'''
+		return CompactParseTree.new_from_parsetree(self)
 
 	def iter_href(self, include_page_local_links=False, include_anchors=False):
 		'''Generator for links in the text
@@ -419,33 +424,13 @@ class ParseTree(object):
 		link and only yield unique links to pages
 		@returns: yields a list of unique L{HRef} objects
 		'''
-		from zim.notebook.page import HRef # XXX
-
-		seen = set()
-		for elt in itertools.chain(
-			self._etree.iter(LINK),
-			self._etree.iter(IMAGE)
-		):
-			href = elt.attrib.get('href')
-			if not href or link_type(href) != 'page':
-				continue
-
-			try:
-				href_obj = HRef.new_from_wiki_link(href)
-			except ValueError:
-				continue
-
-			if not include_anchors:
-				if not href_obj.names:
-					continue # internal link within same page
-				elif href_obj.anchor:
-					href_obj.anchor = None
-					href = href_obj.to_wiki_link()
-
-			if href in seen:
-				continue
-			seen.add(href)
-			yield href_obj
+		return _iter_page_hrefs(
+			(elt.attrib.get('href') for elt in itertools.chain(
+				self._etree.iter(LINK),
+				self._etree.iter(IMAGE)
+			)),
+			include_anchors
+		)
 
 	def iter_tag_names(self):
 		'''Generator for tags in the page content
@@ -569,16 +554,29 @@ class ParseTree(object):
 		in this tree.
 		'''
 		count = 0
-		for element in self._etree.iter():
-			if element.text:
-				newstring, n = regex.subn('', element.text)
-				count += n
-			if element.tail:
-				newstring, n = regex.subn('', element.tail)
-				count += n
+		for text in self.iter_text():
+			newstring, n = regex.subn('', text)
+			count += n
 
 		return count
 
+	def iter_text(self):
+		'''Generator yielding all text strings in this tree in
+		document order.
+		This yields the text of each element and the text following
+		it separately, so matching regular expressions across these
+		strings is not possible.
+		'''
+		return self._iter_element_text(self._etree.getroot())
+
+	def _iter_element_text(self, element):
+		if element.text:
+			yield element.text
+		for child in element:
+			yield from self._iter_element_text(child) # recurs
+			if child.tail:
+				yield child.tail
+
 	def get_ends_with_newline(self):
 		'''Checks whether this tree ends in a newline or not'''
 		return self._get_element_ends_with_newline(self._etree.getroot())
@@ -642,6 +640,258 @@ class ParseTree(object):
 		return ParseTree.new_from_tokens(tokens)
 
 
+def _iter_page_hrefs(hrefs, include_anchors=False):
+	# Shared by ParseTree and ContentFacets, turns "href" attributes
+	# into unique HRef objects for page links
+	from zim.notebook.page import HRef # XXX
+
+	seen = set()
+	for href in hrefs:
+		if not href or link_type(href) != 'page':
+			continue
+
+		try:
+			href_obj = HRef.new_from_wiki_link(href)
+		except ValueError:
+			continue
+
+		if not include_anchors:
+			if not href_obj.names:
+				continue # internal link within same page
+			elif href_obj.anchor:
+				href_obj.anchor = None
+				href = href_obj.to_wiki_link()
+
+		if href in seen:
+			continue
+		seen.add(href)
+		yield href_obj
+
+
+class ContentFacets(object):
+	'''Light-weight alternative for a L{ParseTree} that only keeps
+	those parts of the page content that are needed by the indexers:
+	links, tags, headings, text and checkbox items.
+
+	It supports the L{iter_href()}, L{iter_tag_names()} and
+	L{iter_text()} methods of L{ParseTree} and gives the same results.
+	Objects of this class are constructed by a L{ContentFacetsBuilder},
+	formats that support it implement a C{Scanner} class to create
+	them from source text without building a complete parse tree.
+
+	@ivar meta: dict with the header values of the source
+	@ivar hrefs: list with the "href" attributes of links
+	@ivar image_hrefs: list with the "href" attributes of images
+	@ivar tags: list with tags, including the "@"
+	@ivar headings: list of 2-tuples with the level and text of headings
+	@ivar tasks: list of 3-tuples with the list nesting level, bullet
+	type and text for checkbox list items
+	@ivar text: list with text strings, see L{iter_text()}
+	'''
+
+	def __init__(self):
+		self.meta = LastDefinedOrderedDict()
+		self.hrefs = []
+		self.image_hrefs = []
+		self.tags = []
+		self.headings = []
+		self.tasks = []
+		self.text = []
+
+	@property
+	def hascontent(self):
+		return any(not t.isspace() for t in self.text)
+
+	def iter_href(self, include_page_local_links=False, include_anchors=False):
+		'''Generator for links in the text, see L{ParseTree.iter_href()}
+		Like for the parse tree links come first and images last.
+		'''
+		return _iter_page_hrefs(
+			itertools.chain(self.hrefs, self.image_hrefs),
+			include_anchors
+		)
+
+	def iter_tag_names(self):
+		'''Generator for tags in the page content, see
+		L{ParseTree.iter_tag_names()}
+		'''
+		seen = set()
+		for name in self.tags:
+			if not name in seen:
+				seen.add(name)
+				yield name.lstrip('@')
+
+	def iter_text(self):
+		'''Generator yielding all text strings in document order, see
+		L{ParseTree.iter_text()}
+		'''
+		return iter(self.text)
+
+
+class CompactParseTree(object):
+	'''Read-only alternative for L{ParseTree} that keeps the content
+	in a L{TokenArray} instead of an ElementTree.
+
+	The content is stored as a flat array of tokens with shared tag names
+	and attribute dicts, which takes less memory than the element tree.
+	Since the array is not modified, L{copy()} is cheap and
+	L{iter_tokens()} yields the tokens directly without building a list.
+	Objects of this class can be given to a L{DumperClass} or to
+	L{TokenParser} like a normal L{ParseTree}. Use L{to_parsetree()} to
+	get a tree that can be modified.
+
+	@ivar meta: dict with the header values of the source
+	'''
+
+	def __init__(self, tokens=None, meta=None):
+		'''Constructor
+		@param tokens: a L{TokenArray} or list of tokens in the form
+		returned by L{ParseTree.iter_tokens()}
+		@param meta: optional dict with meta data
+		'''
+		if tokens is None:
+			tokens = TokenArray([(FORMATTEDTEXT, None), (END, FORMATTEDTEXT)])
+		elif not isinstance(tokens, TokenArray):
+			tokens = TokenArray(tokens)
+		self._tokens = tokens
+		self.meta = LastDefinedOrderedDict()
+		if meta:
+			self.meta.update(meta)
+
+	@classmethod
+	def new_from_tokens(klass, tokens):
+		tokens = list(tokens)
+		assert tokens
+		if tokens[0][0] != FORMATTEDTEXT:
+			tokens.insert(0, (FORMATTEDTEXT, None))
+			tokens.append((END, FORMATTEDTEXT))
+		return klass(tokens)
+
+	@classmethod
+	def new_from_parsetree(klass, parsetree):
+		return klass(parsetree.iter_tokens(), parsetree.meta)
+
+	def to_parsetree(self):
+		'''Returns a L{ParseTree} with the same content and meta data'''
+		tree = ParseTree.new_from_tokens(self._tokens)
+		tree.meta.update(self.meta)
+		return tree
+
+	@property
+	def hascontent(self):
+		'''Returns True if the tree contains any content at all.'''
+		for t in itertools.islice(self._tokens.iter_tokens(), 1, len(self._tokens) - 1):
+			if t[0] != TEXT or not t[1].isspace():
+				return True
+		return False
+
+	@property
+	def israw(self):
+		return self._get_root_attrib('raw', False)
+
+	def _get_root_attrib(self, key, default=None):
+		return next(self._tokens.iter_tokens())[1].get(key, default)
+
+	def tostring(self):
+		'''Serialize the tree to a XML representation'''
+		return self.to_parsetree().tostring()
+
+	def copy(self):
+		# Content is not modified, so the token array can be shared
+		return self.__class__(self._tokens, self.meta)
+
+	def iter_tokens(self):
+		return self._tokens.iter_tokens()
+
+	def iter_href(self, include_page_local_links=False, include_anchors=False):
+		'''Generator for links in the text, see L{ParseTree.iter_href()}
+		Like for the parse tree links come first and images last.
+		'''
+		return _iter_page_hrefs(
+			(t[1].get('href') for t in itertools.chain(
+				self._tokens.iter_start_tokens(LINK),
+				self._tokens.iter_start_tokens(IMAGE)
+			)),
+			include_anchors
+		)
+
+	def iter_tag_names(self):
+		'''Generator for tags in the page content, see
+		L{ParseTree.iter_tag_names()}
+		'''
+		seen = set()
+		token_iter = self._tokens.iter_tokens()
+		for t in token_iter:
+			if t[0] == TAG:
+				name = tokens_to_text(collect_until_end_token(token_iter, TAG))
+				if not name in seen:
+					seen.add(name)
+					yield name.lstrip('@')
+
+	def _get_heading_tokens(self, level=1):
+		token_iter = self._tokens.iter_tokens()
+		next(token_iter) # root
+		for t in token_iter:
+			if t[0] == TEXT and t[1].isspace():
+				continue
+			elif t[0] == HEADING and int(t[1]['level']) >= level:
+				return t, collect_until_end_token(token_iter, HEADING)
+			else:
+				return None, None
+		return None, None
+
+	def get_heading_level(self):
+		heading, content = self._get_heading_tokens()
+		if heading is not None:
+			return int(heading[1]['level'])
+		else:
+			return None
+
+	def get_heading_text(self, level=1):
+		heading, content = self._get_heading_tokens(level)
+		if heading is not None:
+			return tokens_to_text(content).strip()
+		else:
+			return ""
+
+	def count(self, text):
+		'''Returns the number of occurences of 'text' in this tree.'''
+		return sum(t.count(text) for t in self._tokens.iter_text())
+
+	def countre(self, regex):
+		'''Returns the number of matches for a regular expression
+		in this tree.
+		'''
+		count = 0
+		for text in self.iter_text():
+			newstring, n = regex.subn('', text)
+			count += n
+
+		return count
+
+	def iter_text(self):
+		'''Generator yielding all text strings in this tree in
+		document order.
+		Unlike L{ParseTree.iter_text()} the text is yielded per line.
+		'''
+		return self._tokens.iter_text()
+
+	def find_element(self, tag):
+		'''Helper function to find the first occurence of C{tag}, returns a L{TokenListElement} or C{None}'''
+		for e in self.iter_elements(tag):
+			return e # return first
+		else:
+			return None
+
+	def iter_elements(self, tag):
+		'''Helper function to find all occurences of C{tag}, yields L{TokenListElement}s'''
+		token_iter = self.iter_tokens()
+		for t in token_iter:
+			if t[0] == tag:
+				content = collect_until_end_token(token_iter, tag)
+				yield TokenListElement(t[0], t[1], content)
+
+
 def split_heading_from_parsetree(parsetree, keep_head_token=True):
 	'''Helper function to split the header from a L{ParseTree}
 	Looks for a header at the start of a page and strips empty lines after it.
@@ -743,6 +993,88 @@ class ParseTreeBuilder(Builder):
 			self._last_char = text[-1] if text else None
 
 
+class CompactParseTreeBuilder(TokenArrayBuilder):
+	'''Builder object that builds a L{CompactParseTree}, can be used
+	instead of L{ParseTreeBuilder}
+	'''
+
+	def get_parsetree(self):
+		'''Returns the constructed L{CompactParseTree} object.'''
+		return CompactParseTree(self.get_tokenarray())
+
+
+class ContentFacetsBuilder(Builder):
+	'''Builder object that builds a L{ContentFacets} object
+
+	Text is split in strings at the same points as the text of
+	elements in a L{ParseTree}, so matching words in these strings
+	gives the same results as for the parse tree.
+	'''
+
+	TASK_BULLETS = (UNCHECKED_BOX, CHECKED_BOX, XCHECKED_BOX, MIGRATED_BOX, TRANSMIGRATED_BOX)
+
+	def __init__(self):
+		self.facets = ContentFacets()
+		self._text = [] # pending text for the current element
+		self._heading = None # level and text of open heading
+		self._task = None # level, bullet and text of open checkbox item
+		self._level = 0 # nesting level of lists
+
+	def get_facets(self):
+		'''Returns the constructed L{ContentFacets} object'''
+		self._flush()
+		return self.facets
+
+	def _flush(self):
+		if self._text:
+			self.facets.text.append(''.join(self._text))
+			self._text = []
+
+	def start(self, tag, attrib=None):
+		self._flush()
+		if tag == HEADING:
+			self._heading = (attrib['level'], [])
+		elif tag in (BULLETLIST, NUMBEREDLIST):
+			self._level += 1
+		elif tag == LISTITEM and attrib and attrib.get('bullet') in self.TASK_BULLETS:
+			self._task = (max(0, self._level - 1), attrib['bullet'], [])
+		elif tag == LINK:
+			self.facets.hrefs.append(attrib['href'])
+
+	def text(self, text):
+		self._text.append(text)
+		if self._heading is not None:
+			self._heading[1].append(text)
+		if self._task is not None:
+			self._task[2].append(text)
+
+	def end(self, tag):
+		self._flush()
+		if tag == HEADING and self._heading is not None:
+			level, text = self._heading
+			self.facets.headings.append((level, ''.join(text).strip()))
+			self._heading = None
+		elif tag in (BULLETLIST, NUMBEREDLIST):
+			self._level -= 1
+		elif tag == LISTITEM and self._task is not None:
+			level, bullet, text = self._task
+			self.facets.tasks.append((level, bullet, ''.join(text).strip()))
+			self._task = None
+
+	def append(self, tag, attrib=None, text=None):
+		if tag == LINK and attrib and attrib.get('href'):
+			self.facets.hrefs.append(attrib['href'])
+		elif tag == IMAGE and attrib and attrib.get('href'):
+			self.facets.image_hrefs.append(attrib['href'])
+		elif tag == TAG:
+			self.facets.tags.append(text)
+
+		self._flush()
+		if text:
+			self.text(text)
+			self._flush()
+
+
 class BackwardParseTreeBuilderWithCleanup(object):
 	'''Adaptor for the pageview compatible with the old builder interface'''
 
@@ -978,14 +1310,30 @@ class DumperClass(object):
 		@param tree: a C{ParseTree} object
 		@returns: a list of lines
 		'''
+		return list(self.dump_iter(tree))
+
+	def dump_iter(self, tree):
+		'''Format a parsetree to text, yielding lines while the tree is
+		being serialized. Gives the same lines as L{dump()}, but output
+		is passed on as soon as a top level element of the tree is
+		complete, so the full output does not need to be kept in memory.
+
+		Since the dumper keeps state while serializing, the iterator
+		should be exhausted before the same dumper is used again.
+
+		@param tree: a C{ParseTree} object
+		@returns: an iterator of lines
+		@implementation: sub-classes that need to reset state before
+		dumping a tree should overload this method rather than L{dump()}
+		'''
 		# FIXME - issue here is that we need to reset state - should be in __init__
 		self._text = []
 		self.context = [DumperContextElement(None, None, self._text)]
-		self._dump(tree.iter_tokens())
+		yield from self._dump(tree.iter_tokens())
 		if len(self.context) != 1:
 			raise AssertionError('Unclosed tags on tree: %s' % self.context[-1].tag)
 		#~ import pprint; pprint.pprint(self._text)
-		return self.get_lines() # FIXME - maybe just return text ?
+		yield from self.get_lines()
 
 	def get_lines(self):
 		'''Return the dumped content as a list of lines
@@ -993,7 +1341,27 @@ class DumperClass(object):
 		'''
 		return ''.join(self._text).splitlines(1)
 
+	def _flush_lines(self, strings):
+		# Returns the complete lines of the top level text and keeps
+		# the last line if it is not yet terminated. A line ending
+		# in "\r" is also kept since the "\n" may still follow.
+		# Keeps the top level text non-empty, "dump_" methods may check
+		# the parent text to see whether they are the first element.
+		lines = ''.join(strings).splitlines(1)
+		strings[:] = ('',)
+		if lines:
+			last = lines[-1]
+			if last.endswith('\r') or last.splitlines()[0] == last:
+				strings[0] = lines.pop()
+		return lines
+
 	def _dump(self, token_iter):
+		# Generator that flushes complete lines whenever a top level
+		# element is closed. Top level elements are children of the
+		# root or of the FORMATTEDTEXT element wrapping the page. Top
+		# level list items are not flushed, for raw trees these depend
+		# on the text of the previous items.
+		toplevel = (None,) if FORMATTEDTEXT in self.TAGS else (None, FORMATTEDTEXT)
 		for t in token_iter:
 			if t[0] == TEXT:
 				text = t[1]
@@ -1023,6 +1391,10 @@ class DumperClass(object):
 
 				if strings is not None:
 					self.context[-1].text.extend(strings)
+
+				if len(self.context) < 3 and tag != LISTITEM \
+					and self.context[-1].tag in toplevel:
+						yield from self._flush_lines(self.context[-1].text)
 			else: # START
 				attrib = t[1].copy() if t[1] else {} # Ensure dumping does not change tree
 				self.context.append(DumperContextElement(t[0], attrib, []))
@@ -56,6 +56,10 @@ empty_lines_re = re.compile(r'((?:^[ \t]*\n)+)', re.M | re.U)
 unindented_line_re = re.compile(r'^\S', re.M)
 	# match any unindented line
 
+inline_markup_re = re.compile(r"\[\[|\{\{|@|//|\*\*|__|_\{|\^\{|~~|''|www\.|file:")
+	# matches in any text where one of the inline rules can match,
+	# including urls and emails, used to skip plain text quickly
+
 
 def _remove_indent(text, indent):
 	return re.sub('(?m)^' + indent, '', text)
@@ -83,6 +87,8 @@ class WikiParser(object):
 		self.backward_indented_blocks = backward_indented_blocks
 		self.backward_url_parsing = backward_url_parsing
 		self.inline_parser = self._init_inline_parse()
+		self.inline_parser.prefilter = inline_markup_re
+		self.nested_inline_parser_below_link.prefilter = inline_markup_re
 		self.list_and_indent_parser = self._init_intermediate_parser()
 		self.block_parser = self._init_block_parser()
 
@@ -515,50 +521,359 @@ class WikiParser(object):
 		builder.append(LINE)
 
 
+class SinglePassWikiParser(WikiParser):
+	'''Alternative parser engine for the wiki format that gives the same
+	builder calls as L{WikiParser}.
+
+	Instead of running the block level and the intermediate level
+	regex parsers over the text, this parser goes through the text
+	once, line by line. Only lines that can start a block element are
+	matched against the block rules, paragraphs, lists and indented
+	blocks are split up based on the start of each line. Inline
+	formatting and the processing of the elements is done by the same
+	rules and methods as used by L{WikiParser}.
+	'''
+
+	def __call__(self, builder, text):
+		builder.start(FORMATTEDTEXT)
+		if text:
+			self._parse_blocks(builder, text)
+		builder.end(FORMATTEDTEXT)
+
+	def _parse_blocks(self, builder, text):
+		# Top level, find block elements at the start of lines and
+		# collect the lines in between as a segment
+		block_parser = self.block_parser
+		segment = []
+		pos, end = 0, len(text)
+		while pos < end:
+			i = text.find('\n', pos)
+			next = end if i == -1 else i + 1
+
+			if text[pos] in _block_start_chars:
+				line = text[pos:next]
+				if line.startswith(('==', '|', '-----')) \
+				or line.lstrip('\t').startswith(("'''", '{{{')):
+					match = block_parser.match(text, pos)
+					if match:
+						if segment:
+							self._parse_segment(builder, segment)
+							segment = []
+						pos = block_parser.process_match(builder, text, match)
+						continue
+
+			segment.append(text[pos:next])
+			pos = next
+
+		if segment:
+			self._parse_segment(builder, segment)
+
+	def _parse_segment(self, builder, lines):
+		# Split a segment in paragraphs and empty lines, equivalent
+		# to WikiParser.parse_para()
+		text = ''.join(lines)
+		if text.isspace():
+			builder.text(text)
+			return
+
+		block = []
+		empty = []
+		for line in lines:
+			if line[-1] == '\n' and line.strip(' \t') == '\n':
+				if block:
+					self._parse_paragraph(builder, block)
+					block = []
+				empty.append(line)
+			else:
+				if empty:
+					builder.text(''.join(empty))
+					empty = []
+				block.append(line)
+
+		if block:
+			self._parse_paragraph(builder, block)
+		elif empty:
+			builder.text(''.join(empty))
+
+	def _parse_paragraph(self, builder, lines):
+		text = ''.join(lines)
+		if text.isspace():
+			builder.text(text)
+			return
+		elif self.backward_indented_blocks \
+		and not unindented_line_re.search(text):
+			# Before zim 0.29 all indented paragraphs were verbatim.
+			builder.append(VERBATIM_BLOCK, None, text)
+			return
+
+		if '    ' in text:
+			lines = [
+				convert_space_to_tab(line) if line.lstrip('\t').startswith('    ') else line
+					for line in lines
+			]
+
+		# Intermediate level, split lists and indented blocks from
+		# the other lines, equivalent to WikiParser.list_and_indent_parser
+		builder.start(PARAGRAPH)
+		n = len(lines)
+		i = 0
+		plain = []
+		while i < n:
+			line = lines[i]
+			m = bullet_line_re.match(line)
+			if m:
+				# List, continues with lines with a bullet and at least
+				# the same indent
+				indent = m.group(1)
+				j = i + 1
+				while j < n:
+					m = bullet_line_re.match(lines[j])
+					if m and m.group(1).startswith(indent):
+						j += 1
+					else:
+						break
+
+				if plain:
+					self.inline_parser(builder, ''.join(plain))
+					plain = []
+				self.parse_list(builder, ''.join(lines[i:j]), indent or None)
+				i = j
+			elif line[0] == '\t':
+				# Indented block, continues with lines with the same
+				# indent and no bullet
+				k = len(line) - len(line.lstrip('\t'))
+				indent = line[:k]
+				j = i + 1
+				while j < n:
+					next = lines[j]
+					if next.startswith(indent) and not next.startswith('\t', k) \
+						and not _bullet_re.match(next, k):
+							j += 1
+					else:
+						break
+
+				if plain:
+					self.inline_parser(builder, ''.join(plain))
+					plain = []
+				self.parse_indent(builder, ''.join(lines[i:j]), indent)
+				i = j
+			else:
+				plain.append(line)
+				i += 1
+
+		if plain:
+			self.inline_parser(builder, ''.join(plain))
+		builder.end(PARAGRAPH)
+
+
+_block_start_chars = frozenset('=|-\t\'{')
+	# first characters of lines that may start a block element
+
+_bullet_re = re.compile(bullet_pattern)
+
+
+PARSER_ENGINES = {
+	'regex': WikiParser,
+	'single-pass': SinglePassWikiParser,
+} #: parser classes that can be selected with the "engine" argument of L{Parser}
+
+default_parser_engine = 'regex' #: engine used when L{Parser} does not specify one
+
 wikiparser = WikiParser() #: singleton instance
 
 
+_wikiparsers = {}
+
+
+def _get_wikiparser(version, engine=None):
+	# Support backward compatibility - see history notes WIKI_FORMAT_VERSION
+	engine = engine or default_parser_engine
+	if version == 'zim 0.6':
+		if engine == 'regex':
+			return wikiparser
+		key = (engine, None)
+	elif version in ('zim 0.4', 'zim 0.5'):
+		key = (engine, 'url')
+	else:
+		key = (engine, 'url+indent')
+
+	if key not in _wikiparsers:
+		_wikiparsers[key] = PARSER_ENGINES[engine](
+			backward_indented_blocks=(key[1] == 'url+indent'),
+			backward_url_parsing=(key[1] is not None)
+		)
+	return _wikiparsers[key]
+
+
+def _prepare_input(input, file_input, default_version):
+	# Common preprocessing for the Parser and the Scanner, returns the
+	# text, the meta headers and the format version
+	if not isinstance(input, str):
+		input = ''.join(input)
+
+	input = input.replace('\u2029', ' ') # Unicode PARAGRAPH SEPARATOR, causes conflict between "splitlines()" and regex "\n" matching - see issues #1760
+	input = fix_unicode_whitespace(input)
+
+	meta, version = None, False
+	if file_input:
+		input, meta = parse_header_lines(input)
+		version = meta.get('Wiki-Format')
+
+	return input, meta, version or default_version
+
+
+def _set_meta(obj, meta):
+	if meta is not None:
+		for k, v in list(meta.items()):
+			# Skip headers that are only interesting for the parser
+			#
+			# Also remove "Modification-Date" here because it causes conflicts
+			# when merging branches with version control, use mtime from filesystem
+			# If we see this header, remove it because it will not be updated.
+			if k not in ('Content-Type', 'Wiki-Format', 'Modification-Date'):
+				obj.meta[k] = v
+
+
 # FIXME FIXME we are redefining Parser here !
 class Parser(ParserClass):
 
-	def __init__(self, version=WIKI_FORMAT_VERSION):
+	def __init__(self, version=WIKI_FORMAT_VERSION, engine=None):
+		'''Constructor
+		@param version: the format version to assume when the input
+		does not specify one
+		@param engine: name of the parser engine, one of the keys in
+		L{PARSER_ENGINES}, defaults to L{default_parser_engine}
+		'''
+		if engine is not None and engine not in PARSER_ENGINES:
+			raise ValueError('Unknown parser engine: %s' % engine)
 		self.version = version
+		self.engine = engine
+
+	def parse(self, input, file_input=False, compact=False):
+		'''Parse text in wiki format
+		@param input: text or an iterable with lines
+		@param file_input: if C{True} the input starts with headers
+		@param compact: if C{True} a L{CompactParseTree} is returned
+		instead of a L{ParseTree}
+		'''
+		input, meta, version = _prepare_input(input, file_input, self.version)
+
+		builder = CompactParseTreeBuilder() if compact else ParseTreeBuilder()
+		_get_wikiparser(version, self.engine)(builder, input)
 
-	def parse(self, input, file_input=False):
-		if not isinstance(input, str):
-			input = ''.join(input)
+		parsetree = builder.get_parsetree()
+		_set_meta(parsetree, meta)
+		return parsetree
+
+
+class Scanner(object):
+	'''Scanner that gives the content of a page as L{ContentFacets}
+	instead of a L{ParseTree}. This is used by the index when none of
+	the indexers needs the full parse tree.
 
-		input = input.replace('\u2029', ' ') # Unicode PARAGRAPH SEPARATOR, causes conflict between "splitlines()" and regex "\n" matching - see issues #1760
-		input = fix_unicode_whitespace(input)
+	Block level elements are handled line by line, only lines that
+	can start a block element are matched against the block rules of
+	the parser. Lists and inline formatting are handled by the same
+	methods as used by the parser, so the results are the same as for
+	the parse tree. Text in versions of the format before "zim 0.4"
+	is handled by the full parser.
+	'''
 
-		meta, version = None, False
-		if file_input:
-			input, meta = parse_header_lines(input)
-			version = meta.get('Wiki-Format')
+	def __init__(self, version=WIKI_FORMAT_VERSION):
+		self.version = version
 
-		# Support backward compatibility - see history notes WIKI_FORMAT_VERSION
-		version = version or self.version
-		if version == 'zim 0.6':
-			mywikiparser = wikiparser
-		elif version in ('zim 0.4', 'zim 0.5'):
-			mywikiparser = WikiParser(backward_url_parsing=True)
+	def scan(self, input, file_input=False):
+		'''Scan text in wiki format
+		@param input: text or an iterable with lines
+		@param file_input: if C{True} the input starts with headers
+		@returns: a L{ContentFacets} object
+		'''
+		input, meta, version = _prepare_input(input, file_input, self.version)
+
+		builder = ContentFacetsBuilder()
+		parser = _get_wikiparser(version)
+		if not input:
+			pass
+		elif parser.backward_indented_blocks:
+			parser(builder, input)
 		else:
-			mywikiparser = WikiParser(backward_indented_blocks=True, backward_url_parsing=True)
+			self._scan(builder, parser, input)
+
+		facets = builder.get_facets()
+		_set_meta(facets, meta)
+		return facets
+
+	def _scan(self, builder, parser, text):
+		para = [] # lines waiting for the inline parser
+		items = [] # list lines waiting for the list parser
+		item_indent = None
+
+		def flush_para():
+			# Inline rules do not match across lines, so only lines
+			# with markup need to go through the inline parser
+			plain = []
+			for line in para:
+				if inline_markup_re.search(line):
+					if plain:
+						builder.text(''.join(plain))
+						plain = []
+					parser.inline_parser(builder, line)
+				else:
+					plain.append(line)
+			if plain:
+				builder.text(''.join(plain))
+			para[:] = []
+
+		def flush_items():
+			if items:
+				parser.parse_list(builder, ''.join(items), item_indent)
+				items[:] = []
+
+		pos, end = 0, len(text)
+		while pos < end:
+			i = text.find('\n', pos)
+			next = end if i == -1 else i + 1
+			line = text[pos:next]
+			stripped = line.lstrip('\t')
+
+			if line.startswith(('==', '|', '-----')) \
+			or stripped.startswith(("'''", '{{{')):
+				# Lines that may start a verbatim block, object, heading,
+				# table or horizontal line - none of these can continue
+				# a list, so it is safe to flush the buffers first
+				flush_items()
+				flush_para()
+				offset = parser.block_parser.match_at(builder, text, pos)
+				if offset is not None:
+					pos = offset
+					continue
+
+			if line.isspace():
+				# Empty lines separate paragraphs
+				flush_items()
+				para.append(line)
+			else:
+				if stripped.startswith('    '):
+					line = convert_space_to_tab(line)
+					stripped = line.lstrip('\t')
+
+				m = bullet_line_re.match(line)
+				if m:
+					indent = m.group(1)
+					if not (items and (not item_indent or indent.startswith(item_indent))):
+						flush_items()
+						flush_para()
+						item_indent = indent
+					items.append(line)
+				else:
+					# Plain or indented line
+					flush_items()
+					para.append(stripped)
 
-		builder = ParseTreeBuilder()
-		mywikiparser(builder, input)
+			pos = next
 
-		parsetree = builder.get_parsetree()
-		if meta is not None:
-			for k, v in list(meta.items()):
-				# Skip headers that are only interesting for the parser
-				#
-				# Also remove "Modification-Date" here because it causes conflicts
-				# when merging branches with version control, use mtime from filesystem
-				# If we see this header, remove it because it will not be updated.
-				if k not in ('Content-Type', 'Wiki-Format', 'Modification-Date'):
-					parsetree.meta[k] = v
-		return parsetree
+		flush_items()
+		flush_para()
 
 
 class Dumper(TextDumper):
@@ -584,19 +899,33 @@ class Dumper(TextDumper):
 	}
 
 	def dump(self, tree, file_output=False):
+		return list(self.dump_iter(tree, file_output))
+
+	def dump_iter(self, tree, file_output=False):
 		# If file_output=True we add meta headers to the output
 		# would be nicer to handle this via a template, but works for now
 		if file_output:
-			header = (
-				('Content-Type', 'text/x-zim-wiki'),
-				('Wiki-Format', WIKI_FORMAT_VERSION),
-			)
-			body = TextDumper.dump(self, tree)
-			if not body[-1].endswith('\n'):
-				body[-1] = body[-1] + '\n'
-			return [dump_header_lines(header, getattr(tree, 'meta', {})), '\n'] + body
+			return self._dump_file_iter(tree)
 		else:
-			return TextDumper.dump(self, tree)
+			return TextDumper.dump_iter(self, tree)
+
+	def _dump_file_iter(self, tree):
+		header = (
+			('Content-Type', 'text/x-zim-wiki'),
+			('Wiki-Format', WIKI_FORMAT_VERSION),
+		)
+		yield dump_header_lines(header, getattr(tree, 'meta', {}))
+		yield '\n'
+
+		# Hold back one line, so we can ensure the file ends with a newline
+		last = None
+		for line in TextDumper.dump_iter(self, tree):
+			if last is not None:
+				yield last
+			last = line
+
+		if last is not None:
+			yield last if last.endswith('\n') else last + '\n'
 
 	def dump_pre(self, tag, attrib, strings):
 		# Indent and wrap with "'''" lines
@@ -5,11 +5,14 @@
 
 from gi.repository import Gtk
 from gi.repository import GObject
+from gi.repository import GLib
+import re
 import logging
 
 from zim.notebook import Path
 from zim.gui.widgets import Dialog, BrowserTreeView, InputEntry, ErrorDialog, ScrolledWindow, StatusPage
 from zim.gui.pageview.find import FIND_REGEX
+from zim.plugins import PluginManager
 
 from zim.search import *
 
@@ -153,11 +156,14 @@ class SearchResultsTreeView(BrowserTreeView):
 	NAME_COL = 0
 	SCORE_COL = 1
 	PATH_COL = 2
+	SNIPPET_COL = 3
 
 	def __init__(self, notebook, navigation):
-		model = Gtk.ListStore(str, int, object)
-			# NAME_COL, SCORE_COL, PATH_COL
+		model = Gtk.ListStore(str, int, object, str)
+			# NAME_COL, SCORE_COL, PATH_COL, SNIPPET_COL
 		BrowserTreeView.__init__(self, model)
+		self.set_tooltip_column(self.SNIPPET_COL)
+		self.notebook = notebook
 		self.navigation = navigation
 		self.query = None
 		self.selection = SearchSelection(notebook)
@@ -196,6 +202,7 @@ class SearchResultsTreeView(BrowserTreeView):
 		self.query = Query(query)
 		self.selection.search(self.query, callback=self._search_callback)
 		self._update_results(self.selection)
+		self._update_snippets()
 
 	def _search_callback(self, results, path):
 		# Returning False will cancel the search
@@ -231,7 +238,7 @@ class SearchResultsTreeView(BrowserTreeView):
 		new = results - seen
 		for path in new:
 			score = results.scores.get(path, 0)
-			model.append((path.name, score, path))
+			model.append((path.name, score, path, None))
 			i += 1
 			order.append((path, i, score))
 
@@ -242,6 +249,28 @@ class SearchResultsTreeView(BrowserTreeView):
 
 		self.hasresults = len(model) > 0
 
+	def _update_snippets(self):
+		# The indexed_fts plugin can show the context of matches
+		if 'indexed_fts' not in PluginManager or self.selection.cancelled:
+			return
+
+		model = self.get_model()
+		if not model:
+			return
+
+		snippets = PluginManager['indexed_fts'].get_snippets(
+			self.notebook, self.query, [row[self.PATH_COL] for row in model],
+			start='\x02', end='\x03'
+		)
+		for row in model:
+			snippet = snippets.get(row[self.PATH_COL].name)
+			if snippet:
+				row[self.SNIPPET_COL] = ''.join(
+					'<b>' if part == '\x02' else '</b>' if part == '\x03'
+						else GLib.markup_escape_text(part)
+							for part in re.split('([\x02\x03])', snippet)
+				)
+
 	def _do_open_page(self, view, path, col):
 		page = Path(self.get_model()[path][0])
 		pageview = self.navigation.open_page(page)
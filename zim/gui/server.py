@@ -220,8 +220,8 @@ class ServerWindow(Gtk.Window):
 			self._source_id = None
 
 		if self.httpd:
-			self.httpd.socket.close()
-				# There is also a httpd.server_close(), but undocumented (!?)
+			self.httpd.server_close()
+				# closes the socket and waits for request threads to finish
 			self.httpd = None
 
 		# Update UI
@@ -9,6 +9,7 @@ takes core of the process life cycle.
 
 import os
 import sys
+import json
 import logging
 import signal
 
@@ -81,6 +82,7 @@ Server Options:
   --port            port to use (defaults to 8080)
   --template        name or filepath of the template to use
   --private         serve only to localhost
+  --threads N       number of threads to handle requests (defaults to 4)
   --gui             run the gui wrapper for the server
 
 Export Options:
@@ -92,6 +94,10 @@ Export Options:
   -r, --recursive   when exporting a page, also export sub-pages
   -s, --singlefile  export all pages to a single output file
   -O, --overwrite   force overwriting existing file(s)
+  -j, --jobs N      number of processes to render pages, not used
+                    for single file and MHTML output
+  --incremental     only export pages that changed since the previous
+                    export to the same output, implies --overwrite
 
 Import Options:
   --format          format to read (defaults to 'wiki')
@@ -100,9 +106,16 @@ Import Options:
 
 Search Options:
   -s, --with-scores print score for each page, sort by score
+  -j, --jobs N      number of processes to search page contents
+  --explain         print the steps of the search with timings
+  -n, --limit N     print at most N results, best matches first
+  --format FORMAT   output format, 'text' (default) or 'json'
+  --stream          print results as soon as they are found
+  --snippets        print the context of matches for each result
 
 Index Options:
   -f, --flush       flush the index first and force re-building
+  -j, --jobs N      number of processes to parse pages when re-building
 
 Try 'zim --manual' for more help.
 '''
@@ -374,7 +387,8 @@ class ServerCommand(NotebookCommand):
 		('port=', 'p', 'port number to use (defaults to 8080)'),
 		('template=', 't', 'name or path of the template to use'),
 		('standalone', '', 'start a single instance, no background process'),
-		('private', '', 'serve only to localhost')
+		('private', '', 'serve only to localhost'),
+		('threads=', '', 'number of threads to handle requests (defaults to 4)'),
 	)
 
 	def run(self):
@@ -382,14 +396,17 @@ class ServerCommand(NotebookCommand):
 		from zim.templates import get_template
 
 		port = int(self.opts.get('port', 8080))
+		threads = int(self.opts.get('threads', zim.www.DEFAULT_THREADS))
+		if threads < 1:
+			raise UsageError('--threads should be a positive number')
 		template = get_template('html', self.opts.get('template', 'Default'), pwd=self.pwd)
 		notebook, x = self.build_notebook()
 		is_public = not self.opts.get('private', False)
 
-		self.server = httpd = zim.www.make_server(notebook, public=is_public, template=template, port=port)
+		self.server = httpd = zim.www.make_server(notebook, public=is_public, template=template, port=port, threads=threads)
 			# server attribute used in testing to stop sever in thread
 		logger.info("Serving HTTP on %s port %i...", httpd.server_name, httpd.server_port)
-		httpd.serve_forever()
+		zim.www.serve_forever(httpd)
 
 
 class ServerGuiCommand(NotebookCommand, GtkCommand):
@@ -438,6 +455,8 @@ class ExportCommand(NotebookCommand):
 		('recursive', 'r', 'when exporting a page, also export sub-pages'),
 		('singlefile', 's', 'export all pages to a single output file'),
 		('overwrite', 'O', 'overwrite existing file(s)'),
+		('jobs=', 'j', 'number of processes to render pages'),
+		('incremental', '', 'only export pages that changed since the previous export'),
 	)
 
 	def get_exporter(self, page):
@@ -455,6 +474,10 @@ class ExportCommand(NotebookCommand):
 		if not 'output' in self.opts:
 			raise UsageError(_('Output location needed for export')) # T: error in export command
 
+		jobs = int(self.opts.get('jobs', 1))
+		if jobs < 1:
+			raise UsageError('--jobs should be a positive number')
+
 		try:
 			output = localFileOrFolder(self.opts['output'], pwd=self.pwd)
 		except FileNotFoundError:
@@ -462,7 +485,7 @@ class ExportCommand(NotebookCommand):
 			output = FilePath(self.pwd).get_abspath(self.opts['output']) # can raise again for mal-formed paths
 		else:
 			# file or folder exists
-			if not self.opts.get('overwrite'):
+			if not (self.opts.get('overwrite') or self.opts.get('incremental')):
 				if isinstance(output, LocalFolder):
 					if len(output.list_names()) > 0:
 						raise Error(_('Output folder exists and not empty, specify "--overwrite" to force export'))  # T: error message for export
@@ -472,7 +495,7 @@ class ExportCommand(NotebookCommand):
 					raise Error(_('Output file exists, specify "--overwrite" to force export'))  # T: error message for export
 
 		if format == 'mhtml':
-			self.ignore_options('index-page')
+			self.ignore_options('index-page', 'jobs', 'incremental')
 			if isinstance(output, LocalFolder): # implies exists
 				raise UsageError(_('Need output file to export MHTML')) # T: error message for export
 			else:
@@ -483,7 +506,7 @@ class ExportCommand(NotebookCommand):
 				document_root_url=self.opts.get('root-url'),
 			)
 		elif self.opts.get('singlefile'):
-			self.ignore_options('index-page')
+			self.ignore_options('index-page', 'jobs', 'incremental')
 			if isinstance(output, LocalFolder):
 				ext = get_format(format).info['extension']
 				output = output.file(page.basename) + '.' + ext
@@ -505,6 +528,8 @@ class ExportCommand(NotebookCommand):
 			exporter = build_page_exporter(
 				output, format, template, page,
 				document_root_url=self.opts.get('root-url'),
+				jobs=jobs,
+				incremental=bool(self.opts.get('incremental')),
 			)
 		else:
 			if isinstance(output, LocalFile): # implies exists
@@ -516,6 +541,8 @@ class ExportCommand(NotebookCommand):
 				output, format, template,
 				index_page=self.opts.get('index-page'),
 				document_root_url=self.opts.get('root-url'),
+				jobs=jobs,
+				incremental=bool(self.opts.get('incremental')),
 			)
 
 		return exporter
@@ -580,6 +607,12 @@ class SearchCommand(NotebookCommand):
 	arguments = ('NOTEBOOK', 'QUERY')
 	options = (
 		("with-scores", "s", "also print scores of search results"),
+		('jobs=', 'j', 'number of processes to search page contents'),
+		('explain', '', 'print the steps of the search with timings'),
+		('limit=', 'n', 'maximum number of results to print'),
+		('format=', '', 'output format, "text" or "json"'),
+		('stream', '', 'print results as soon as they are found'),
+		('snippets', '', 'print the context of matches for each result'),
 	)
 
 	def run(self):
@@ -594,19 +627,95 @@ class SearchCommand(NotebookCommand):
 		else:
 			raise ValueError('Empty query')
 
+		jobs = int(self.opts.get('jobs', 1))
+		if jobs < 1:
+			raise UsageError('--jobs should be a positive number')
+
+		limit = int(self.opts['limit']) if 'limit' in self.opts else None
+		if limit is not None and limit < 1:
+			raise UsageError('--limit should be a positive number')
+
+		self.output_format = self.opts.get('format', 'text')
+		if self.output_format not in ('text', 'json'):
+			raise UsageError('--format should be "text" or "json"')
+
 		selection = SearchSelection(notebook)
-		selection.search(query)
+		printed = set()
 
-		if self.opts.get("with-scores", False):
-			sorted_sel = sorted(selection.scores.items(),
-				key=lambda i:i[0].name, reverse=False)
-			sorted_sel.sort(key=lambda i:i[1], reverse=True)
+		def print_results(paths):
+			if self.opts.get('snippets'):
+				snippets = selection.get_snippets(paths)
+			else:
+				snippets = None
+
+			for path in paths:
+				printed.add(path)
+				self._print_result(path, selection.scores.get(path, 0),
+					snippets.get(path.name) if snippets is not None else None)
+
+		if self.opts.get('stream'):
+			# Only pages that were just scored are final, other results
+			# passed to the callback may still be removed by later terms
+			def callback(results, path):
+				if path is not None and results is not None \
+				and path in results and path not in printed:
+					print_results([path])
+				return limit is None or len(printed) < limit
+
+			selection.search(query, callback=callback, jobs=jobs)
+			if not selection.cancelled:
+				remaining = self._sorted_results(selection, limit)
+				remaining = [p for p in remaining if p not in printed]
+				if limit is not None:
+					remaining = remaining[:limit - len(printed)]
+				print_results(remaining)
+		else:
+			selection.search(query, jobs=jobs)
+			print_results(self._sorted_results(selection, limit))
+
+		if self.output_format == 'json':
+			stats = dict(selection.stats)
+			stats['results'] = len(selection)
+			stats['printed'] = len(printed)
+			print(json.dumps({'stats': stats}), flush=True)
+
+		if self.opts.get('explain'):
+			print('')
+			print('%-40s %8s %8s %9s' % ('Step', 'Estimate', 'Results', 'Time'))
+			for line in selection.format_plan():
+				print(line)
+			print('')
+			stats = selection.stats
+			print('Pages scanned: %i, parsed: %i, index hits: %i' % (
+				stats['pages_scanned'], stats['pages_parsed'], stats['index_hits']))
+			print('Cache: %s' % (stats['cache'] or 'miss'))
+			for phase, seconds in sorted(stats['phases'].items()):
+				print('Time %s: %.3fs' % (phase, seconds))
+			print('Time total: %.3fs' % stats['elapsed'])
+
+	def _sorted_results(self, selection, limit):
+		# With a limit the best matches are kept, so sort by score
+		if self.opts.get("with-scores", False) or limit is not None:
+			paths = sorted(selection, key=lambda p: p.name)
+			paths.sort(key=lambda p: selection.scores.get(p, 0), reverse=True)
+		else:
+			paths = sorted(selection, key=lambda p: p.name)
 
-			for result in sorted_sel:
-				print(str(result[1]) + "\t" + result[0].name)
+		return paths[:limit] if limit is not None else paths
+
+	def _print_result(self, path, score, snippet):
+		if self.output_format == 'json':
+			record = {'page': path.name, 'score': score}
+			if self.opts.get('snippets'):
+				record['snippet'] = snippet
+			print(json.dumps(record), flush=True)
 		else:
-			for path in sorted(selection, key=lambda p: p.name):
-				print(path.name)
+			fields = [path.name]
+			if self.opts.get("with-scores", False):
+				fields.insert(0, str(score))
+			if self.opts.get('snippets'):
+				fields.append(snippet or '')
+			print('\t'.join(fields), flush=True)
 
 class IndexCommand(NotebookCommand):
 	'''Class implementing the C{--index} command'''
@@ -614,6 +723,7 @@ class IndexCommand(NotebookCommand):
 	arguments = ('NOTEBOOK',)
 	options = (
 		('flush', 'f', 'flush the index first and force re-building'),
+		('jobs=', 'j', 'number of processes to parse pages when re-building'),
 	)
 
 	def run(self):
@@ -629,10 +739,14 @@ class IndexCommand(NotebookCommand):
 		mylogger.setLevel(logging.DEBUG)
 		mylogger.addFilter(elevate_index_logging)
 
+		jobs = int(self.opts.get('jobs', 1))
+		if jobs < 1:
+			raise UsageError('--jobs should be a positive number')
+
 		notebook, x = self.build_notebook(ensure_uptodate=False)
 		if self.opts.get('flush'):
 			notebook.index.flush()
-			notebook.index.update()
+			notebook.index.update(jobs=jobs)
 		else:
 			# Effectively the same as check_and_update_index ui action
 			logger.info('Checking notebook index')
@@ -12,6 +12,12 @@ except ImportError:
 
 
 import os
+import sys
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
 import logging
 
 logger = logging.getLogger('zim.newfs.helpers')
@@ -20,7 +26,7 @@ logger = logging.getLogger('zim.newfs.helpers')
 from zim.signals import SignalEmitter, SIGNAL_NORMAL
 from zim.errors import Error
 
-from .local import LocalFSObjectBase
+from .local import LocalFSObjectBase, LocalFolder, LocalFile
 
 
 class FileTreeWatcher(SignalEmitter):
@@ -40,6 +46,227 @@ class FileTreeWatcher(SignalEmitter):
 	} #: signals supported by this class
 
 
+class InotifyNotSupportedError(Error):
+	'''Error raised when the inotify API is not available on this
+	platform
+	'''
+	pass
+
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_IN_WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+	| IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_IN_EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+def _get_libc():
+	if not sys.platform.startswith('linux'):
+		raise InotifyNotSupportedError('inotify is only supported on Linux')
+
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		libc.inotify_init1.argtypes = (ctypes.c_int,)
+		libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+		libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+	except (OSError, AttributeError):
+		raise InotifyNotSupportedError('inotify not found in libc')
+	return libc
+
+
+class InotifyTreeWatcher(SignalEmitter):
+	'''Helper object that watches a folder and all sub-folders for
+	changes made by other processes using the Linux "inotify" API.
+	Complements L{FileTreeWatcher}, which only sees changes made through
+	zim's own file system objects, and supports the same signals.
+
+	Hidden files and folders are ignored, like they are ignored when
+	listing a folder. Moves are reported as "removed" for the old
+	location and "created" for the new location.
+
+	If the kernel event queue overflows, events are lost and the
+	"overflow" signal is emitted; the owner should fall back to a full
+	check of the tree.
+
+	Events are processed by L{process_events()}. When C{start()} is
+	called with C{mainloop=True} this is triggered from the main loop,
+	else the owner needs to call it.
+
+	@signal: C{created (file)}: new file or folder
+	@signal: C{changed (file)}: file content or attributes changed
+	@signal: C{removed (file)}: file or folder was removed
+	@signal: C{overflow ()}: events were lost
+	'''
+
+	__signals__ = {
+		'created': (SIGNAL_NORMAL, None, (object,)),
+		'changed': (SIGNAL_NORMAL, None, (object,)),
+		'moved': (SIGNAL_NORMAL, None, (object, object)),
+		'removed': (SIGNAL_NORMAL, None, (object,)),
+		'overflow': (SIGNAL_NORMAL, None, ()),
+	} #: signals supported by this class
+
+	def __init__(self, folder):
+		'''Constructor
+		@param folder: a L{LocalFolder} to watch
+		@raises InotifyNotSupportedError: if not supported on this platform
+		'''
+		assert isinstance(folder, LocalFolder)
+		self.folder = folder
+		self._libc = _get_libc()
+		self._fd = None
+		self._source_id = None
+		self._watches = {} # wd -> path
+
+	@property
+	def running(self):
+		return self._fd is not None
+
+	def start(self, mainloop=True):
+		'''Start watching the folder
+		@param mainloop: if C{True} events are processed from the
+		main loop
+		'''
+		if self._fd is not None:
+			return
+
+		fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if fd < 0:
+			raise InotifyNotSupportedError(os.strerror(ctypes.get_errno()))
+		self._fd = fd
+		self._add_watch_recursive(self.folder.path)
+
+		if mainloop:
+			assert GObject, 'mainloop requires gobject'
+			self._source_id = GObject.io_add_watch(
+				self._fd, GObject.IO_IN, self._on_io_in
+			)
+		logger.debug('Watching %i folders in %s', len(self._watches), self.folder)
+
+	def stop(self):
+		'''Stop watching and release all resources'''
+		if self._source_id is not None:
+			GObject.source_remove(self._source_id)
+			self._source_id = None
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+		self._watches.clear()
+
+	def _on_io_in(self, fd, condition):
+		self.process_events()
+		return self.running # keep watch
+
+	def _add_watch_recursive(self, path):
+		wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _IN_WATCH_MASK)
+		if wd < 0:
+			logger.warning('Could not watch folder: %s', path)
+			return
+		self._watches[wd] = path
+		try:
+			names = os.listdir(path)
+		except OSError:
+			return
+		for name in names:
+			if not _is_hidden(name):
+				childpath = os.path.join(path, name)
+				if os.path.isdir(childpath) and not os.path.islink(childpath):
+					self._add_watch_recursive(childpath)
+
+	def process_events(self, timeout=0):
+		'''Read pending events and emit signals
+		@param timeout: time in seconds to wait for events
+		@returns: the number of signals emitted
+		'''
+		if self._fd is None:
+			return 0
+
+		r, w, x = select.select([self._fd], [], [], timeout)
+		if not r:
+			return 0
+
+		count = 0
+		while True:
+			try:
+				data = os.read(self._fd, 65536)
+			except BlockingIOError:
+				break
+			except OSError as error:
+				if error.errno == errno.EINTR:
+					continue
+				raise
+
+			offset = 0
+			while offset < len(data):
+				wd, mask, cookie, length = _IN_EVENT_HEADER.unpack_from(data, offset)
+				offset += _IN_EVENT_HEADER.size
+				name = data[offset:offset+length].rstrip(b'\0')
+				offset += length
+				count += self._dispatch(wd, mask, os.fsdecode(name))
+
+		return count
+
+	def _dispatch(self, wd, mask, name):
+		if mask & IN_Q_OVERFLOW:
+			logger.warning('File system events were lost for: %s', self.folder)
+			self.emit('overflow')
+			return 1
+		elif mask & IN_IGNORED:
+			self._watches.pop(wd, None)
+			return 0
+
+		path = self._watches.get(wd)
+		if path is None:
+			return 0 # watch was removed already
+		elif not name:
+			return 0 # event on the folder itself, handled by parent
+		elif _is_hidden(name):
+			return 0
+
+		path = os.path.join(path, name)
+		isdir = mask & IN_ISDIR
+		obj = LocalFolder(path) if isdir else LocalFile(path)
+
+		if mask & (IN_CREATE | IN_MOVED_TO):
+			if isdir:
+				self._add_watch_recursive(path)
+			self.emit('created', obj)
+		elif mask & (IN_DELETE | IN_MOVED_FROM):
+			if isdir:
+				for w, p in list(self._watches.items()):
+					if p == path or p.startswith(path + os.sep):
+						self._libc.inotify_rm_watch(self._fd, w)
+						self._watches.pop(w, None)
+			self.emit('removed', obj)
+		elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+			self.emit('changed', obj)
+		else:
+			return 0
+
+		return 1
+
+
+def _is_hidden(name):
+	# Same filter as used for listing folders
+	return name[0] in ('.', '~') or name[-1] == '~'
+
+
 class TrashNotSupportedError(Error):
 	'''Error raised when trashing is not supported and delete should
 	be used instead
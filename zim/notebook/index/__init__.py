@@ -4,7 +4,12 @@
 
 
 import sqlite3
+import threading
+import queue
+import time
 import logging
+import contextlib
+import urllib.request
 
 logger = logging.getLogger('zim.notebook.index')
 
@@ -14,7 +19,8 @@ except ImportError:
 	GObject = None
 
 
-from zim.newfs import LocalFile, File, Folder, FileNotFoundError
+from zim.newfs import LocalFile, LocalFolder, File, Folder, FileNotFoundError
+from zim.newfs.helpers import InotifyTreeWatcher, InotifyNotSupportedError
 from zim.signals import SignalEmitter
 from zim.base.naturalsort import natural_sort_key
 
@@ -25,12 +31,73 @@ from .base import *
 from .pages import *
 from .links import *
 from .tags import *
+from .words import *
 
 
-DB_VERSION = '0.8'
+DB_VERSION = '0.10'
 DB_SORTKEY_CONTENT = 'text_1.2.3_unicode_αβγ_žžž'
 
 
+class ThreadConnection(object):
+	'''Proxy for the database connection of an L{Index} that can be
+	shared by index views used from multiple threads. In the thread
+	that created the index, calls go to the main connection, in other
+	threads they go to a read-only connection for that thread, see
+	L{Index.get_readonly_connection()}.
+	'''
+
+	def __init__(self, index):
+		self._index = index
+
+	def __getattr__(self, name):
+		if threading.get_ident() == self._index._db_thread:
+			db = self._index._db
+		else:
+			db = self._index.get_readonly_connection()
+		return getattr(db, name)
+
+
+class BatchedCommitConnection(sqlite3.Connection):
+	'''Database connection that can combine multiple calls to
+	C{commit()} in one transaction. When batching is enabled with
+	L{set_batch()}, the actual commit only happens every C{batch_size}
+	calls or when more than C{max_delay} seconds have passed. Use
+	L{flush()} to force a commit. By default every call commits.
+	'''
+
+	def __init__(self, *arg, **kwarg):
+		sqlite3.Connection.__init__(self, *arg, **kwarg)
+		self.batch_size = 1
+		self.max_delay = None
+		self.on_flush = None
+		self._n_pending = 0
+		self._last_flush = time.time()
+
+	def set_batch(self, batch_size, max_delay=None):
+		'''Set commit batching
+		@param batch_size: number of calls to C{commit()} to combine,
+		C{1} to disable batching
+		@param max_delay: max number of seconds before a commit, or C{None}
+		'''
+		assert batch_size >= 1
+		self.batch_size = batch_size
+		self.max_delay = max_delay
+
+	def commit(self):
+		self._n_pending += 1
+		if self._n_pending >= self.batch_size \
+		or (self.max_delay is not None and time.time() - self._last_flush > self.max_delay):
+			self.flush()
+
+	def flush(self):
+		'''Commit now and call the C{on_flush} callback'''
+		sqlite3.Connection.commit(self)
+		self._n_pending = 0
+		self._last_flush = time.time()
+		if self.on_flush is not None:
+			self.on_flush()
+
+
 class Index(SignalEmitter):
 	'''The Index keeps a cache of all pages in a notebook store, all
 	links between pages and all tags. This data is used to speed up
@@ -48,21 +115,37 @@ class Index(SignalEmitter):
 
 	@signal: C{new-update-iter (update_iter)}: signal used for plugins wanting
 	to extend the indexer
+	@signal: C{new-thread-update-iter (update_iter)}: like C{new-update-iter}
+	but for the update iter used by an L{IndexUpdateThread}; plugins that
+	do not add their indexer here prevent the use of the thread
 	@signal: C{changed ()}: emitted after changes have been committed
+
+	@ivar generation: counter that is increased on each change of the
+	index, can be used to check whether data derived from the index is
+	still valid
 	'''
 
 	__signals__ = {
 		'new-update-iter': (None, None, (object,)),
+		'new-thread-update-iter': (None, None, (object,)),
 		'changed': (None, None, ()),
 	}
 
-	def __init__(self, dbpath, layout):
+	def __init__(self, dbpath, layout, readonly=False):
 		'''Constructor
 		@param dbpath: a file path for the sqlite db, or C{":memory:"}
 		@param layout: a L{NotebookLayout} instance to index
+		@param readonly: if C{True} the database is opened with a
+		read-only connection, e.g. for worker processes that only
+		query an index maintained by another process. Such an index
+		can not be updated and the database must exist.
 		'''
+		assert not (readonly and dbpath == ':memory:')
 		self.dbpath = dbpath
 		self.layout = layout
+		self.readonly = readonly
+		self.generation = 0
+		self._db_thread = threading.get_ident()
 		self._db_connect()
 		if not hasattr(self, 'update_iter'):
 			self._update_iter_init()
@@ -70,6 +153,9 @@ class Index(SignalEmitter):
 
 		self._checker = FilesIndexChecker(self._db, self.layout.root)
 		self.background_check = BackgroundCheck(self._checker, None)
+		self._watcher = None
+		self._watcher_overflow = False
+		self._readonly_connections = threading.local()
 
 	def _update_iter_init(self):
 		self.update_iter = IndexUpdateIter(self._db, self.layout)
@@ -77,13 +163,26 @@ class Index(SignalEmitter):
 		self.emit('new-update-iter', self.update_iter)
 
 	def on_commit(self, iter):
+		self.generation += 1
 		self.emit('changed')
 
+	def _commit_now(self):
+		# Commit even while the update iter is batching commits, so
+		# interactive changes are visible to other connections right away
+		if isinstance(self._db, BatchedCommitConnection):
+			self._db.flush()
+		else:
+			self._db.commit()
+
 	def _db_connect(self):
 		# NOTE: for a locked database, different errors happen on linux and
 		# on windows, so test both platforms when modifying here
 
-		if self.dbpath != ':memory:':
+		if self.readonly:
+			logger.debug('Connecting read-only to database file: %s', self.dbpath)
+			self._db = self._db_connect_readonly()
+			return
+		elif self.dbpath != ':memory:':
 			logger.debug('Connecting to database file: %s', self.dbpath)
 			file = LocalFile(self.dbpath)
 			file.parent().touch()
@@ -91,16 +190,14 @@ class Index(SignalEmitter):
 			logger.debug('Connecting to in-memory database')
 
 		try:
-			self._db = sqlite3.Connection(self.dbpath)
+			self._db = BatchedCommitConnection(self.dbpath)
 		except:
 			self._db_recover()
 
 		self._db.row_factory = sqlite3.Row
 
 		try:
-			self._db.execute('PRAGMA synchronous=OFF;')
-			# Don't wait for disk writes, we can recover from crashes
-			# anyway. Allows us to use commit more frequently.
+			self._db_set_pragmas(self._db)
 
 			if self.get_property('db_version') != DB_VERSION:
 				logger.info('Index db_version out of date')
@@ -110,6 +207,7 @@ class Index(SignalEmitter):
 				self._db_init()
 
 			self.set_property('db_version', DB_VERSION) # Ensure we can write
+			self._db.commit()
 		except sqlite3.OperationalError:
 			# db is there but table does not exist
 			logger.debug('Operational error, init tabels')
@@ -120,6 +218,15 @@ class Index(SignalEmitter):
 		except sqlite3.DatabaseError:
 			self._db_recover()
 
+	@staticmethod
+	def _db_set_pragmas(db):
+		db.execute('PRAGMA synchronous=OFF;')
+			# Don't wait for disk writes, we can recover from crashes
+			# anyway. Allows us to use commit more frequently.
+		db.execute('PRAGMA journal_mode=WAL;')
+			# Readers and writer do not block each other, no-op for
+			# in-memory database
+
 	def _db_recover(self):
 		assert not self.dbpath == ':memory:'
 		file = LocalFile(self.dbpath)
@@ -127,14 +234,54 @@ class Index(SignalEmitter):
 			logger.warning('Overwriting possibly corrupt database: %s', self.dbpath)
 		try:
 			file.remove(cleanup=False)
+			for suffix in ('-wal', '-shm'):
+				other = LocalFile(self.dbpath + suffix)
+				if other.exists():
+					other.remove(cleanup=False)
 		except:
 			logger.error('Could not access database file, running in-memory database')
 			self.dbpath = ':memory:'
 		finally:
-			self._db = sqlite3.Connection(self.dbpath)
+			self._db = BatchedCommitConnection(self.dbpath)
 			self._db.row_factory = sqlite3.Row
+			self._db_set_pragmas(self._db)
 			self._db_init()
 
+	def get_readonly_connection(self):
+		'''Returns a read-only database connection for use by index
+		views in the current thread. Thanks to the WAL journal mode
+		readers on this connection do not wait for an ongoing index
+		update, but they also do not see changes before they are
+		committed. For an in-memory database the main connection
+		is returned.
+		'''
+		if self.dbpath == ':memory:' or self.readonly:
+			return self._db
+
+		db = getattr(self._readonly_connections, 'db', None)
+		if db is None:
+			db = self._db_connect_readonly()
+			self._readonly_connections.db = db
+		return db
+
+	def get_thread_connection(self):
+		'''Returns a L{ThreadConnection} for index views that are
+		used from multiple threads, e.g. by the request threads of the
+		web server. Other threads only get read access.
+		@raises AssertionError: for an in-memory database, which can
+		not be shared between threads
+		'''
+		assert self.dbpath != ':memory:', 'In-memory index can not be used from other threads'
+		return ThreadConnection(self)
+
+	def _db_connect_readonly(self):
+		db = sqlite3.connect(
+			'file:%s?mode=ro' % urllib.request.pathname2url(self.dbpath),
+			uri=True
+		)
+		db.row_factory = sqlite3.Row
+		return db
+
 	def _db_init(self):
 		tables = [r[0] for r in self._db.execute(
 			'SELECT name FROM sqlite_master '
@@ -172,9 +319,12 @@ class Index(SignalEmitter):
 	def is_uptodate(self):
 		return self.update_iter.is_uptodate()
 
-	def update(self):
-		'''Update all data in the index'''
-		self.update_iter.update()
+	def update(self, jobs=None):
+		'''Update all data in the index
+		@param jobs: number of worker processes used to parse pages,
+		see L{IndexUpdateIter.update()}
+		'''
+		self.update_iter.update(jobs=jobs)
 
 	def check_and_update(self):
 		'''Check and update all data in the index'''
@@ -183,6 +333,24 @@ class Index(SignalEmitter):
 	def check_and_update_iter(self):
 		return self.update_iter.check_and_update_iter()
 
+	def update_thread(self, check=False):
+		'''Get an L{IndexUpdateThread} to run an update in a separate
+		thread
+		@param check: if C{True} check and update, else only update
+		@returns: an L{IndexUpdateThread} or C{None} when not supported,
+		e.g. for an in-memory database
+		'''
+		if self.dbpath == ':memory:':
+			return None
+
+		thread = IndexUpdateThread(self, check)
+		if thread.is_supported():
+			return thread
+		else:
+			logger.debug('Plugin indexers do not support update thread')
+			thread.close()
+			return None
+
 	def check_async(self, notebook, paths, recursive=False):
 		assert GObject, 'async operation requires gobject mainloop'
 		for path in paths:
@@ -190,6 +358,19 @@ class Index(SignalEmitter):
 			self._checker.queue_check(file, recursive=recursive)
 			self._checker.queue_check(folder, recursive=recursive)
 
+		self._start_background_check(notebook)
+
+	def check_files_async(self, notebook, files):
+		'''Like L{check_async()} but takes file and folder objects
+		instead of page paths. Folders are checked recursively.
+		'''
+		assert GObject, 'async operation requires gobject mainloop'
+		for file in files:
+			self._checker.queue_check(file, recursive=isinstance(file, Folder))
+
+		self._start_background_check(notebook)
+
+	def _start_background_check(self, notebook):
 		self.background_check.callback = lambda *a: on_out_of_date_found(notebook, self.background_check)
 				# XXX: should go via constructor, but there notebook is not known
 		self.background_check.start()
@@ -198,6 +379,7 @@ class Index(SignalEmitter):
 		'''Delete all data in the index'''
 		logger.info('Flushing index')
 		self._db_init()
+		self.generation += 1
 
 	def flag_reindex(self):
 		'''This methods flags all pages with content to be re-indexed.
@@ -207,22 +389,78 @@ class Index(SignalEmitter):
 		'''
 		from .files import STATUS_NEED_UPDATE
 		self._db.execute(
-			'UPDATE files SET index_status = ?'
+			'UPDATE files SET index_status = ?, digest = NULL '
 			'WHERE id IN (SELECT source_file FROM pages)',
 			(STATUS_NEED_UPDATE,)
 		)
+		self.generation += 1
 
 	def start_background_check(self, notebook):
+		'''Check the whole notebook for changes in the background.
+		Where supported this also starts an L{InotifyTreeWatcher} that
+		keeps the index up to date afterwards. As long as this watcher
+		is running, calling this method again is a no-op. So the full
+		check is only done when the watcher has been offline.
+		'''
+		if self._watcher is not None and not self._watcher_overflow:
+			return # watcher is keeping the index up to date
+
+		if self._watcher is None:
+			self._watcher = self._start_watcher(notebook)
+		self._watcher_overflow = False
 		self.check_async(notebook, [Path(':')], recursive=True)
 
+	def _start_watcher(self, notebook):
+		if not isinstance(self.layout.root, LocalFolder):
+			return None
+
+		try:
+			watcher = InotifyTreeWatcher(self.layout.root)
+			watcher.start()
+		except InotifyNotSupportedError as error:
+			logger.debug('No file system watcher: %s', error)
+			return None
+
+		def on_change(o, file):
+			self.check_files_async(notebook, [file])
+
+		def on_overflow(o):
+			self._watcher_overflow = True
+			self.start_background_check(notebook)
+
+		for signal in ('created', 'changed', 'removed'):
+			watcher.connect(signal, on_change)
+		watcher.connect('overflow', on_overflow)
+		return watcher
+
 	def stop_background_check(self):
 		self.background_check.stop()
-
-	def update_file(self, file):
+		if self._watcher is not None:
+			self._watcher.stop()
+			self._watcher = None
+
+	def update_file(self, file, parsetree=None, etag=None):
+		'''Update the index for a single file or folder
+		@param file: a L{File} or L{Folder} object
+		@param parsetree: optional L{ParseTree} for the content of a
+		page source file, if given the file is not parsed again
+		@param etag: the etag as given by C{write_with_etag()} when
+		C{parsetree} was written, required with C{parsetree}. The tree
+		is only used if the file still matches this etag.
+		'''
 		if not file.exists():
 			return self.remove_file(file)
 
 		path = file.relpath(self.layout.root)
+		if parsetree is not None:
+			assert etag is not None, 'parsetree requires etag'
+			self.update_iter.pages.set_stored_parsetree(path, parsetree, etag)
+		try:
+			self._update_file(file, path, etag)
+		finally:
+			self.update_iter.pages.set_stored_parsetree(path, None, None)
+
+	def _update_file(self, file, path, etag=None):
 		row = self._db.execute('SELECT id FROM files WHERE path=?', (path,)).fetchone()
 
 		filesindexer = self.update_iter.files
@@ -230,14 +468,14 @@ class Index(SignalEmitter):
 		if row:
 			node_id = row[0]
 			if isinstance(file, File):
-				filesindexer.update_file(node_id, file)
+				filesindexer.update_file(node_id, file, etag)
 			elif isinstance(file, Folder):
 				filesindexer.update_folder(node_id, file)
 			else:
 				raise TypeError
 		else:
 			if isinstance(file, File):
-				filesindexer.interactive_add_file(file)
+				filesindexer.interactive_add_file(file, etag)
 			elif isinstance(file, Folder):
 				filesindexer.interactive_add_folder(file)
 			else:
@@ -246,7 +484,7 @@ class Index(SignalEmitter):
 		for i in self.update_iter.partial_update_iter():
 			pass
 
-		self._db.commit()
+		self._commit_now()
 		self.on_commit(None)
 
 	def remove_file(self, file):
@@ -268,7 +506,7 @@ class Index(SignalEmitter):
 		for i in self.update_iter.partial_update_iter():
 			pass
 
-		self._db.commit()
+		self._commit_now()
 		self.on_commit(None)
 
 	def file_moved(self, oldfile, newfile):
@@ -304,30 +542,56 @@ class Index(SignalEmitter):
 				(ROOT_ID, pid, HREF_REL_ABSOLUTE, path.name)
 			)
 
-		self._db.commit()
+		self._commit_now()
 		self.on_commit(None)
 
 
 class IndexUpdateIter(SignalEmitter):
+	'''Object that drives the indexers to update the index.
+
+	While iterating, commits made by the indexers are combined in
+	batches of C{commit_batch_size} commits, or C{commit_max_delay}
+	seconds per transaction, if the database connection is a
+	L{BatchedCommitConnection}. Larger batches give better throughput,
+	smaller batches make changes visible to other connections sooner.
+
+	@signal: C{commit ()}: emitted when an update is done
+	'''
 
 	__signals__ = {
 		'commit': (None, None, ()),
 	}
 
+	COMMIT_BATCH_SIZE = 100 #: default for C{commit_batch_size}
+	COMMIT_MAX_DELAY = 0.5 #: default for C{commit_max_delay}
+
 	def __init__(self, db, layout):
 		self.db = db
 		self.layout = layout
-		self.files = FilesIndexer(db, layout.root)
+		self.commit_batch_size = self.COMMIT_BATCH_SIZE
+		self.commit_max_delay = self.COMMIT_MAX_DELAY
+		self.files = FilesIndexer(db, layout.root, layout)
 		self.pages = PagesIndexer(db, layout, self.files)
 		self.links = LinksIndexer(db, self.pages)
 		self.tags = TagsIndexer(db, self.pages)
-		self._indexers = [self.files, self.pages, self.links, self.tags]
+		self.words = WordsIndexer(db, self.pages)
+		self._indexers = [self.files, self.pages, self.links, self.tags, self.words]
+		self._check_content_facets()
 
 	def add_indexer(self, indexer):
 		self._indexers.append(indexer)
+		self._check_content_facets()
 
 	def remove_indexer(self, indexer):
 		self._indexers.remove(indexer)
+		self._check_content_facets()
+
+	def _check_content_facets(self):
+		# Pages only need a full parse tree if an indexer asks for it
+		self.pages.use_scanner = all(
+			indexer.CONTENT_FACETS is not None
+				for indexer in self._indexers if isinstance(indexer, IndexerBase)
+		)
 
 	def get_indexer(self, cls):
 		for indexer in self._indexers:
@@ -343,15 +607,77 @@ class IndexUpdateIter(SignalEmitter):
 		return self
 
 	def __iter__(self):
-		for indexer in self._indexers:
-			for i in indexer.update_iter():
+		with self._batched_commits():
+			for indexer in self._indexers:
+				for i in indexer.update_iter():
+					yield
+		self.emit('commit')
+
+	@contextlib.contextmanager
+	def _batched_commits(self):
+		if isinstance(self.db, BatchedCommitConnection) and self.db.batch_size == 1:
+			self.db.set_batch(self.commit_batch_size, self.commit_max_delay)
+			try:
 				yield
+			finally:
+				self.db.set_batch(1)
+				self.db.flush()
+		else:
+			yield # no batching support, or nested
+
+	def update(self, jobs=None):
+		'''Convenience method to do a full update at once
+		@param jobs: if larger than 1, page sources are parsed by a pool
+		of this many worker processes while this process remains the
+		only one writing to the database. Mainly useful for re-building
+		the index from scratch.
+		'''
+		if jobs and jobs > 1:
+			for i in self.parallel_update_iter(jobs):
+				pass
+		else:
+			for i in self:
+				pass
+
+	def parallel_update_iter(self, jobs):
+		'''Like L{__iter__()} but parses page sources in a
+		L{PageParserPool} with C{jobs} worker processes
+		'''
+		pool = PageParserPool(self.layout, jobs, scan=self.pages.use_scanner)
+		self.pages.parser_pool = pool
+		try:
+			with self._batched_commits():
+				queued = False
+				for i in self.files.update_iter():
+					if not queued and self._folders_uptodate():
+						# All folders are indexed first, at this point all
+						# files that need an update are known
+						pool.queue(self._files_need_update())
+						queued = True
+					yield
+
+				for indexer in self._indexers[1:]:
+					for i in indexer.update_iter():
+						yield
+		finally:
+			self.pages.parser_pool = None
+			pool.close()
+
 		self.emit('commit')
 
-	def update(self):
-		'''Convenience method to do a full update at once'''
-		for i in self:
-			pass
+	def _folders_uptodate(self):
+		row = self.db.execute(
+			'SELECT id FROM files WHERE index_status=? AND node_type=?',
+			(STATUS_NEED_UPDATE, TYPE_FOLDER)
+		).fetchone()
+		return row is None
+
+	def _files_need_update(self):
+		return [r[0] for r in self.db.execute(
+			'SELECT path FROM files WHERE index_status=? AND node_type=?'
+			' ORDER BY id',
+			(STATUS_NEED_UPDATE, TYPE_FILE)
+		)]
 
 	def check_and_update(self, file=None):
 		'''Convenience method to do a full update and check at once'''
@@ -359,16 +685,17 @@ class IndexUpdateIter(SignalEmitter):
 			pass
 
 	def check_and_update_iter(self, file=None):
-		checker = FilesIndexChecker(self.db, self.layout.root)
-		checker.queue_check(file=file)
-		for out_of_date in checker.check_iter():
-			yield
-			if out_of_date:
-				for i in self.files.update_iter():
-					yield
+		with self._batched_commits():
+			checker = FilesIndexChecker(self.db, self.layout.root)
+			checker.queue_check(file=file)
+			for out_of_date in checker.check_iter():
+				yield
+				if out_of_date:
+					for i in self.files.update_iter():
+						yield
 
-		for i in self.partial_update_iter():
-			yield
+			for i in self.partial_update_iter():
+				yield
 
 		self.emit('commit')
 
@@ -379,6 +706,148 @@ class IndexUpdateIter(SignalEmitter):
 				yield
 
 
+class IndexUpdateThread(object):
+	'''Runs an index update in a separate thread with its own
+	database connection, so parsing pages and writing the database do
+	not block the main loop.
+
+	The thread uses its own L{IndexUpdateIter}. Signals of the indexers
+	in this iter are collected and re-emitted by their counterparts in
+	C{index.update_iter} after the changes have been committed. So
+	listeners of the main update iter, like tree models and plugins,
+	get the same signals as for an update in the main thread. Indexers
+	of the main update iter do not get these signals, their work is
+	done in the thread. While signals are re-emitted, the thread waits,
+	so the database state matches what the signals describe.
+
+	Iterating this object in the main thread starts the thread and
+	yields until it is done, re-emitting signals in each step. This
+	makes it a drop-in replacement for the iterator of an
+	L{IndexUpdateOperation}.
+	'''
+
+	def __init__(self, index, check=False):
+		'''Constructor
+		@param index: the L{Index}, must use a database file
+		@param check: if C{True} check and update, else only update
+		'''
+		assert index.dbpath != ':memory:'
+		self.index = index
+		self.check = check
+		self.error = None
+		self._signals = []
+		self._queue = queue.Queue()
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._thread_main)
+		self._thread.daemon = True
+
+		index._commit_now() # release any pending write lock
+		self.db = sqlite3.connect(
+			index.dbpath,
+			check_same_thread=False,
+			factory=BatchedCommitConnection
+		)
+		self.db.row_factory = sqlite3.Row
+		index._db_set_pragmas(self.db)
+		self.db.on_flush = self._on_flush
+		self.update_iter = IndexUpdateIter(self.db, index.layout)
+		index.emit('new-thread-update-iter', self.update_iter)
+		self.db.flush()
+
+		self._main_objects = [index.update_iter] + index.update_iter._indexers
+		self._relay(self.update_iter, index.update_iter)
+		for indexer in self.update_iter._indexers:
+			target = index.update_iter.get_indexer(type(indexer))
+			if target is not None and type(target) is type(indexer):
+				self._relay(indexer, target)
+
+	def _relay(self, source, target):
+		for signal in source.__signals__:
+			source.connect(signal, lambda o, *a, s=signal: self._signals.append((target, s, a)))
+
+	def is_supported(self):
+		'''Returns C{True} if all indexers of the main update iter have
+		a counterpart in the thread
+		'''
+		mine = set(type(i) for i in self.update_iter._indexers)
+		return all(type(i) in mine for i in self.index.update_iter._indexers)
+
+	def close(self):
+		self.db.close()
+
+	def _thread_main(self):
+		try:
+			if self.check:
+				my_iter = self.update_iter.check_and_update_iter()
+			else:
+				my_iter = iter(self.update_iter)
+			for i in my_iter:
+				if self._stop.is_set():
+					break
+			self.db.flush()
+		except Exception as error:
+			logger.exception('Error in index update thread')
+			self.error = error
+		finally:
+			self.db.close()
+			self._queue.put(None)
+
+	def _on_flush(self):
+		# Called in the thread, block until main loop replayed signals.
+		# When stopped, do not wait, the main thread replays the queue
+		# after the thread is done.
+		if self._signals:
+			signals, self._signals = self._signals, []
+			done = threading.Event()
+			self._queue.put((signals, done))
+			while not (done.is_set() or self._stop.is_set()):
+				done.wait(0.1)
+
+	def _replay(self, item):
+		signals, done = item
+		for target, signal, args in signals:
+			target.emit_excluding(signal, self._main_objects, *args)
+		done.set()
+
+	def __iter__(self):
+		self._thread.start()
+		try:
+			while True:
+				try:
+					item = self._queue.get(timeout=0.01)
+				except queue.Empty:
+					yield
+					continue
+
+				if item is None:
+					break # thread done
+				self._replay(item)
+				yield
+		finally:
+			if self._thread.is_alive():
+				logger.debug('Index update thread cancelled')
+				self._stop.set()
+				self._thread.join()
+
+			# Changes committed after the main loop stopped waiting
+			# still need their signals
+			while True:
+				try:
+					item = self._queue.get_nowait()
+				except queue.Empty:
+					break
+				if item is not None:
+					self._replay(item)
+
+		if self.error:
+			raise self.error
+
+	def update(self):
+		'''Convenience method to run the thread and wait for it'''
+		for i in self:
+			pass
+
+
 class BackgroundCheck(object):
 
 	def __init__(self, checker, callback):
@@ -437,10 +906,18 @@ class IndexUpdateOperation(NotebookOperation):
 		)
 
 	def _get_iter(self, notebook):
-		return iter(notebook.index.update_iter)
+		thread = notebook.index.update_thread()
+		if thread is not None:
+			return iter(thread)
+		else:
+			return iter(notebook.index.update_iter)
 
 
 class IndexCheckAndUpdateOperation(IndexUpdateOperation):
 
 	def _get_iter(self, notebook):
-		return notebook.index.check_and_update_iter()
+		thread = notebook.index.update_thread(check=True)
+		if thread is not None:
+			return iter(thread)
+		else:
+			return notebook.index.check_and_update_iter()
@@ -35,10 +35,18 @@ class IndexView(object):
 class IndexerBase(SignalEmitter, ConnectorMixin):
 	'''Base class for "content indexer" objects.
 	It defines the callback functions that are calls from L{PagesIndexer}
+
+	@cvar CONTENT_FACETS: the parts of the page content that the indexer
+	uses, any of "links", "tags", "headings", "text" and "tasks" (see
+	L{ContentFacets}), or C{None} if the indexer needs the full
+	L{ParseTree}. When all indexers declare their facets, pages are
+	scanned instead of parsed when the index is updated.
 	'''
 
 	__signals__ = {}
 
+	CONTENT_FACETS = None
+
 	def __init__(self, db):
 		self.db = db
 
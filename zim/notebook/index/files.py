@@ -1,6 +1,7 @@
 
 
 import os
+import hashlib
 import logging
 
 logger = logging.getLogger('zim.notebook.index')
@@ -22,10 +23,42 @@ STATUS_NEED_DELETION = 3
 TYPE_FOLDER = 1
 TYPE_FILE = 2
 
-from zim.newfs import File, Folder, SEP
+from zim.newfs import File, Folder, LocalFile, SEP
 from zim.signals import SignalEmitter
 
 
+DIGEST_CHUNK_SIZE = 2 ** 16
+
+
+def content_digest(file):
+	'''Compute the md5 digest of the text content of a file, this
+	matches the digest used in the etag from C{read_with_etag()} and
+	C{write_with_etag()}. Local files are read in chunks.
+	@param file: a L{File} object
+	@returns: the digest as hex string, or C{None} if the file can not
+	be decoded
+	'''
+	m = hashlib.md5()
+	try:
+		if isinstance(file, LocalFile):
+			with open(file.path, mode='r', encoding='UTF-8') as fh:
+				first = True
+				while True:
+					text = fh.read(DIGEST_CHUNK_SIZE)
+					if not text:
+						break
+					elif first:
+						text = text.lstrip('\ufeff')
+						first = False
+					m.update(text.replace('\x00', '').encode('UTF-8'))
+		else:
+			m.update(file.read().encode('UTF-8'))
+	except UnicodeDecodeError:
+		return None
+	else:
+		return m.hexdigest()
+
+
 class FilesIndexer(SignalEmitter):
 	'''Class that will update the "files" table in the index based on
 	changes seen on the file system.
@@ -50,9 +83,13 @@ class FilesIndexer(SignalEmitter):
 		'file-row-deleted': (None, None, (object,)),
 	}
 
-	def __init__(self, db, folder):
+	def __init__(self, db, folder, layout=None):
 		self.db = db
 		self.folder = folder
+		if layout is None:
+			from zim.notebook.layout import FilesLayout
+			layout = FilesLayout(folder)
+		self.layout = layout
 
 		self.db.executescript('''
 		CREATE TABLE IF NOT EXISTS files(
@@ -62,6 +99,8 @@ class FilesIndexer(SignalEmitter):
 			path TEXT UNIQUE NOT NULL,
 			node_type INTEGER NOT NULL,
 			mtime TIMESTAMP,
+			size INTEGER,
+			digest TEXT,
 
 			index_status INTEGER DEFAULT 3
 
@@ -130,7 +169,7 @@ class FilesIndexer(SignalEmitter):
 			self.db.commit()
 			yield
 
-	def interactive_add_file(self, file):
+	def interactive_add_file(self, file, etag=None):
 		assert isinstance(file, File) and file.exists()
 		parent_id = self._add_parent(file.parent())
 		path = file.relpath(self.folder)
@@ -145,7 +184,7 @@ class FilesIndexer(SignalEmitter):
 
 		self.emit('file-row-inserted', row)
 
-		self.update_file(row['id'], file)
+		self.update_file(row['id'], file, etag)
 
 	def interactive_add_folder(self, folder):
 		assert isinstance(folder, Folder) and folder.exists()
@@ -255,14 +294,56 @@ class FilesIndexer(SignalEmitter):
 
 		self.set_node_uptodate(node_id, mtime)
 
-	def update_file(self, node_id, file):
+	def update_file(self, node_id, file, etag=None):
+		'''Update a file row and emit "file-row-changed" if the content
+		changed. For page source files that changed mtime but not size
+		the content digest is compared, so e.g. a "touch" does not cause
+		a re-index. Other files, like attachments, are not read.
+		@param node_id: the row id of the file
+		@param file: the L{File} object
+		@param etag: optional etag as returned by C{write_with_etag()}
+		when the file was just written, used to avoid reading it again
+		'''
 		logger.debug('Index file: %s', file)
 		# get mtime before contents /signal
-		self.set_node_uptodate(node_id, file.mtime())
+		mtime = file.mtime()
+		size = file.size()
 		row = self.db.execute('SELECT * FROM files WHERE id=?', (node_id,)).fetchone()
 		assert row is not None, 'No row matching id: %r' % node_id
+
+		digest = None
+		if etag is not None and etag[0] == mtime:
+			digest = etag[1].hex()
+		elif row['size'] == size and row['mtime'] != mtime \
+			and self.layout.is_source_file(file):
+				# Size did not change, check whether the content did
+				digest = content_digest(file)
+				if digest is not None and digest == row['digest']:
+					# Only mtime changed, e.g. after "touch" or a checkout
+					logger.debug('File content unchanged: %s', file)
+					self.set_node_uptodate(node_id, mtime)
+					return
+
+		self.db.execute(
+			'UPDATE files SET index_status = ?, mtime = ?, size = ?, digest = ? WHERE id = ?',
+			(STATUS_UPTODATE, mtime, size, digest, node_id)
+		)
+		row = self.db.execute('SELECT * FROM files WHERE id=?', (node_id,)).fetchone()
 		self.emit('file-row-changed', row)
 
+	def set_node_digest(self, node_id, mtime, digest):
+		'''Record the content digest of a file, as found by reading it
+		@param node_id: the row id of the file
+		@param mtime: the mtime of the file when it was read, the
+		digest is ignored if the file changed since it was indexed
+		@param digest: the md5 of the text content as hex string, see
+		L{content_digest()}
+		'''
+		self.db.execute(
+			'UPDATE files SET digest = ? WHERE id = ? AND mtime = ?',
+			(digest, node_id, mtime)
+		)
+
 	def set_node_uptodate(self, node_id, mtime):
 		self.db.execute(
 			'UPDATE files SET index_status = ?, mtime = ? WHERE id = ?',
@@ -61,6 +61,8 @@ class LinksIndexer(IndexerBase):
 
 	__signals__ = {}
 
+	CONTENT_FACETS = ('links',)
+
 	def __init__(self, db, pagesindexer):
 		IndexerBase.__init__(self, db)
 		self._pages = PagesViewInternal(db)
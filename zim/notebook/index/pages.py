@@ -4,9 +4,11 @@
 
 from datetime import datetime
 from typing import Generator, Optional
+from collections import deque
 
 import sqlite3
 import logging
+import importlib
 
 logger = logging.getLogger('zim.notebook.index')
 
@@ -46,7 +48,13 @@ class PagesIndexer(IndexerBase):
 	@signal: C{page-row-delete (row)}: row to be deleted
 	@signal: C{page-row-deleted (row)}: row that has been deleted
 
-	@signal: C{page-changed (row, content)}: page contents changed
+	@signal: C{page-changed (row, content)}: page contents changed,
+	C{content} is a L{ParseTree}, or a L{ContentFacets} object when
+	C{use_scanner} is set
+
+	@ivar use_scanner: if C{True} page sources are scanned instead of
+	parsed, when the format supports it. Set by L{IndexUpdateIter} when
+	all indexers declare the C{CONTENT_FACETS} they need.
 	'''
 
 	__signals__ = {
@@ -57,9 +65,15 @@ class PagesIndexer(IndexerBase):
 		'page-changed': (None, None, (object, object))
 	}
 
+	CONTENT_FACETS = ()
+
 	def __init__(self, db, layout, filesindexer):
 		IndexerBase.__init__(self, db)
 		self.layout = layout
+		self.files = filesindexer
+		self.use_scanner = False
+		self.parser_pool = None # optional L{PageParserPool}
+		self._stored_trees = {}
 		self.connectto_all(filesindexer, (
 			'file-row-inserted', 'file-row-changed', 'file-row-deleted'
 		))
@@ -136,13 +150,44 @@ class PagesIndexer(IndexerBase):
 
 		if row['source_file'] == filerow['id']:
 			file = self.layout.root.file(filerow['path'])
-			format = self.layout.get_format(file)
 			mtime = file.mtime()
-			tree = format.Parser().parse(file.read(), file_input=True)
+			tree, etag = self._get_parsetree(filerow['path'], file, mtime)
+			if etag is not None:
+				# Record the digest while we have it, so a later change
+				# of only the mtime does not cause a re-index
+				self.files.set_node_digest(filerow['id'], etag[0], etag[1].hex())
 			self.update_page(pagename, mtime, tree)
 		else:
 			pass # some conflict file changed
 
+	def set_stored_parsetree(self, path, parsetree, etag):
+		'''Set a parse tree for a file that was just written, so the next
+		update for this file does not need to parse it again
+		@param path: file path relative to the notebook folder
+		@param parsetree: the L{ParseTree} that was written, or C{None}
+		to unset
+		@param etag: etag returned when writing the file
+		'''
+		if parsetree is None:
+			self._stored_trees.pop(path, None)
+		else:
+			self._stored_trees[path] = (parsetree, etag)
+
+	def _get_parsetree(self, path, file, mtime):
+		# Returns the tree and the etag from reading the file, if known
+		if path in self._stored_trees:
+			tree, etag = self._stored_trees.pop(path)
+			if etag[0] == mtime or file.verify_etag(etag):
+				return tree, None # digest was set from the etag already
+
+		if self.parser_pool is not None:
+			tree, etag = self.parser_pool.get(path, mtime)
+			if tree is not None:
+				return tree, etag
+
+		format = self.layout.get_format(file)
+		return _read_page_source(file, format, self.use_scanner)
+
 	def on_file_row_deleted(self, o, filerow):
 		pagename, file_type = self.layout.map_filepath(filerow['path'])
 		if file_type != FILE_TYPE_PAGE_SOURCE:
@@ -302,6 +347,117 @@ class PagesIndexer(IndexerBase):
 		)
 
 
+def _read_page_source(file, format, scan=False):
+	# Returns the tree and the etag from reading the file
+	text, etag = file.read_with_etag()
+	if scan and hasattr(format, 'Scanner'):
+		return format.Scanner().scan(text, file_input=True), etag
+	else:
+		return format.Parser().parse(text, file_input=True), etag
+
+
+def _parse_page_source(path, format_name, scan=False):
+	# Runs in a worker process of the L{PageParserPool}, so only
+	# picklable arguments and return values
+	from zim.newfs import LocalFile
+	file = LocalFile(path)
+	format = importlib.import_module(format_name)
+	return _read_page_source(file, format, scan)
+
+
+class PageParserPool(object):
+	'''Pool of worker processes that parse page source files ahead of
+	the L{PagesIndexer}. The indexer still does all database writes, it
+	only picks up the pre-parsed tree instead of parsing the file itself.
+
+	Files are parsed in the order they are queued, with at most
+	C{window} files in flight, so the indexer should request them in
+	roughly the same order to keep the workers busy. Results are only
+	used when the mtime of the file did not change in between, else
+	the indexer falls back to parsing the file itself.
+	'''
+
+	def __init__(self, layout, jobs, window=None, scan=False):
+		'''Constructor
+		@param layout: a L{NotebookLayout}
+		@param jobs: number of worker processes
+		@param window: max number of files queued in the pool at once,
+		defaults to 16 times C{jobs}
+		@param scan: if C{True} give L{ContentFacets} instead of parse
+		trees, for formats that support it
+		'''
+		from concurrent.futures import ProcessPoolExecutor
+		self.layout = layout
+		self.scan = scan
+		self.jobs = jobs
+		self.window = window or jobs * 16
+		self._executor = ProcessPoolExecutor(max_workers=jobs)
+		self._queue = deque()
+		self._queued = set()
+		self._futures = {}
+
+	def queue(self, paths):
+		'''Queue files for parsing
+		@param paths: list of file paths relative to the notebook folder,
+		files that are not page sources are ignored
+		'''
+		for path in paths:
+			pagename, file_type = self.layout.map_filepath(path)
+			if file_type == FILE_TYPE_PAGE_SOURCE and path not in self._queued:
+				self._queue.append(path)
+				self._queued.add(path)
+		self._fill()
+
+	def _fill(self):
+		while self._queue and len(self._futures) < self.window:
+			path = self._queue.popleft()
+			file = self.layout.root.file(path)
+			try:
+				format = self.layout.get_format(file)
+			except AssertionError:
+				continue
+			self._futures[path] = self._executor.submit(
+				_parse_page_source, file.path, format.__name__, self.scan
+			)
+
+	def get(self, path, mtime):
+		'''Get the parse tree for a file
+		@param path: file path relative to the notebook folder
+		@param mtime: the current mtime of the file
+		@returns: a 2-tuple of a L{ParseTree} and the etag from reading
+		the file, or C{(None, None)} if the file was not queued, has
+		changed after parsing, or parsing failed
+		'''
+		self._queued.discard(path)
+		future = self._futures.pop(path, None)
+		if future is None:
+			try:
+				self._queue.remove(path)
+			except ValueError:
+				pass
+			return None, None
+
+		try:
+			tree, etag = future.result()
+		except Exception:
+			logger.debug('Parallel parsing failed for: %s', path)
+			tree, etag = None, None
+		else:
+			if etag[0] != mtime:
+				tree, etag = None, None
+		self._fill()
+		return tree, etag
+
+	def close(self):
+		'''Stop the worker processes'''
+		for future in self._futures.values():
+			future.cancel()
+		self._futures.clear()
+		self._queue.clear()
+		self._queued.clear()
+		self._executor.shutdown(wait=True)
+
+
 class PageIndexRecord(Path):
 	'''Object representing a page L{Path} in the index, with data
 	for the corresponding row in the C{pages} table.
@@ -621,6 +777,20 @@ class PagesView(IndexView):
 		page_id = self._pages.get_page_id(path) if path else ROOT_ID # can raise
 		return self._pages.walk_bottomup(page_id)
 
+	def n_walk(self, path: Optional[Path] = None) -> int:
+		'''@returns: number of pages yielded by L{walk()} for C{path}
+		@param path: optional, defaults to root path
+		'''
+		if path is None or path.isroot:
+			return self.n_all_pages()
+
+		# Names below path sort between "path:" and "path;"
+		c, = self.db.execute(
+			'SELECT COUNT(*) FROM pages WHERE name > ? AND name < ?',
+			(path.name + ':', path.name + ';')
+		).fetchone()
+		return c
+
 	def n_all_pages(self) -> int:
 		'''@returns: total number of pages in the index'''
 		c, = self.db.execute('SELECT COUNT(*) FROM pages').fetchone()
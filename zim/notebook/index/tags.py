@@ -54,6 +54,8 @@ class TagsIndexer(IndexerBase):
 		'tag-removed-from-page': (SIGNAL_NORMAL, None, (object, object)),
 	}
 
+	CONTENT_FACETS = ('tags',)
+
 	def __init__(self, db, pagesindexer):
 		IndexerBase.__init__(self, db)
 		self.connectto_all(pagesindexer, (
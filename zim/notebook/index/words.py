@@ -0,0 +1,160 @@
+'''The words index is an inverted index of page content. For each word
+it records the pages it appears on and how often. It is used by
+L{zim.search} to answer content queries without opening every page.
+
+Words are sequences of word characters (regex C{\\w+}) in the text of
+the parse tree, stored in lower case. This matches how the search
+module matches content, see L{zim.search.SearchSelection}.
+'''
+
+import re
+import collections
+
+from .base import IndexerBase, IndexView
+
+
+_word_re = re.compile(r'\w+', re.U)
+
+_MAX_SQL_VARIABLES = 500
+
+
+def iter_words(tree):
+	'''Generator yielding all words in a parse tree, in lower case
+	@param tree: a L{ParseTree}
+	'''
+	for text in tree.iter_text():
+		yield from _word_re.findall(text.lower())
+
+
+class WordsIndexer(IndexerBase):
+	'''Indexer for the C{words} and C{wordsources} tables'''
+
+	__signals__ = {}
+
+	CONTENT_FACETS = ('text',)
+
+	def __init__(self, db, pagesindexer):
+		IndexerBase.__init__(self, db)
+		self._removed_word_ids = set() # words that may have become unused
+		self.connectto_all(pagesindexer, (
+			'page-changed', 'page-row-delete'
+		))
+
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS words (
+				id INTEGER PRIMARY KEY,
+				word TEXT,
+
+				CONSTRAINT uc_WordOnce UNIQUE (word)
+			);
+			CREATE TABLE IF NOT EXISTS wordsources (
+				source INTEGER REFERENCES pages(id),
+				word INTEGER REFERENCES words(id),
+				count INTEGER,
+
+				PRIMARY KEY (source, word)
+			) WITHOUT ROWID;
+			CREATE INDEX IF NOT EXISTS wordsources_word ON wordsources(word);
+		''')
+
+	def on_page_changed(self, pagesindexer, pagerow, doc):
+		counts = collections.Counter(iter_words(doc))
+
+		self._delete_wordsources(pagerow['id'])
+		# Word ids are not cached, other connections to the same
+		# database can remove words at any time
+		self.db.executemany(
+			'INSERT OR IGNORE INTO words(word) VALUES (?)',
+			((word,) for word in counts)
+		)
+		self.db.executemany(
+			'INSERT INTO wordsources(source, word, count) '
+			'SELECT ?, id, ? FROM words WHERE word=?',
+			((pagerow['id'], n, word) for word, n in counts.items())
+		)
+
+	def on_page_row_delete(self, pagesindexer, pagerow):
+		self._delete_wordsources(pagerow['id'])
+
+	def _delete_wordsources(self, source):
+		self._removed_word_ids.update(
+			r[0] for r in self.db.execute(
+				'SELECT word FROM wordsources WHERE source=?', (source,)
+			)
+		)
+		self.db.execute(
+			'DELETE FROM wordsources WHERE source=?', (source,)
+		)
+
+	def update_iter(self):
+		# Only words that were removed from a page since the last
+		# update can have become unused, this keeps the cleanup cheap
+		# after a single page update
+		word_ids = list(self._removed_word_ids)
+		self._removed_word_ids.clear()
+		for i in range(0, len(word_ids), _MAX_SQL_VARIABLES):
+			chunk = word_ids[i:i + _MAX_SQL_VARIABLES]
+			self.db.execute(
+				'DELETE FROM words WHERE id IN (%s) AND NOT EXISTS '
+				'(SELECT 1 FROM wordsources WHERE word=words.id)'
+				% ','.join('?' * len(chunk)),
+				chunk
+			)
+			yield
+
+
+class WordsView(IndexView):
+
+	def count_matches(self, regex, prefix=None):
+		'''Count matches for a pattern in the content of all pages
+
+		The regex is matched against each word in the index
+		separately, so it should not match whitespace or punctuation.
+		For a word that is found in a page N times and matches the
+		regex M times, the count for the page is increased by M * N.
+
+		@param regex: a compiled regular expression, it is matched
+		against words in lower case
+		@param prefix: optional literal prefix, in lower case, that all
+		matching words start with. This allows using the database index
+		instead of checking all words.
+		@returns: a dict mapping page names to counts, only pages with
+		at least one match are included
+		'''
+		if prefix:
+			cursor = self.db.execute(
+				'SELECT id, word FROM words WHERE word >= ? AND word < ?',
+				(prefix, prefix + '\U0010ffff')
+			)
+		else:
+			cursor = self.db.execute('SELECT id, word FROM words')
+
+		weights = {}
+		for word_id, word in cursor:
+			n = len(regex.findall(word))
+			if n:
+				weights[word_id] = n
+
+		counts = {}
+		word_ids = list(weights.keys())
+		for i in range(0, len(word_ids), _MAX_SQL_VARIABLES):
+			chunk = word_ids[i:i + _MAX_SQL_VARIABLES]
+			for name, word_id, n in self.db.execute(
+				'SELECT pages.name, wordsources.word, wordsources.count '
+				'FROM wordsources JOIN pages ON wordsources.source=pages.id '
+				'WHERE wordsources.word IN (%s)' % ','.join('?' * len(chunk)),
+				chunk
+			):
+				counts[name] = counts.get(name, 0) + n * weights[word_id]
+
+		return counts
+
+	def list_pages_with_content(self):
+		'''Returns the set of names of all pages that have content
+		(a source file) in the index
+		'''
+		return set(
+			r[0] for r in self.db.execute(
+				'SELECT name FROM pages WHERE source_file IS NOT NULL'
+			)
+		)
@@ -9,6 +9,7 @@ import re
 import weakref
 import logging
 import threading
+import collections
 
 logger = logging.getLogger('zim.notebook')
 
@@ -18,7 +19,7 @@ import zim.templates
 import zim.formats
 
 from zim.fs import adapt_from_oldfs
-from zim.newfs import SEP, Folder, LocalFile, LocalFolder
+from zim.newfs import SEP, Folder, LocalFile, LocalFolder, FileNotFoundError
 from zim.config import INIConfigFile, String, ConfigDefinitionByClass, Boolean, Choice
 from zim.errors import Error
 from zim.base.naturalsort import natural_sort_key
@@ -31,6 +32,7 @@ from .info import create_valid_interwiki_key
 from .operations import notebook_state, NOOP, SimpleAsyncOperation, ongoing_operation
 from .page import Path, Page, PageError, HRef, HREF_REL_ABSOLUTE, HREF_REL_FLOATING, HREF_REL_RELATIVE
 from .index import IndexNotFoundError, LINK_DIR_BACKWARD, ROOT_PATH
+from .parsetreecache import ParseTreeCache
 
 DATA_FORMAT_VERSION = (0, 4)
 
@@ -62,6 +64,7 @@ class NotebookConfig(INIConfigFile):
 			('default_file_format', String('zim-wiki')),
 			('default_file_extension', String('.txt')),
 			('notebook_layout', String('files')),
+			('parse_cache', Boolean(False)),
 		))
 
 
@@ -149,6 +152,102 @@ def assert_index_uptodate(method):
 _NOTEBOOK_CACHE = weakref.WeakValueDictionary()
 
 
+class PageLRUCache(object):
+	'''Keeps strong references to the most recently used pages
+
+	The notebook only keeps weak references to pages, so without this
+	cache a page and its parse tree are dropped as soon as the last user
+	lets go of it. This cache sits in front of the weak cache and keeps
+	a bounded number of pages alive. Memory usage is estimated from the
+	size of the source file of pages that have content loaded. Pages
+	are often touched before their content is loaded, so the estimate
+	for pages without content is updated on the next touch.
+
+	@ivar max_entries: maximum number of pages to keep
+	@ivar max_memory: maximum estimated memory in bytes
+	@ivar memory: current estimated memory in bytes
+	@ivar hits: number of lookups in L{Notebook.get_page()} that found
+	a cached page
+	@ivar misses: number of lookups that created a new page object
+	'''
+
+	MAX_ENTRIES = 100 #: default for C{max_entries}
+	MAX_MEMORY = 32 * 1024 * 1024 #: default for C{max_memory}
+	TREE_SIZE_FACTOR = 10 #: estimated memory of a parse tree per byte source
+
+	def __init__(self, max_entries=None, max_memory=None):
+		self.max_entries = self.MAX_ENTRIES if max_entries is None else max_entries
+		self.max_memory = self.MAX_MEMORY if max_memory is None else max_memory
+		self.memory = 0
+		self.hits = 0
+		self.misses = 0
+		self._pages = collections.OrderedDict()
+		self._sizes = {}
+		self._unsized = set() # pages without content when last estimated
+
+	def __len__(self):
+		return len(self._pages)
+
+	def __contains__(self, name):
+		return name in self._pages
+
+	def _estimate_size(self, page):
+		if page._parsetree is None and page._textbuffer is None:
+			return 0
+		try:
+			return page.source_file.size() * self.TREE_SIZE_FACTOR
+		except FileNotFoundError:
+			return 0
+
+	def _set_size(self, page):
+		self.memory -= self._sizes.get(page.name, 0)
+		self._sizes[page.name] = self._estimate_size(page)
+		self.memory += self._sizes[page.name]
+		if self._sizes[page.name]:
+			self._unsized.discard(page.name)
+		else:
+			self._unsized.add(page.name)
+
+	def touch(self, page):
+		'''Add a page or mark it as most recently used'''
+		if self.max_entries < 1:
+			return
+
+		# Content may have been loaded since these pages were touched
+		for name in list(self._unsized):
+			other = self._pages[name]
+			if other._parsetree is not None or other._textbuffer is not None:
+				self._set_size(other)
+
+		self._pages[page.name] = page
+		self._pages.move_to_end(page.name)
+		self._set_size(page)
+
+		while self._pages and (
+			len(self._pages) > self.max_entries
+			or (self.memory > self.max_memory and len(self._pages) > 1)
+		):
+			name, page = self._pages.popitem(last=False)
+			self.memory -= self._sizes.pop(name)
+			self._unsized.discard(name)
+
+	def discard(self, name):
+		'''Remove a page from the cache
+		@param name: the page name
+		'''
+		if name in self._pages:
+			self._pages.pop(name)
+			self.memory -= self._sizes.pop(name)
+			self._unsized.discard(name)
+
+	def clear(self):
+		'''Remove all pages from the cache'''
+		self._pages.clear()
+		self._sizes.clear()
+		self._unsized.clear()
+		self.memory = 0
+
+
 from zim.plugins import ExtensionBase, extendable
 
 class NotebookExtension(ExtensionBase):
@@ -198,6 +297,8 @@ class Notebook(ConnectorMixin, SignalEmitter):
 	@ivar config: A L{SectionedConfigDict} for the notebook config
 	(the C{X{notebook.zim}} config file in the notebook folder)
 	@ivar index: The L{Index} object used by the notebook
+	@ivar parse_cache: The L{ParseTreeCache} used by the notebook or C{None}
+	@ivar page_lru: The L{PageLRUCache} keeping recently used pages alive
 	'''
 
 	# define signals we want to use - (closure type, return type and arg types)
@@ -217,7 +318,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 	}
 
 	@classmethod
-	def new_from_dir(klass, dir):
+	def new_from_dir(klass, dir, index_readonly=False):
 		'''Constructor to create a notebook based on a specific
 		file system location.
 		Since the file system is an external resource, this method
@@ -225,14 +326,21 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		references for re-use.
 
 		@param dir: a L{Folder} object
+		@param index_readonly: if C{True} a new object is returned that
+		opens the index read-only and does not use the parse tree cache.
+		Intended for worker processes that read pages while the index
+		is maintained by the main process.
+		A L{ParseTreeCache} is only used when the "parse_cache" property
+		of the notebook is set.
 		@returns: a L{Notebook} object
 		'''
 		dir = adapt_from_oldfs(dir)
 		assert isinstance(dir, LocalFolder)
 
-		nb = _NOTEBOOK_CACHE.get(dir.uri)
-		if nb:
-			return nb
+		if not index_readonly:
+			nb = _NOTEBOOK_CACHE.get(dir.uri)
+			if nb:
+				return nb
 
 		from .index import Index
 		from .layout import FilesLayout
@@ -259,22 +367,36 @@ class Notebook(ConnectorMixin, SignalEmitter):
 			raise ValueError('Unkonwn notebook layout: %s' % config['Notebook']['notebook_layout'])
 
 		cache_dir.touch() # must exist for index to work
+		if index_readonly:
+			index = Index(cache_dir.file('index.db').path, layout, readonly=True)
+			return klass(cache_dir, config, folder, layout, index)
+
 		index = Index(cache_dir.file('index.db').path, layout)
+		if config['Notebook']['parse_cache']:
+			parse_cache = ParseTreeCache(cache_dir.file('parsetree.db').path)
+		else:
+			parse_cache = None
 
-		nb = klass(cache_dir, config, folder, layout, index)
+		nb = klass(cache_dir, config, folder, layout, index, parse_cache)
 		_NOTEBOOK_CACHE[dir.uri] = nb
 		return nb
 
-	def __init__(self, cache_dir, config, folder, layout, index):
+	def __init__(self, cache_dir, config, folder, layout, index, parse_cache=None):
 		'''Constructor
 		@param cache_dir: a L{Folder} object used for caching the notebook state
 		@param config: a L{NotebookConfig} object
 		@param folder: a L{Folder} object for the notebook location
 		@param layout: a L{NotebookLayout} object
 		@param index: an L{Index} object
+		@param parse_cache: an optional L{ParseTreeCache} object to keep
+		parse trees of pages between sessions
 		'''
 		self.folder = folder
 		self.cache_dir = cache_dir
+		self.parse_cache = parse_cache
+		if parse_cache is not None:
+			# Also called at exit, writes pending access times
+			weakref.finalize(self, parse_cache.close)
 		self.state = INIConfigFile(cache_dir.file('state.conf'))
 		self.config = config
 		self.properties = config['Notebook']
@@ -288,6 +410,8 @@ class Notebook(ConnectorMixin, SignalEmitter):
 			logger.info('Notebook read-only: %s', folder.path)
 
 		self._page_cache = weakref.WeakValueDictionary()
+		self._page_lock = threading.RLock()
+		self.page_lru = PageLRUCache()
 
 		self.name = None
 		self.icon = None
@@ -298,10 +422,11 @@ class Notebook(ConnectorMixin, SignalEmitter):
 			from zim.newfs.helpers import FileTreeWatcher
 			folder.watcher = FileTreeWatcher()
 
-		from .index import PagesView, LinksView, TagsView
+		from .index import PagesView, LinksView, TagsView, WordsView
 		self.pages = PagesView.new_from_index(self.index)
 		self.links = LinksView.new_from_index(self.index)
 		self.tags = TagsView.new_from_index(self.index)
+		self.words = WordsView.new_from_index(self.index)
 
 		def on_page_row_changed(o, row, oldrow):
 			if row['name'] in self._page_cache:
@@ -313,8 +438,13 @@ class Notebook(ConnectorMixin, SignalEmitter):
 				self._page_cache[row['name']].haschildren = False
 				self.emit('page-info-changed', self._page_cache[row['name']])
 
-		self.index.update_iter.pages.connect('page-row-changed', on_page_row_changed)
-		self.index.update_iter.pages.connect('page-row-deleted', on_page_row_deleted)
+		def on_new_update_iter(index, update_iter):
+			# A new iter is created e.g. when the index is flushed
+			update_iter.pages.connect('page-row-changed', on_page_row_changed)
+			update_iter.pages.connect('page-row-deleted', on_page_row_deleted)
+
+		on_new_update_iter(self.index, self.index.update_iter)
+		self.connectto(self.index, 'new-update-iter', on_new_update_iter)
 
 		self.connectto(self.properties, 'changed', self.on_properties_changed)
 		self.on_properties_changed(self.properties)
@@ -325,7 +455,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 	def _reload_pages_in_cache(self, path):
 		p = path.name
 		ns = path.name + ':'
-		for name, page in self._page_cache.items():
+		for name, page in list(self._page_cache.items()):
 			if name == p or name.startswith(ns):
 				if page.modified:
 					logger.error('Page with unsaved changes in cache while modifying notebook')
@@ -333,6 +463,8 @@ class Notebook(ConnectorMixin, SignalEmitter):
 					page.reload_textbuffer()
 					# "page.haschildren" may also have changed, will be updated
 					# by signal handlers for index
+				self.page_lru.discard(name)
+					# only keep alive if still in use elsewhere
 
 	@property
 	def uri(self):
@@ -391,35 +523,40 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		# As a special case, using an invalid page as the argument should
 		# return a valid page object.
 		assert isinstance(path, Path)
-		if path.name in self._page_cache:
-			page = self._page_cache[path.name]
-			assert isinstance(page, Page)
-			page.check_source_changed()
-			return page
-		else:
-			file, folder = self.layout.map_page(path)
-			if file.exists() and not self.layout.is_source_file(file):
-				raise PageNotAvailableError(path, file)
-
-			folder = self.layout.get_attachments_folder(path)
-			format = self.layout.get_format(file)
-			page = Page(path, False, file, folder, format)
-			if self.readonly:
-				page._readonly = True # XXX
-			try:
-				indexpath = self.pages.lookup_by_pagename(path)
-			except IndexNotFoundError:
-				pass
-				# TODO trigger indexer here if page exists !
+		with self._page_lock: # page cache is shared with web server threads
+			if path.name in self._page_cache:
+				page = self._page_cache[path.name]
+				assert isinstance(page, Page)
+				page.check_source_changed()
+				self.page_lru.hits += 1
+				self.page_lru.touch(page)
+				return page
 			else:
-				if indexpath and indexpath.haschildren:
-					page.haschildren = True
-				# page might be the parent of a placeholder, in that case
-				# the index knows it has children, but the store does not
+				file, folder = self.layout.map_page(path)
+				if file.exists() and not self.layout.is_source_file(file):
+					raise PageNotAvailableError(path, file)
+
+				folder = self.layout.get_attachments_folder(path)
+				format = self.layout.get_format(file)
+				page = Page(path, False, file, folder, format, self.parse_cache)
+				if self.readonly:
+					page._readonly = True # XXX
+				try:
+					indexpath = self.pages.lookup_by_pagename(path)
+				except IndexNotFoundError:
+					pass
+					# TODO trigger indexer here if page exists !
+				else:
+					if indexpath and indexpath.haschildren:
+						page.haschildren = True
+					# page might be the parent of a placeholder, in that case
+					# the index knows it has children, but the store does not
 
-			# TODO - set haschildren if page maps to a store namespace
-			self._page_cache[path.name] = page
-			return page
+				# TODO - set haschildren if page maps to a store namespace
+				self._page_cache[path.name] = page
+				self.page_lru.misses += 1
+				self.page_lru.touch(page)
+				return page
 
 	def get_new_page(self, path):
 		'''Like get_page() but guarantees the page does not yet exist
@@ -463,8 +600,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		logger.debug('Store page: %s', page)
 		self.emit('store-page', page)
 		page._store()
-		file, folder = self.layout.map_page(page)
-		self.index.update_file(file)
+		self._update_index_for_stored_page(page)
 		page.set_modified(False)
 		self.emit('stored-page', page)
 
@@ -497,8 +633,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 	def _store_page_async_finished(self, page, error, pre_modified):
 		if not error.is_set():
-			file, folder = self.layout.map_page(page)
-			self.index.update_file(file)
+			self._update_index_for_stored_page(page)
 			if page.modified == pre_modified:
 				# HACK: Checking modified state protects against race condition
 				# in async store. Works because pageview sets "page.modified"
@@ -506,6 +641,16 @@ class Notebook(ConnectorMixin, SignalEmitter):
 				page.set_modified(False)
 				self.emit('stored-page', page)
 
+	def _update_index_for_stored_page(self, page):
+		# Hand the tree that was just written to the index, so it does
+		# not need to read and parse the file again
+		file, folder = self.layout.map_page(page)
+		tree, page._last_stored_tree = page._last_stored_tree, None # don't keep it alive
+		if tree is not None and page._last_etag is not None:
+			self.index.update_file(file, tree, page._last_etag)
+		else:
+			self.index.update_file(file)
+
 	def wait_for_store_page_async(self):
 		op = ongoing_operation(self)
 		if isinstance(op, SimpleAsyncOperation):
@@ -576,6 +721,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 				tree.set_heading_text(newpath.basename)
 				page.set_parsetree(tree)
 				self.store_page(page)
+				self.page_lru.discard(page.name)
 
 	def _move_file_and_folder(self, path, newpath):
 		file, folder = self.layout.map_page(path)
@@ -696,6 +842,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		newtree = tree.substitute_elements((zim.formats.LINK,), replacefunc)
 		page.set_parsetree(newtree)
 		self.store_page(page)
+		self.page_lru.discard(page.name)
 
 	def _update_links_to_moved_page(self, oldroot, newroot):
 		# 1. Check remaining placeholders, update pages causing them
@@ -771,6 +918,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		newtree = tree.substitute_elements((zim.formats.LINK,), replacefunc)
 		page.set_parsetree(newtree)
 		self.store_page(page)
+		self.page_lru.discard(page.name)
 
 	def _update_link_tag(self, elt, source, target, oldhref):
 		if oldhref.rel == HREF_REL_ABSOLUTE: # prefer to keep absolute links
@@ -938,6 +1086,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 					page = self.get_page(p)
 					self._remove_links_in_page(page, path)
 					self.store_page(page)
+					self.page_lru.discard(page.name)
 
 		# let everybody know what happened
 		self.emit('deleted-page', path)
@@ -444,6 +444,7 @@ class Page(Path, SignalEmitter):
 	@ivar modified: C{True} if the page was modified since the last
 	store. Will be reset by L{Notebook.store_page()}
 	@ivar readonly: C{True} when the page is read-only or belongs to a readonly notebook
+	@ivar parse_cache: a L{ParseTreeCache} object or C{None}
 
 	@signal: C{storage-changed (changed-on-disk)}: signal emitted on page
 	change. The argument "changed-on-disk" is C{True} when an external
@@ -456,7 +457,7 @@ class Page(Path, SignalEmitter):
 		'modified-changed': (SIGNAL_NORMAL, None, ()),
 	}
 
-	def __init__(self, path, haschildren, file, folder, format):
+	def __init__(self, path, haschildren, file, folder, format, parse_cache=None):
 		assert isinstance(path, Path)
 		self.name = path.name
 		self.haschildren = haschildren
@@ -470,12 +471,14 @@ class Page(Path, SignalEmitter):
 
 		self._readonly = None
 		self._last_etag = None
+		self._last_stored_tree = None # tree matching _last_etag, used by index
 		if isinstance(format, str):
 			self.format = zim.formats.get_format(format)
 		else:
 			self.format = format
 		self.source_file = file
 		self.attachments_folder = folder
+		self.parse_cache = parse_cache
 
 	@property
 	def readonly(self):
@@ -554,10 +557,12 @@ class Page(Path, SignalEmitter):
 
 			lines = self.format.Dumper().dump(tree, file_output=True)
 			self._last_etag = self.source_file.writelines_with_etag(lines, self._last_etag)
+			self._last_stored_tree = tree
 			self._meta = tree.meta
 		else:
 			self.source_file.remove()
 			self._last_etag = None
+			self._last_stored_tree = None
 			self._meta = None
 		self.emit('storage-changed', False)
 
@@ -624,6 +629,13 @@ class Page(Path, SignalEmitter):
 		elif self._parsetree:
 			return self._parsetree
 		else:
+			if self.parse_cache is not None:
+				cached = self.parse_cache.get(self.source_file, self.format)
+				if cached is not None:
+					self._parsetree, self._last_etag = cached
+					self._meta = self._parsetree.meta
+					return self._parsetree
+
 			try:
 				text, self._last_etag = self.source_file.read_with_etag()
 			except zim.newfs.FileNotFoundError:
@@ -633,6 +645,8 @@ class Page(Path, SignalEmitter):
 				self._parsetree = parser.parse(text, file_input=True)
 				self._meta = self._parsetree.meta
 				assert self._meta is not None
+				if self.parse_cache is not None:
+					self.parse_cache.put(self.source_file, self.format, self._parsetree, self._last_etag)
 				return self._parsetree
 
 	def set_parsetree(self, tree):
@@ -0,0 +1,296 @@
+'''This module implements a persistent cache for page parse trees.
+
+Parsing the source of a page is one of the more expensive operations
+when the same page is accessed over and over again, e.g. when searching,
+exporting or serving a notebook. Since L{Page} objects are only weakly
+cached by the notebook, the parse tree is normally lost as soon as the
+page goes out of scope.
+
+The L{ParseTreeCache} keeps a serialized copy of the parse tree in a
+sqlite database next to the index. The tree is stored as a list of
+tokens in JSON, the cache database can be in a shared notebook folder,
+so a format that can run code when loading (like pickle) is not used. Entries are keyed by the file path
+and the size and md5 digest of the source file. On lookup the file is
+read to verify the digest, so any change of the content invalidates the
+entry, even if the mtime did not change. Reading and hashing the file
+is much cheaper than parsing it. The etag returned with a cached tree
+is computed from the file that was read, so it is valid for saving
+changes. The total size of the cache is bounded, least recently used
+entries are dropped first. Access times are kept in memory and written
+together with the next change of the cache.
+'''
+
+import os
+import time
+import json
+import sqlite3
+import logging
+import threading
+
+from zim.newfs import FileNotFoundError
+from zim.formats import ParseTree
+
+
+logger = logging.getLogger('zim.notebook')
+
+
+CACHE_VERSION = 2
+
+
+def _dumps(tree):
+	# Returns None if the tree can not be serialized
+	tokens = list(tree.iter_tokens())
+	if not tokens:
+		return None
+	try:
+		return json.dumps(
+			{'meta': list(tree.meta.items()), 'tokens': tokens},
+			ensure_ascii=False, separators=(',', ':')
+		).encode('UTF-8')
+	except (TypeError, ValueError):
+		return None
+
+
+def _loads(data):
+	obj = json.loads(data.decode('UTF-8'))
+	tree = ParseTree.new_from_tokens(tuple(t) for t in obj['tokens'])
+	tree.meta.update(obj['meta'])
+	return tree
+
+
+class ParseTreeCache(object):
+	'''Persistent cache of page parse trees, see module docs for details.
+
+	This object is thread safe, it uses its own database connection
+	and a lock to serialize access.
+
+	@ivar hits: number of lookups that were found in the cache
+	@ivar misses: number of lookups that were not found in the cache
+	'''
+
+	MAX_SIZE = 64 * 1024 * 1024 #: default for C{max_size} in bytes
+
+	def __init__(self, dbpath, max_size=None):
+		'''Constructor
+		@param dbpath: a file path for the sqlite db
+		@param max_size: maximum size of the cached data in bytes
+		'''
+		self.dbpath = dbpath
+		self.max_size = max_size or self.MAX_SIZE
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._total = 0
+		self._atimes = {} # access times not yet written to the db
+		self._db = None
+		try:
+			self._db_connect()
+		except sqlite3.Error:
+			logger.warning('Overwriting possibly corrupt parse cache: %s', dbpath)
+			self._db_close()
+			try:
+				for path in (dbpath, dbpath + '-wal', dbpath + '-shm'):
+					if os.path.exists(path):
+						os.remove(path)
+				self._db_connect()
+			except (OSError, sqlite3.Error):
+				logger.exception('Could not access parse cache, disabling it')
+				self._db_close()
+
+	def _db_connect(self):
+		self._db = sqlite3.connect(self.dbpath, check_same_thread=False)
+		self._db.execute('PRAGMA synchronous=OFF')
+		self._db.execute('PRAGMA journal_mode=WAL')
+		version = self._db.execute('PRAGMA user_version').fetchone()[0]
+		if version != CACHE_VERSION:
+			self._db.execute('DROP TABLE IF EXISTS parsetrees')
+			self._db.execute('PRAGMA user_version=%i' % CACHE_VERSION)
+		self._db.execute(
+			'CREATE TABLE IF NOT EXISTS parsetrees ('
+			'path TEXT PRIMARY KEY, '
+			'format TEXT, '
+			'size INTEGER, '
+			'mtime REAL, '
+			'md5 TEXT, '
+			'atime REAL, '
+			'nbytes INTEGER, '
+			'data BLOB'
+			')'
+		)
+		self._db.execute('CREATE INDEX IF NOT EXISTS parsetrees_atime ON parsetrees(atime)')
+		self._total = self._db.execute('SELECT total(nbytes) FROM parsetrees').fetchone()[0]
+		self._db.commit()
+
+	def _db_close(self):
+		if self._db is not None:
+			try:
+				self._db.close()
+			except sqlite3.Error:
+				pass
+		self._db = None
+
+	def close(self):
+		'''Close the database connection, after this the cache is
+		disabled
+		'''
+		with self._lock:
+			if self._db is not None:
+				try:
+					self._flush_atimes()
+					self._db.commit()
+				except sqlite3.Error:
+					logger.exception('Error writing parse cache')
+			self._db_close()
+
+	def get(self, file, format):
+		'''Lookup the parse tree for a file
+		@param file: the source file as L{File} object
+		@param format: the format module used to parse the file
+		@returns: a 2-tuple of a L{ParseTree} and the etag for the file
+		or C{None} when the file is not in the cache or changed
+		'''
+		if self._db is None:
+			return None
+
+		try:
+			size = file.size()
+		except FileNotFoundError:
+			return None
+
+		with self._lock:
+			try:
+				row = self._db.execute(
+					'SELECT md5, data FROM parsetrees '
+					'WHERE path=? AND format=? AND size=?',
+					(file.path, format.__name__, size)
+				).fetchone()
+			except sqlite3.Error:
+				logger.exception('Error reading parse cache')
+				row = None
+
+		if row is None:
+			self.misses += 1
+			return None
+
+		md5, data = row
+		try:
+			text, etag = file.read_with_etag()
+		except FileNotFoundError:
+			self.misses += 1
+			return None
+
+		if etag[1] != md5:
+			# Content changed without changing the size
+			self.remove(file)
+			self.misses += 1
+			return None
+
+		try:
+			tree = _loads(data)
+		except Exception:
+			logger.exception('Could not load cached parse tree for: %s', file.path)
+			self.remove(file)
+			self.misses += 1
+			return None
+		else:
+			with self._lock:
+				self._atimes[file.path] = time.time()
+			self.hits += 1
+			return tree, etag
+
+	def put(self, file, format, tree, etag):
+		'''Store the parse tree for a file
+		@param file: the source file as L{File} object
+		@param format: the format module used to parse the file
+		@param tree: the L{ParseTree} as parsed from the file
+		@param etag: the etag that was returned when reading the file
+		'''
+		if self._db is None:
+			return
+
+		mtime, md5 = etag
+		try:
+			if file.mtime() != mtime:
+				return # file changed since reading, do not cache
+			size = file.size()
+		except FileNotFoundError:
+			return
+
+		data = _dumps(tree)
+		if data is None or len(data) > self.max_size:
+			return
+
+		with self._lock:
+			try:
+				row = self._db.execute(
+					'SELECT nbytes FROM parsetrees WHERE path=?', (file.path,)
+				).fetchone()
+				if row is not None:
+					self._total -= row[0]
+				self._db.execute(
+					'INSERT OR REPLACE INTO parsetrees VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+					(file.path, format.__name__, size, mtime, md5, time.time(), len(data), data)
+				)
+				self._total += len(data)
+				self._flush_atimes()
+				if self._total > self.max_size:
+					self._evict()
+				self._db.commit()
+			except sqlite3.Error:
+				logger.exception('Error writing parse cache')
+
+	def _flush_atimes(self):
+		if self._atimes:
+			self._db.executemany(
+				'UPDATE parsetrees SET atime=? WHERE path=?',
+				((atime, path) for path, atime in self._atimes.items())
+			)
+			self._atimes.clear()
+
+	def _evict(self):
+		# Re-count first, other processes may use the same database
+		self._total = self._db.execute('SELECT total(nbytes) FROM parsetrees').fetchone()[0]
+		if self._total <= self.max_size:
+			return
+
+		rows = self._db.execute(
+			'SELECT path, nbytes FROM parsetrees ORDER BY atime'
+		).fetchall()
+		for path, nbytes in rows:
+			if self._total <= self.max_size:
+				break
+			self._db.execute('DELETE FROM parsetrees WHERE path=?', (path,))
+			self._total -= nbytes
+
+		logger.debug('Parse cache evicted entries, size now %i bytes', self._total)
+
+	def remove(self, file):
+		'''Remove the cached parse tree for a file
+		@param file: the source file as L{File} object
+		'''
+		if self._db is None:
+			return
+
+		with self._lock:
+			try:
+				row = self._db.execute(
+					'SELECT nbytes FROM parsetrees WHERE path=?', (file.path,)
+				).fetchone()
+				if row is not None:
+					self._db.execute('DELETE FROM parsetrees WHERE path=?', (file.path,))
+					self._total -= row[0]
+					self._atimes.pop(file.path, None)
+					self._db.commit()
+			except sqlite3.Error:
+				logger.exception('Error writing parse cache')
+
+	def clear(self):
+		'''Remove all entries from the cache'''
+		if self._db is None:
+			return
+
+		with self._lock:
+			self._db.execute('DELETE FROM parsetrees')
+			self._db.commit()
+			self._atimes.clear()
+			self._total = 0
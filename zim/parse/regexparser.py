@@ -93,6 +93,10 @@ class RegexParser(object):
 	The function should take a L{Builder} object as first argument,
 	followed by one or more parameters for matched groups in the
 	regular expression.
+	@ivar prefilter: optional compiled regex that matches in any text
+	where one of the rules can match. Text without a match for this
+	regex is processed as unmatched text directly, which is much
+	cheaper than trying all rules at every position.
 	'''
 
 	def __init__(self, *rules):
@@ -103,6 +107,7 @@ class RegexParser(object):
 		'''
 		self.rules = [] #: sub rules
 		self.process_unmatched = self._process_unmatched
+		self.prefilter = None
 		self._re = None
 
 		for rule in rules:
@@ -139,15 +144,15 @@ class RegexParser(object):
 			logger.warning('Parser got empty string')
 			return
 
+		if self.prefilter is not None and not self.prefilter.search(text):
+			try:
+				self.process_unmatched(builder, text)
+			except Exception as error:
+				self._raise_exception(error, text, 0, len(text), builder)
+			return
+
 		if self._re is None:
-			# Generate the regex and cache it for re-use
-			self.rules = tuple(self.rules) # freeze list
-			pattern = r'|'.join([
-				r"(?P<rule%i>%s)" % (i, r.pattern)
-					for i, r in enumerate(self.rules)
-			])
-			#print('PATTERN:\n', pattern.replace(')|(', ')\t|\n('), '\n...')
-			self._re = re.compile(pattern, re.U | re.M | re.X)
+			self._compile()
 
 		iter = 0
 		end = len(text)
@@ -184,6 +189,70 @@ class RegexParser(object):
 
 	parse = __call__
 
+	def _compile(self):
+		# Generate the regex and cache it for re-use
+		self.rules = tuple(self.rules) # freeze list
+		pattern = r'|'.join([
+			r"(?P<rule%i>%s)" % (i, r.pattern)
+				for i, r in enumerate(self.rules)
+		])
+		#print('PATTERN:\n', pattern.replace(')|(', ')\t|\n('), '\n...')
+		self._re = re.compile(pattern, re.U | re.M | re.X)
+
+	def match_at(self, builder, text, offset):
+		'''Process a rule if one matches exactly at C{offset} in
+		C{text}. Unlike calling the parser, this does not look for
+		matches further on in the text, nor process unmatched text.
+		This allows callers to handle the text in between matches
+		themselves.
+
+		@param builder: a L{Builder} object
+		@param text: to be parsed text as string
+		@param offset: character offset in C{text}
+		@returns: the offset after the processed match, or C{None} if
+		no rule matches
+		'''
+		match = self.match(text, offset)
+		if match is None:
+			return None
+		else:
+			return self.process_match(builder, text, match)
+
+	def match(self, text, offset):
+		'''Check whether a rule matches exactly at C{offset} in C{text}
+		without processing it. Use L{process_match()} to process the
+		result.
+		@param text: to be parsed text as string
+		@param offset: character offset in C{text}
+		@returns: a match object or C{None}
+		'''
+		if self._re is None:
+			self._compile()
+
+		return self._re.match(text, offset)
+
+	def process_match(self, builder, text, match):
+		'''Process a match returned by L{match()}
+		@param builder: a L{Builder} object
+		@param text: the text that was matched
+		@param match: the match object
+		@returns: the offset after the processed match
+		'''
+		mstart, mend = match.span()
+		name = match.lastgroup # named outer group
+		i = int(name[4:]) # name is e.g. "rule1"
+		groups = [g for g in match.groups() if g is not None]
+		if len(groups) > 1:
+			groups.pop(0) # get rid of named outer group if inner groups are defined
+
+		self._backup_iter = 0
+		try:
+			self.rules[i].process(builder, *groups)
+		except Exception as error:
+			self._raise_exception(error, text, mstart, mend, builder, self.rules[i])
+
+		return mend - self._backup_iter
+
 	def backup_parser_offset(self, i):
 		self._backup_iter += i
 
@@ -0,0 +1,249 @@
+'''This module contains a compact representation of a token list.
+
+A L{TokenArray} keeps the tokens of a tree in a flat list. Text is
+stored as plain strings, one item per line, while start and end tokens
+are shared tuples with interned tag names and shared, read-only
+attribute dicts. Tokens are only turned back into 2-tuples when
+iterating, so iterating does not need to build an intermediate list.
+
+The tokens in the array are stored in the "top level lists" form as
+produced by L{topLevelLists()}, which is the form returned by
+C{ParseTree.iter_tokens()}.
+'''
+
+import sys
+import weakref
+
+from .tokenlist import TEXT, END, topLevelLists
+from .builder import Builder
+
+
+class FrozenAttrib(dict):
+	'''Read-only dict used for the attributes of start tokens in a
+	L{TokenArray}. Since these objects are shared between tokens and
+	between arrays they can not be modified, use C{copy()} to get a
+	normal dict.
+	'''
+
+	__slots__ = ('__weakref__',)
+
+	def _readonly(self, *arg, **kwarg):
+		raise TypeError('Attributes of a TokenArray can not be modified')
+
+	__setitem__ = _readonly
+	__delitem__ = _readonly
+	clear = _readonly
+	pop = _readonly
+	popitem = _readonly
+	setdefault = _readonly
+	update = _readonly
+
+	def __reduce__(self):
+		return (FrozenAttrib, (dict(self),))
+
+
+_EMPTY_ATTRIB = FrozenAttrib()
+
+_attrib_cache = weakref.WeakValueDictionary()
+_start_tokens = {} # (tag, is None) -> start token without attributes
+_end_tokens = {} # tag -> end token
+
+
+def freeze_attrib(attrib):
+	'''Returns a shared L{FrozenAttrib} with the same content as
+	C{attrib}. Equal attributes with hashable values give the same
+	object.
+	@param attrib: a dict or C{None}
+	@returns: a L{FrozenAttrib} object
+	'''
+	if not attrib:
+		return _EMPTY_ATTRIB
+	elif isinstance(attrib, FrozenAttrib):
+		return attrib
+
+	try:
+		# Include the type, else e.g. "1" and "True" are shared
+		if len(attrib) == 1:
+			key = tuple((k, v.__class__, v) for k, v in attrib.items())
+		else:
+			key = tuple(sorted((k, v.__class__, v) for k, v in attrib.items()))
+		frozen = _attrib_cache.get(key)
+	except TypeError:
+		return FrozenAttrib(attrib) # unhashable value, can not be shared
+
+	if frozen is None:
+		frozen = FrozenAttrib(attrib)
+		_attrib_cache[key] = frozen
+	return frozen
+
+
+def start_token(tag, attrib=None):
+	'''Returns a start token with interned tag name and frozen attributes.
+	Tokens without attributes are shared, C{None} and an empty dict are
+	kept apart.
+	'''
+	if not attrib:
+		key = (tag, attrib is None)
+		try:
+			return _start_tokens[key]
+		except KeyError:
+			tag = sys.intern(tag)
+			token = (tag, None if attrib is None else _EMPTY_ATTRIB)
+			_start_tokens[key] = token
+			return token
+	else:
+		return (sys.intern(tag), freeze_attrib(attrib))
+
+
+def end_token(tag):
+	'''Returns a shared end token for C{tag}'''
+	try:
+		return _end_tokens[tag]
+	except KeyError:
+		tag = sys.intern(tag)
+		token = (END, tag)
+		_end_tokens[tag] = token
+		return token
+
+
+class TokenArray(object):
+	'''Flat, read-only array of tokens
+
+	Objects of this class can be used instead of a list of tokens, they
+	are iterable and can be shared without copying. Start tokens are
+	yielded with a L{FrozenAttrib} for the attributes, so code that
+	wants to modify attributes must copy them first.
+	'''
+
+	__slots__ = ('_items',)
+
+	def __init__(self, tokens=()):
+		'''Constructor
+		@param tokens: an iterable of tokens
+		'''
+		items = []
+		for t in tokens:
+			if t[0] == TEXT:
+				items.append(t[1])
+			elif t[0] == END:
+				items.append(end_token(t[1]))
+			else:
+				items.append(start_token(t[0], t[1]))
+		self._items = items
+
+	@classmethod
+	def _new_from_items(klass, items):
+		array = klass.__new__(klass)
+		array._items = items
+		return array
+
+	def __len__(self):
+		return len(self._items)
+
+	def __iter__(self):
+		return self.iter_tokens()
+
+	def __eq__(self, other):
+		if isinstance(other, TokenArray):
+			return self._items == other._items
+		else:
+			return NotImplemented
+
+	def __getstate__(self):
+		# Pickle attributes as plain dicts, see __setstate__
+		return [
+			(item[0], dict(item[1]))
+				if item.__class__ is not str and item[0] != END and item[1]
+					else item
+						for item in self._items
+		]
+
+	def __setstate__(self, items):
+		# Restore sharing of tokens and attributes after unpickling
+		self._items = TokenArray(
+			(TEXT, item) if item.__class__ is str else item
+				for item in items
+		)._items
+
+	def iter_tokens(self):
+		'''Generator yielding tokens'''
+		for item in self._items:
+			if item.__class__ is str:
+				yield (TEXT, item)
+			else:
+				yield item
+
+	def iter_text(self):
+		'''Generator yielding the text of all text tokens'''
+		for item in self._items:
+			if item.__class__ is str:
+				yield item
+
+	def iter_start_tokens(self, tags):
+		'''Generator yielding start tokens for specific tags
+		@param tags: a tag name or a set or tuple of tag names
+		'''
+		if isinstance(tags, str):
+			tags = (tags,)
+		for item in self._items:
+			if item.__class__ is not str and item[0] in tags:
+				yield item
+
+
+class TokenArrayBuilder(Builder):
+	'''Builder class that builds a L{TokenArray}
+
+	Consecutive pieces of text are merged and split per line and
+	missing attributes are replaced by an empty dict, so the resulting
+	tokens are the same as those of a C{ParseTree} build by the same
+	parser.
+	'''
+
+	def __init__(self):
+		self._tokens = []
+		self._text = []
+		self.stack = []
+
+	def get_tokenarray(self):
+		'''Returns the constructed L{TokenArray} object'''
+		if self.stack:
+			raise AssertionError('Did not finish processing: %r' % self.stack)
+		self._flush()
+		tokens = topLevelLists(self._tokens)
+		items = [t[1] if t[0] == TEXT else t for t in tokens]
+		return TokenArray._new_from_items(items)
+
+	def _flush(self):
+		text = self._text[0] if len(self._text) == 1 else ''.join(self._text)
+		self._text = []
+		if text:
+			lines = text.splitlines(True)
+			if len(lines) == 1:
+				self._tokens.append((TEXT, text))
+			else:
+				self._tokens.extend((TEXT, line) for line in lines)
+
+	def start(self, tag, attrib=None):
+		if self._text:
+			self._flush()
+		self._tokens.append(start_token(tag, attrib or _EMPTY_ATTRIB))
+		self.stack.append(tag)
+
+	def text(self, text):
+		self._text.append(text)
+
+	def end(self, tag):
+		if tag != self.stack[-1]:
+			raise AssertionError('Unmatched tag closed: %s' % tag)
+		if self._text:
+			self._flush()
+		self._tokens.append(end_token(tag))
+		self.stack.pop()
+
+	def append(self, tag, attrib=None, text=None):
+		if self._text:
+			self._flush()
+		self._tokens.append(start_token(tag, attrib or _EMPTY_ATTRIB))
+		if text:
+			self._tokens.extend((TEXT, line) for line in text.splitlines(True))
+		self._tokens.append(end_token(tag))
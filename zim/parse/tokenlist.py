@@ -136,41 +136,50 @@ def topLevelLists(tokens):
 	# ..<ul>...</ul>.. --> ..</p><ul>...</ul><p>..
 	# ..<ul>...</ul></p> --> ..</p><ul>...</ul>
 	#
+	return list(iterTopLevelLists(tokens))
+
+
+def iterTopLevelLists(tokens):
+	# Generator version of topLevelLists(), only buffers the tokens
+	# of one list at a time.
 	from zim.formats import NUMBEREDLIST, BULLETLIST, PARAGRAPH
 	para_end = (END, PARAGRAPH)
 	seen_para = False
 	tokeniter = iter(tokens)
-	newtokens = []
+	last = None # held back, dropped if it opens a paragraph with a list
 	for t in tokeniter:
 		if t[0] in (NUMBEREDLIST, BULLETLIST):
 			assert seen_para, 'Looks like tokenlist had top level lists to start with'
-			if newtokens[-1][0] == PARAGRAPH:
-				newtokens.pop()
-			else:
-				newtokens.append((END, PARAGRAPH))
+			if last is None or last[0] != PARAGRAPH:
+				if last is not None:
+					yield last
+				yield (END, PARAGRAPH)
 
-			newtokens.append(t)
-			newtokens.extend(_changeList(tokeniter))
+			yield t
+			yield from _changeList(tokeniter)
 
 			nexttoken = next(tokeniter)
 			while nexttoken[0] in (BULLETLIST, NUMBEREDLIST):
-				newtokens.append(nexttoken)
-				newtokens.extend(_changeList(tokeniter))
+				yield nexttoken
+				yield from _changeList(tokeniter)
 				nexttoken = next(tokeniter)
 
 			if nexttoken == (END, PARAGRAPH):
-				pass
+				last = None
 			else:
-				newtokens.append((PARAGRAPH, None))
-				newtokens.append(nexttoken)
+				yield (PARAGRAPH, None)
+				last = nexttoken
 		else:
 			if t[0] == PARAGRAPH:
 				seen_para = True
 			elif t == para_end:
 				seen_para = False
-			newtokens.append(t)
+			if last is not None:
+				yield last
+			last = t
 
-	return newtokens
+	if last is not None:
+		yield last
 
 
 class TokenBuilder(Builder):
@@ -5,18 +5,37 @@ It borrows a lot from the task list plugin which also needs to index all
 page contents.
 '''
 
+import re
 import sqlite3
 import logging
 
 from zim.plugins import PluginClass
 from zim.notebook import NotebookExtension, Path
 from zim.notebook.index.base import IndexerBase
-from zim.parse.tokenlist import TEXT
 from zim.search import SearchSelection
 
 logger = logging.getLogger("zim.plugins.indexed_fts")
 
 
+RANK_COUNT = 'count'
+RANK_BM25 = 'bm25'
+
+BM25_SCALE = 100 # score for the best match when ranking by bm25
+
+_MAX_SQL_VARIABLES = 500
+
+PREFIX_LENGTHS = '2 3' # prefix lengths for the "prefix" index option
+
+_cjk_re = re.compile('[\u4e00-\u9fff]') # see SearchSelection._content_regex()
+
+
+def _like_pattern(string):
+	# Pattern for the LIKE operator that matches at least all strings
+	# matched by the search term, "%" and "_" in the term are not
+	# escaped, they only make the pattern match more
+	return '%' + '%'.join(s for s in string.split('*') if s) + '%'
+
+
 def compare_version(curv, minv):
 	'''Check if a passed tuple of version numbers curv is equal or higher
 	than the version tuple passed in minv
@@ -50,6 +69,18 @@ sqlite.
 		'help': 'Plugins:Indexed Full Text Search'
 	}
 
+	plugin_preferences = (
+		# key, type, label, default
+		('ranking', 'choice', _('Rank search results by'), RANK_COUNT, (RANK_COUNT, RANK_BM25)),
+			# T: plugin preference, "count" means number of matches, "bm25" is a relevance ranking algorithm
+		('max_results', 'int', _('Maximum number of results when ranking by bm25, 0 for no limit'), 0, (0, 100000)),
+			# T: plugin preference
+		('prefix_index', 'bool', _('Add an index for faster prefix search like "foo*"'), False),
+			# T: plugin preference
+		('trigram_index', 'bool', _('Add an index for substring search like "*oo" and for Chinese text'), False),
+			# T: plugin preference
+	)
+
 	@classmethod
 	def check_dependencies(klass):
 		conn = sqlite3.connect(":memory:")
@@ -69,8 +100,7 @@ sqlite.
 			('sqlite version 3.43.0 or higher', has_min_version, True)
 		]
 
-	@staticmethod
-	def process_index_fts(searchselection, term, scope):
+	def process_index_fts(self, searchselection, term, scope):
 		'''
 		The workhorse for actually searching the index, called by the
 		search function if available.
@@ -79,29 +109,74 @@ sqlite.
 		@param term: a term to look for
 		@param scope: if passed, a set of valid page names to search in
 
-		NOTE: Currently, we don't use the more advanced BM25 ranking method
-		but instead try to replicate what zim internally uses: the number
-		of times the word was found in the page.
+		Depending on the "ranking" preference the score is either the
+		number of times the word was found in the page, which is what
+		zim uses internally, or the BM25 relevance of the page.
+
+		If the trigram index is enabled, terms with a wildcard that is
+		not at the end and terms with Chinese characters are looked up
+		in that table instead, these can not be matched by the tokens
+		in the normal FTS table. Scores are always the number of
+		matches for these terms.
 		'''
 		db = searchselection.notebook.index._db
 
 		# All keywords passed to this functions are content-related so
 		# we don't need to check the term.keyword property.
-		# Beware: FTS5 supports a complex search syntax, including "*"
-		# expansion, but we cannot use this for counting the occurences.
-		# Instead, we use the GLOB operator for counting occurences,
-		# which also understands "*" expansion but might otherwise
-		# provide different results.
-		query_results = db.execute(
-			"SELECT p.name AS name, count(v.offset) as score "
-			"FROM pages_fts(?) as f "
-			"JOIN keys_pages_fts as k ON f.rowid = k.fts_id "
-			"JOIN pages as p ON k.page_id = p.id "
-			"JOIN pages_ftsv AS v ON f.rowid = v.doc "
-			"WHERE v.term GLOB ? "
-			"GROUP BY p.name;",
-			(term.string, term.string.lower())
-		).fetchall()
+		if self._use_trigram_index(term):
+			query_results = self._process_trigram_index(searchselection, db, term)
+		elif self.preferences['ranking'] == RANK_BM25:
+			# Only the top N can be used when the result is not
+			# combined with a scope or inverted
+			limit = self.preferences['max_results']
+			if not limit or scope or term.inverse:
+				limit = -1
+			query_results = db.execute(
+				"SELECT p.name AS name, f.rank AS rank "
+				"FROM ("
+				"  SELECT rowid, rank FROM pages_fts "
+				"  WHERE pages_fts MATCH ? ORDER BY rank LIMIT ?"
+				") AS f "
+				"JOIN keys_pages_fts as k ON f.rowid = k.fts_id "
+				"JOIN pages as p ON k.page_id = p.id;",
+				(term.string, limit)
+			).fetchall()
+			# bm25() gives negative floats, the best match first, which
+			# can be very small for common words. Scores are integers,
+			# so scale them relative to the best match.
+			best = min((row['rank'] for row in query_results), default=0)
+			query_results = [
+				{
+					'name': row['name'],
+					'score': max(1, int(round(row['rank'] / best * BM25_SCALE))) if best else 1
+				} for row in query_results
+			]
+		else:
+			# Beware: FTS5 supports a complex search syntax, including "*"
+			# expansion, but we cannot use this for counting the occurences.
+			# Instead, we use the GLOB operator for counting occurences,
+			# which also understands "*" expansion but might otherwise
+			# provide different results.
+			# The range on v.term allows the vocabulary table to only
+			# look at terms with the right prefix instead of all terms.
+			glob = term.string.lower()
+			prefix = glob.split('*', 1)[0]
+			if prefix:
+				range_sql = "AND v.term >= ? AND v.term < ? "
+				range_args = (prefix, prefix + '\U0010ffff')
+			else:
+				range_sql = ""
+				range_args = ()
+			query_results = db.execute(
+				"SELECT p.name AS name, count(v.offset) as score "
+				"FROM pages_fts(?) as f "
+				"JOIN keys_pages_fts as k ON f.rowid = k.fts_id "
+				"JOIN pages as p ON k.page_id = p.id "
+				"JOIN pages_ftsv AS v ON f.rowid = v.doc "
+				"WHERE v.term GLOB ? " + range_sql +
+				"GROUP BY p.name;",
+				(term.string, glob) + range_args
+			).fetchall()
 
 		myscores = {}
 
@@ -136,32 +211,175 @@ sqlite.
 
 		return myresults
 
+	def estimate_n_pages(self, searchselection, term):
+		'''Estimate the number of pages matching a content term, used
+		by the search to decide the order of terms
+		@param searchselection: the L{SearchSelection} instance to use
+		@param term: a term to look for
+		@returns: the number of pages containing the term, or C{None}
+		if this can not be determined cheaply
+		'''
+		if self._use_trigram_index(term):
+			return None
+
+		try:
+			c, = searchselection.notebook.index._db.execute(
+				"SELECT count(*) FROM pages_fts WHERE pages_fts MATCH ?;",
+				(term.string,)
+			).fetchone()
+		except sqlite3.Error:
+			return None
+		else:
+			return c
+
+	def _use_trigram_index(self, term):
+		return self.preferences['trigram_index'] and bool(
+			'*' in term.string.rstrip('*') or _cjk_re.search(term.string)
+		)
+
+	@staticmethod
+	def _process_trigram_index(searchselection, db, term):
+		# The trigram table gives candidates for substrings of at
+		# least 3 characters, shorter substrings do not use the index,
+		# so then just scan all text. The stored text is matched with
+		# the same regex that is used to search page contents.
+		regex = searchselection._content_regex(term.string)
+		if max(len(s) for s in term.string.split('*')) >= 3:
+			rows = db.execute(
+				"SELECT rowid FROM pages_fts_trigram WHERE page_content LIKE ?;",
+				(_like_pattern(term.string),)
+			).fetchall()
+			candidates = [row[0] for row in rows]
+		else:
+			candidates = None
+
+		if candidates is None:
+			cursor = db.execute(
+				"SELECT p.name, f.page_content FROM pages_fts as f "
+				"JOIN keys_pages_fts as k ON f.rowid = k.fts_id "
+				"JOIN pages as p ON k.page_id = p.id;"
+			)
+			rows = cursor.fetchall()
+		else:
+			rows = []
+			for i in range(0, len(candidates), _MAX_SQL_VARIABLES):
+				chunk = candidates[i:i + _MAX_SQL_VARIABLES]
+				rows.extend(db.execute(
+					"SELECT p.name, f.page_content FROM pages_fts as f "
+					"JOIN keys_pages_fts as k ON f.rowid = k.fts_id "
+					"JOIN pages as p ON k.page_id = p.id "
+					"WHERE f.rowid IN (%s);" % ','.join('?' * len(chunk)),
+					chunk
+				).fetchall())
+
+		query_results = []
+		for name, text in rows:
+			count = len(regex.findall(text))
+			if count:
+				query_results.append({'name': name, 'score': count})
+		return query_results
+
+	def get_snippets(self, notebook, query, paths, start='<b>', end='</b>', tokens=10):
+		'''Get context for the matches of a search query in pages
+
+		@param notebook: the L{Notebook}
+		@param query: a L{Query} object, only positive content terms
+		are used
+		@param paths: the pages to get snippets for
+		@param start: text to insert before each match
+		@param end: text to insert after each match
+		@param tokens: max number of tokens in a snippet
+		@returns: a dict mapping page names to snippets, pages without
+		matches are left out
+		'''
+		strings = [s.strip('*') for s in query._walk_text_content(query.root)]
+		strings = [s for s in strings if s]
+		if not strings:
+			return {}
+
+		fts_query = ' OR '.join(
+			'"%s"*' % s.replace('"', '""') for s in strings
+		)
+		names = [p.name for p in paths]
+		snippets = {}
+		db = notebook.index._db
+		for i in range(0, len(names), _MAX_SQL_VARIABLES):
+			chunk = names[i:i + _MAX_SQL_VARIABLES]
+			try:
+				rows = db.execute(
+					"SELECT p.name, snippet(pages_fts, 0, ?, ?, '\u2026', ?) "
+					"FROM pages_fts "
+					"JOIN keys_pages_fts as k ON pages_fts.rowid = k.fts_id "
+					"JOIN pages as p ON k.page_id = p.id "
+					"WHERE pages_fts MATCH ? AND p.name IN (%s);" % ','.join('?' * len(chunk)),
+					[start, end, tokens, fts_query] + chunk
+				).fetchall()
+			except sqlite3.Error:
+				logger.exception('Could not get snippets for: %s', fts_query)
+				return snippets
+			snippets.update((row[0], row[1].strip()) for row in rows)
+
+		return snippets
+
 
 class FTSIndexer(IndexerBase):
 	'''Indexer for adding page content to the FTS index table, to keep
 	the FTS index up-to-date.
+
+	The table stores a copy of the page text, this is needed for
+	C{snippet()} to give context for search results.
+
+	Optionally the FTS table gets a prefix index, and a second FTS
+	table is added that uses the "trigram" tokenizer. This table uses
+	the first table for its content, so the text is not stored twice.
 	'''
 	PLUGIN_NAME = "IndexedFTS"
-	PLUGIN_DB_FORMAT = "0.1"
+	PLUGIN_DB_FORMAT = "0.3"
 
 	__signals__ = {}
 
+	CONTENT_FACETS = ('text',)
+
+	@classmethod
+	def db_format(cls, prefix_index=False, trigram_index=False):
+		'''Returns the format string stored in the index for a given
+		set of options, if it changes the tables need to be re-build
+		'''
+		options = [cls.PLUGIN_DB_FORMAT]
+		if prefix_index:
+			options.append('prefix')
+		if trigram_index:
+			options.append('trigram')
+		return ' '.join(options)
+
 	@classmethod
 	def teardown(cls, db):
+		db.execute("DROP TABLE IF EXISTS pages_fts_trigram;")
+		db.execute("DROP TABLE IF EXISTS pages_ftsv;")
 		db.execute("DROP TABLE IF EXISTS pages_fts;")
 		db.execute("DROP TABLE IF EXISTS keys_pages_fts;")
 		db.execute("DELETE FROM zim_index WHERE key = ?;", (cls.PLUGIN_NAME,))
 
-	def __init__(self, db, pages_indexer):
+	def __init__(self, db, pages_indexer, prefix_index=False, trigram_index=False):
 		IndexerBase.__init__(self, db)
 		self.db = db
-		self.db.executescript('''
+		self.trigram_index = trigram_index
+		prefix = ", prefix = '%s'" % PREFIX_LENGTHS if prefix_index else ''
+		self.db.execute('''
 			CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
 				page_content,
-				tokenize = 'unicode61 remove_diacritics 2',
-				content = '',
-				contentless_delete = 1
-			);
+				tokenize = 'unicode61 remove_diacritics 2'%s
+			);''' % prefix
+		)
+		if trigram_index:
+			self.db.execute('''
+				CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts_trigram USING fts5(
+					page_content,
+					tokenize = 'trigram',
+					content = 'pages_fts'
+				);
+			''')
+		self.db.executescript('''
 			CREATE VIRTUAL TABLE IF NOT EXISTS pages_ftsv
 			USING fts5vocab(pages_fts, instance);
 
@@ -173,7 +391,7 @@ class FTSIndexer(IndexerBase):
 		''')
 		self.db.execute(
 			"INSERT OR REPLACE INTO zim_index VALUES (?, ?);",
-			(self.PLUGIN_NAME, self.PLUGIN_DB_FORMAT)
+			(self.PLUGIN_NAME, self.db_format(prefix_index, trigram_index))
 		)
 
 		self.connectto_all(pages_indexer, (
@@ -185,7 +403,18 @@ class FTSIndexer(IndexerBase):
 			"WHERE page_id = ?;", (page_id,)).fetchone()
 		return fts_id[0] if fts_id is not None else None
 
+	def delete_trigram_row(self, rowid):
+		# The trigram table has external content, so it needs the old
+		# text to remove it from the index
+		if self.trigram_index:
+			self.db.execute(
+				"INSERT INTO pages_fts_trigram (pages_fts_trigram, rowid, page_content) "
+				"SELECT 'delete', rowid, page_content FROM pages_fts WHERE rowid = ?;",
+				(rowid,)
+			)
+
 	def delete_fts_row(self, rowid):
+		self.delete_trigram_row(rowid)
 		self.db.execute("DELETE FROM pages_fts WHERE rowid = ?;",
 			(rowid,)
 		)
@@ -198,12 +427,7 @@ class FTSIndexer(IndexerBase):
 		This is the centerpiece of the plugin: FTS-index all text in the
 		document and store the newly created row.
 		'''
-		allcont = [
-			token[1]
-			for token in content_tree.iter_tokens()
-			if token[0] == TEXT
-		]
-		allcont_str = ''.join(allcont)
+		allcont_str = ''.join(content_tree.iter_text())
 
 		logger.debug("Indexing full text of page %s", row["name"])
 
@@ -211,6 +435,7 @@ class FTSIndexer(IndexerBase):
 
 		if fts_id is not None:
 			# Page was searched before, we can update
+			self.delete_trigram_row(fts_id)
 			self.db.execute("UPDATE pages_fts SET page_content = ? "
 				"WHERE rowid = ?;",
 				(allcont_str, fts_id)
@@ -219,10 +444,17 @@ class FTSIndexer(IndexerBase):
 			cur = self.db.execute(
 				"INSERT INTO pages_fts (page_content) VALUES (?);",
 				(allcont_str,))
+			fts_id = cur.lastrowid
 			cur.execute(
 				"INSERT OR REPLACE INTO keys_pages_fts (page_id, fts_id) "
 				"VALUES (?, ?);",
-				(row["id"], cur.lastrowid,))
+				(row["id"], fts_id,))
+
+		if self.trigram_index:
+			self.db.execute(
+				"INSERT INTO pages_fts_trigram (rowid, page_content) VALUES (?, ?);",
+				(fts_id, allcont_str)
+			)
 
 	def on_page_row_deleted(self, o, row):
 		fts_id = self.get_fts_id(row["id"])
@@ -244,26 +476,50 @@ class IndexedFTSNotebookExtension(NotebookExtension):
 		NotebookExtension.__init__(self, plugin, notebook)
 
 		self.index = notebook.index
+		self.check_tables()
 
-		# Check if the current index contains the latest version of the
-		# FTS index table (if any at all):
+		self.indexer = None
+		self.setup_indexer(self.index, self.index.update_iter)
+		self.index.connect('new-update-iter', self.setup_indexer)
+		self.index.connect('new-thread-update-iter', self.setup_thread_indexer)
+		self.connectto(plugin.preferences, 'changed', self.on_preferences_changed)
+
+	def _options(self):
+		return {
+			'prefix_index': self.plugin.preferences['prefix_index'],
+			'trigram_index': self.plugin.preferences['trigram_index'],
+		}
+
+	def check_tables(self):
+		'''Check if the current index contains the latest version of the
+		FTS index tables (if any at all) with the current options, if
+		not the tables are removed and the index is flagged for re-indexing.
+		@returns: C{True} if the tables are up-to-date
+		'''
 		if self.index.get_property(FTSIndexer.PLUGIN_NAME) \
-			!= FTSIndexer.PLUGIN_DB_FORMAT:
+			!= FTSIndexer.db_format(**self._options()):
 
 			FTSIndexer.teardown(self.index._db)
 			self.index.flag_reindex()
+			return False
+		else:
+			return True
 
-		self.indexer = None
-		self.setup_indexer(self.index, self.index.update_iter)
-		self.index.connect('new-update-iter', self.setup_indexer)
+	def on_preferences_changed(self, preferences):
+		if not self.check_tables():
+			self.index.update_iter.remove_indexer(self.indexer)
+			self.setup_indexer(self.index, self.index.update_iter)
 
 	def setup_indexer(self, index, update_iter):
 		if self.indexer is not None:
 			self.indexer.disconnect_all()
 
-		self.indexer = FTSIndexer(index._db, update_iter.pages)
+		self.indexer = FTSIndexer(index._db, update_iter.pages, **self._options())
 		update_iter.add_indexer(self.indexer)
 
+	def setup_thread_indexer(self, index, update_iter):
+		update_iter.add_indexer(FTSIndexer(update_iter.db, update_iter.pages, **self._options()))
+
 	def teardown(self):
 		'''This should be called when the plugin is disabled.
 		It will not, however, remove the plugins data from the index
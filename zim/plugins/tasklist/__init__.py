@@ -109,6 +109,7 @@ class TaskListNotebookExtension(NotebookExtension):
 		self.indexer = None
 		self._setup_indexer(self.index, self.index.update_iter)
 		self.connectto(self.index, 'new-update-iter', self._setup_indexer)
+		self.connectto(self.index, 'new-thread-update-iter', self._setup_thread_indexer)
 
 		self.connectto(self.properties, 'changed', self.on_properties_changed)
 
@@ -121,6 +122,12 @@ class TaskListNotebookExtension(NotebookExtension):
 		update_iter.add_indexer(self.indexer)
 		self.connectto(self.indexer, 'tasklist-changed')
 
+	def _setup_thread_indexer(self, index, update_iter):
+		# Signals of this indexer are re-emitted by self.indexer, so no
+		# need to connect here
+		indexer = TasksIndexer(update_iter.db, update_iter.pages, self.properties)
+		update_iter.add_indexer(indexer)
+
 	def on_properties_changed(self, properties):
 		# Need to construct new parser, re-index pages
 		if self._parser_key != self._get_parser_key():
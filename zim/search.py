@@ -46,9 +46,16 @@ For content '*' can occur on both sides, but does not match whitespace
 
 
 import re
+import time
 import logging
+import weakref
+import threading
+import importlib
+
+from collections import deque, OrderedDict, Counter
 
 from zim.parse.encode import unescape_string
+from zim.newfs import LocalFile
 from zim.notebook import Path, \
 	PageNotFoundError, IndexNotFoundError, \
 	LINK_DIR_BACKWARD, LINK_DIR_FORWARD
@@ -81,6 +88,18 @@ keyword_re = re.compile('(' + '|'.join(KEYWORDS) + '):(.*)', re.I)
 operators_re = re.compile(r'^(\|\||\&\&|\+|\-)')
 tag_re = re.compile(r'^\@(\w+)$', re.U)
 
+
+def _count_page_source(path, format_name, regexes):
+	# Runs in a worker process of the pool used by
+	# SearchSelection._process_content(), so only picklable arguments
+	# and return values
+	file = LocalFile(path)
+	if not file.exists():
+		return None
+	format = importlib.import_module(format_name)
+	tree = format.Parser().parse(file.read(), file_input=True)
+	return [tree.countre(regex) for regex in regexes]
+
 class QueryTerm(object):
 	'''Wrapper for a single term in a query. Consists of a keyword,
 	a string and a flag for inverse (NOT operator).
@@ -279,6 +298,151 @@ class PageSelection(set):
 	pass
 
 
+def _query_key(group):
+	# Normalized representation of a query tree, terms in a group are
+	# sorted since the order does not change the results
+	members = []
+	for member in group:
+		if isinstance(member, QueryGroup):
+			members.append(('g', member.operator, _query_key(member)))
+		else:
+			members.append(('t', member.keyword, member.string, member.inverse))
+	return tuple(sorted(members))
+
+
+def _plugin_key():
+	# Search results depend on the indexed_fts plugin and its preferences
+	if "indexed_fts" in PluginManager:
+		return tuple(sorted(PluginManager["indexed_fts"].preferences.items()))
+	else:
+		return None
+
+
+class SearchCache(object):
+	'''Cache of search results for a notebook, used by
+	L{SearchSelection}. Results are only valid as long as the index
+	does not change, so the cache is cleared whenever the
+	C{generation} of the index changes. The least recently used
+	results are dropped when there are more than C{max_entries}.
+
+	Next to exact matches, the cache can give the results of an
+	earlier query that is a sub-set of the new query. If a query only
+	adds terms to the top level AND group, its results can be found
+	by searching only those terms within the earlier results. This is
+	typically the case while a query is typed.
+	'''
+
+	MAX_ENTRIES = 20 #: default for C{max_entries}
+
+	def __init__(self, max_entries=None):
+		self.max_entries = max_entries or self.MAX_ENTRIES
+		self.generation = None
+		self.hits = 0
+		self.refined = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def _check_generation(self, generation):
+		if generation != self.generation:
+			self._entries.clear()
+			self.generation = generation
+
+	def get(self, generation, query):
+		'''Lookup results for a query
+		@param generation: the current generation of the index
+		@param query: a L{Query} object
+		@returns: a 2-tuple of a set of paths and a dict of scores, or
+		C{None}
+		'''
+		key = (_plugin_key(), _query_key(query.root))
+		with self._lock:
+			self._check_generation(generation)
+			try:
+				results, scores = self._entries[key]
+			except KeyError:
+				return None
+			else:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return set(results), dict(scores)
+
+	def get_refinable(self, generation, query):
+		'''Lookup results of an earlier query that has a sub-set of the
+		top level AND terms of a query
+		@param generation: the current generation of the index
+		@param query: a L{Query} object
+		@returns: a 3-tuple of a set of paths, a dict of scores and a
+		list of the terms of C{query} that were not in the earlier
+		query; or C{None}
+		'''
+		plugin_key = _plugin_key()
+		terms = _query_key(query.root)
+		with self._lock:
+			self._check_generation(generation)
+			best = None
+			for key in reversed(self._entries):
+				if key[0] != plugin_key or len(key[1]) >= len(terms):
+					continue
+				added = Counter(terms)
+				added.subtract(key[1])
+				if min(added.values()) >= 0 and (best is None or len(key[1]) > len(best[1])):
+					best = key
+
+			if best is None:
+				self.misses += 1
+				return None
+
+			self._entries.move_to_end(best)
+			self.refined += 1
+			results, scores = self._entries[best]
+
+		added = Counter(terms)
+		added.subtract(best[1])
+		members = []
+		for member in query.root:
+			key = _query_key([member])[0]
+			if added[key] > 0:
+				added[key] -= 1
+				members.append(member)
+		return set(results), dict(scores), members
+
+	def put(self, generation, query, results, scores):
+		'''Store results for a query
+		@param generation: the generation of the index the results
+		are based on
+		@param query: a L{Query} object
+		@param results: a set of paths
+		@param scores: a dict with scores
+		'''
+		key = (_plugin_key(), _query_key(query.root))
+		with self._lock:
+			self._check_generation(generation)
+			self._entries[key] = (frozenset(results), dict(scores))
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def clear(self):
+		'''Remove all entries'''
+		with self._lock:
+			self._entries.clear()
+
+
+_search_caches = weakref.WeakKeyDictionary()
+_search_caches_lock = threading.Lock()
+
+def get_search_cache(index):
+	'''Returns the L{SearchCache} for the notebook using C{index}'''
+	with _search_caches_lock:
+		try:
+			return _search_caches[index]
+		except KeyError:
+			cache = SearchCache()
+			_search_caches[index] = cache
+			return cache
+
+
 class SearchSelection(PageSelection):
 	'''This class wraps a set of Page or ResultPath objects which result
 	from processing a search query. The attribute 'scores' gives a dict
@@ -291,8 +455,11 @@ class SearchSelection(PageSelection):
 		self.cancelled = False
 		self.query = None
 		self.scores = {}
+		self.jobs = None
+		self.plan = []
+		self.stats = {}
 
-	def search(self, query, selection=None, callback=None):
+	def search(self, query, selection=None, callback=None, jobs=None):
 		'''Populate this SearchSelection with results for a query.
 		This method flushes any previous results in this set.
 
@@ -308,22 +475,203 @@ class SearchSelection(PageSelection):
 		  - C{path} is the C{Path} for the last searched path or C{None}
 
 		If the callback returns C{False} the search is cancelled.
+
+		@param jobs: if larger than 1, pages that need to be scanned for
+		content are parsed and matched by a pool of C{jobs} worker
+		processes. Results are still processed in the same order as
+		for a serial search.
+
+		After the search the attribute C{plan} gives the steps taken,
+		see L{format_plan()}. The attribute C{stats} gives a dict with
+		statistics of the search:
+		  - C{pages_scanned}: number of pages checked for content terms
+		  - C{pages_parsed}: number of those pages that were parsed
+		  - C{index_hits}: number of those pages that were answered by
+		    the words index, including pages skipped because the index
+		    shows they can not match
+		  - C{cache}: "hit" or "refined" when the results came from
+		    the L{SearchCache}, else C{None}
+		  - C{phases}: a dict with the time in seconds spent in each
+		    phase of the search: "cache", "index", "fts" and "content"
+		  - C{elapsed}: the total time in seconds
+
+		When the index is up-to-date, results are cached in the
+		L{SearchCache} of the notebook, so repeating a query, or
+		adding terms to it, does not need a full search.
 		'''
 		# Clear state
 		self.cancelled = False
+		self.jobs = jobs
 		self.query = query
 		self.clear()
 		self.scores = {}
+		self.plan = []
+		self.stats = {
+			'pages_scanned': 0,
+			'pages_parsed': 0,
+			'index_hits': 0,
+			'cache': None,
+			'phases': {},
+			'elapsed': 0.0,
+		}
+
+		# Only use the cache when the index reflects the notebook
+		# contents, a search within a selection is not cached
+		index = self.notebook.index
+		if selection is None and index.is_uptodate:
+			cache = get_search_cache(index)
+			generation = index.generation
+		else:
+			cache = None
 
 		# Actual search
-		self.update(self._process_group(query.root, selection, callback))
+		start = time.time()
+		cached = cache.get(generation, query) if cache else None
+		refinable = cache.get_refinable(generation, query) if cache and not cached else None
+		if cached:
+			results, self.scores = cached
+			self.update(results)
+			self.stats['cache'] = 'hit'
+			self._add_plan_step(0, 'cached', None, self, start, 'cache')
+		elif refinable:
+			results, self.scores, terms = refinable
+			self.stats['cache'] = 'refined'
+			self._add_plan_step(0, 'cached', None, results, start, 'cache')
+			if results:
+				# Only the added terms are needed, within the results
+				# for the cached part of the query
+				group = QueryGroup(OPERATOR_AND, terms)
+				self.update(self._process_group(group, results, callback))
+		else:
+			self.update(self._process_group(query.root, selection, callback))
 
 		# Clean up results
 		scored = set(self.scores.keys())
 		for path in scored - self:
 			self.scores.pop(path)
 
-	def _process_group(self, group, scope=None, callback=None):
+		if cache and not cached and not self.cancelled \
+		and index.generation == generation:
+			cache.put(generation, query, self, self.scores)
+
+		self.stats['elapsed'] = time.time() - start
+
+	def format_plan(self):
+		'''Format the steps of the last search for display, for each
+		step it gives the estimated and actual number of results and
+		the time it took
+		@returns: a list of lines
+		'''
+		lines = []
+		for depth, label, estimate, n_results, seconds in self.plan:
+			lines.append('%-40s %8s %8i %8.3fs' % (
+				'  ' * depth + label,
+				'-' if estimate is None else estimate,
+				n_results, seconds
+			))
+		return lines
+
+	def get_snippets(self, paths, context=40):
+		'''Get the context of matches of the last query in pages
+
+		When the "indexed_fts" plugin is loaded, snippets come from the
+		full text index. Otherwise the page text is searched for the
+		first match of L{Query.find_input}.
+
+		@param paths: the pages to get snippets for
+		@param context: number of characters to show around the match
+		when the snippets do not come from the full text index
+		@returns: a dict mapping page names to snippets, pages without
+		matches are left out
+		'''
+		if self.query is None:
+			return {}
+		elif "indexed_fts" in PluginManager:
+			return PluginManager["indexed_fts"].get_snippets(
+				self.notebook, self.query, paths, start='', end='')
+
+		string, is_regex = self.query.find_input
+		if not string:
+			return {}
+		regex = re.compile(string if is_regex else re.escape(string), re.I | re.U)
+
+		snippets = {}
+		for path in paths:
+			try:
+				tree = self.notebook.get_page(path).get_parsetree()
+			except:
+				logger.exception('Exception reading: %s', path)
+				continue
+			if tree is None:
+				continue
+
+			text = ''.join(tree.iter_text())
+			match = regex.search(text)
+			if match:
+				start = max(0, match.start() - context)
+				end = min(len(text), match.end() + context)
+				snippet = ' '.join(text[start:end].split())
+				if start > 0:
+					snippet = '…' + snippet
+				if end < len(text):
+					snippet += '…'
+				snippets[path.name] = snippet
+
+		return snippets
+
+	def _add_plan_step(self, depth, label, estimate, results, start, phase):
+		seconds = time.time() - start
+		self.plan.append((depth, label, estimate, len(results or ()), seconds))
+		phases = self.stats['phases']
+		phases[phase] = phases.get(phase, 0.0) + seconds
+
+	@staticmethod
+	def _term_label(term):
+		label = '%s: %s' % (term.keyword, term.string)
+		return 'NOT ' + label if term.inverse else label
+
+	def _estimate(self, term):
+		# Estimate the number of pages matching a term, without the
+		# inverse flag, based on index statistics. Returns None for
+		# content terms if no estimate is available.
+		if hasattr(term, 'estimate'):
+			return term.estimate
+
+		estimate = None
+		try:
+			if term.keyword == 'tag':
+				estimate = self.notebook.tags.n_list_pages(term.string.strip('*'))
+			elif term.keyword in ('namespace', 'section'):
+				path = Path(term.string.strip('*:'))
+				estimate = 1 + self.notebook.pages.n_walk(path)
+			elif term.keyword in ('linksfrom', 'linksto'):
+				dir = LINK_DIR_FORWARD if term.keyword == 'linksfrom' else LINK_DIR_BACKWARD
+				path = self.notebook.pages.lookup_from_user_input(term.string.rstrip('*'))
+				if term.string.endswith('*'):
+					estimate = self.notebook.links.n_list_links_section(path, dir)
+				else:
+					estimate = self.notebook.links.n_list_links(path, dir)
+			elif term.keyword == 'name':
+				estimate = self.notebook.pages.n_all_pages()
+			elif "indexed_fts" in PluginManager:
+				estimate = PluginManager["indexed_fts"].estimate_n_pages(self, term)
+		except (IndexNotFoundError, ValueError):
+			estimate = 0
+
+		term.estimate = estimate
+		return estimate
+
+	def _plan_terms(self, terms):
+		# Order terms in an AND group so the most selective run first,
+		# this reduces the scope for the other terms. Inverse terms go
+		# last, with a scope they do not need to walk the whole notebook.
+		def key(term):
+			estimate = self._estimate(term)
+			return (term.inverse, estimate is None, estimate or 0)
+
+		terms.sort(key=key) # stable sort, keeps order for equal keys
+
+	def _process_group(self, group, scope=None, callback=None, depth=0):
 		# This method processes all search terms in a QueryGroup
 		# it is recursive for nested QueryGroup objects and calls
 		# _process_from_index and _process_content to handle
@@ -335,6 +683,17 @@ class SearchSelection(PageSelection):
 		if len(group) == 1 and isinstance(group[0], QueryGroup):
 			group = group[0]
 
+		group_start = time.time()
+		group_step = len(self.plan)
+		self.plan.append(None) # placeholder, see below
+		results = self._process_group_terms(group, scope, callback, depth)
+		self.plan[group_step] = (
+			depth, 'AND' if group.operator == OPERATOR_AND else 'OR',
+			None, len(results), time.time() - group_start
+		)
+		return results
+
+	def _process_group_terms(self, group, scope, callback, depth):
 		# For optimization we sort the terms in the group based  on how
 		# easy we can get them. Anything that needs content is last.
 		indexterms = []
@@ -353,14 +712,17 @@ class SearchSelection(PageSelection):
 		# Decide what operator to use
 		if group.operator == OPERATOR_AND:
 			op_func = self._and_operator
+			self._plan_terms(indexterms)
 		else:
 			op_func = self._or_operator
 
 		# First process index terms - no callback in between - this is fast
 		results = None
 		for term in indexterms:
+			start = time.time()
 			results, scope = op_func(results, scope,
 				self._process_from_index(term, scope))
+			self._add_plan_step(depth + 1, self._term_label(term), self._estimate(term), results, start, 'index')
 
 		if callback:
 			if group.operator == OPERATOR_AND:
@@ -382,7 +744,7 @@ class SearchSelection(PageSelection):
 
 		for term in subgroups:
 			results, scope = op_func(results, scope,
-				self._process_group(term, scope, callbackwrapper))
+				self._process_group(term, scope, callbackwrapper, depth + 1))
 
 			if callback:
 				if group.operator == OPERATOR_AND:
@@ -422,18 +784,27 @@ class SearchSelection(PageSelection):
 			# (which we don't need here)
 			# For OR sets, results is whatever was found so far, and should
 			# be extended with matches inside scope.
+			if group.operator == OPERATOR_AND:
+				self._plan_terms(contentterms)
+
 			for term in contentterms:
+				start = time.time()
 				if group.operator == OPERATOR_AND:
 					results, scope = self._and_operator(scope, scope,
 						process_index_fts(self, term, scope))
 				else:
 					results, scope = self._or_operator(results, scope,
 						process_index_fts(self, term, scope))
+				self._add_plan_step(depth + 1, self._term_label(term), self._estimate(term), results, start, 'fts')
 
 		# Now do the content terms all at once per page - slow or very slow
 		elif contentterms:
+			start = time.time()
 			results = self._process_content(
 				contentterms, results, scope, group.operator, callback)
+			self._add_plan_step(depth + 1,
+				'scan ' + ', '.join(self._term_label(t) for t in contentterms),
+				None, results, start, 'content')
 
 		# And return our results as summed by the operator
 		return results or set()
@@ -566,46 +937,200 @@ class SearchSelection(PageSelection):
 		#
 		# For AND 'scope' will be the results of previous steps, we make a subset
 		# of this. In 'results' will only be any final results already obtained from
-		# contentorname optimization
+		# contentorname optimization, pages with content that turn out not
+		# to match are removed again
 		# For OR 'results' is whatever was found so far while 'scope' can be larger
 		# we extend the results with any matches from scope
 		for term in terms:
 			term.content_regex = self._content_regex(term.string)
 			# term.name_regex already defined in _process_from_index
 
+		# If the index is up-to-date, the words index can give the
+		# counts for simple terms directly and tells us which pages can
+		# be skipped because they can not match. For other terms we
+		# still need to open the pages that are left.
+		use_index = self.notebook.index.is_uptodate
+		for term in terms:
+			term.index_counts = None # dict with counts per page name
+			term.index_candidates = None # set of page names that may match
+			if use_index:
+				patterns, exact = self._content_index_patterns(term.string)
+				if patterns:
+					matches = [self.notebook.words.count_matches(r, p) for r, p in patterns]
+					if exact:
+						term.index_counts = matches[0]
+					term.index_candidates = set(matches[0]).intersection(*matches[1:])
+
+		need_tree = any(term.index_counts is None for term in terms)
+		use_candidates = any(term.index_candidates is not None for term in terms)
+		if not need_tree or use_candidates:
+			with_content = self.notebook.words.list_pages_with_content()
+		skipped = [] # pages that do not match according to the index
+
+		def may_match(term, path):
+			if term.keyword == 'contentorname' \
+			and term.name_regex.match(path.name):
+				return True
+			else:
+				return term.index_candidates is None \
+					or path.name in term.index_candidates
+
+		def skip_page(path):
+			if all(term.index_candidates is None for term in terms):
+				return False
+			elif operator == OPERATOR_AND:
+				return any(
+					not may_match(term, path) if not term.inverse
+						else (term.index_counts is not None and path.name in term.index_counts)
+					for term in terms
+				)
+			else: # OPERATOR_OR
+				return not any(
+					term.inverse or may_match(term, path) for term in terms
+				)
+
 		def page_generator(paths):
 			for path in paths:
+				if skip_page(path):
+					skipped.append(path)
+					continue
+				elif not need_tree:
+					if path.name in with_content:
+						yield path, None
+					continue
+
 				try:
-					yield self.notebook.get_page(path)
+					page = self.notebook.get_page(path)
 				except:
 					logger.exception('Exception opening: %s', path)
 					continue
 
-		if scope:
-			generator = page_generator(scope)
+				#~ print('!! Search content', page)
+				try:
+					tree = page.get_parsetree()
+				except:
+					logger.exception('Exception reading: %s', page)
+					continue
+
+				if tree is None:
+					continue # Assume need to have content even for negative query
+				else:
+					yield page, tree
+
+		def parallel_page_generator(paths, executor, window):
+			# Like page_generator() but lets the worker processes parse
+			# the source and count the matches. Pages that are already
+			# loaded are counted here, they may have unsaved changes.
+			# Results are yielded in order, keeping at most "window"
+			# pages in flight.
+			regexes = [term.content_regex for term in terms]
+			queue = deque()
+
+			def pop():
+				page, future = queue.popleft()
+				try:
+					if future is None:
+						return page, page.get_parsetree()
+					else:
+						return page, future.result()
+				except:
+					logger.exception('Exception reading: %s', page)
+					return page, None
+
+			try:
+				for path in paths:
+					if skip_page(path):
+						skipped.append(path)
+						continue
+
+					try:
+						page = self.notebook.get_page(path)
+					except:
+						logger.exception('Exception opening: %s', path)
+						continue
+
+					if page._parsetree is None and page._textbuffer is None \
+					and isinstance(page.source_file, LocalFile):
+						future = executor.submit(
+							_count_page_source,
+							page.source_file.path, page.format.__name__, regexes
+						)
+						queue.append((page, future))
+					else:
+						queue.append((page, None))
+
+					while len(queue) > window:
+						page, data = pop()
+						if data is not None:
+							yield page, data
+
+				while queue:
+					page, data = pop()
+					if data is not None:
+						yield page, data
+			finally:
+				# Cancelled, do not leave work behind in the pool
+				for page, future in queue:
+					if future is not None:
+						future.cancel()
+
+		def count(i, term, path, data):
+			# data is None for pages from the index, a parse tree or
+			# a list of counts from a worker process
+			if data is None:
+				return term.index_counts.get(path.name, 0)
+			elif isinstance(data, list):
+				return data[i]
+			else:
+				return data.countre(term.content_regex)
+
+		paths = scope if scope else self.notebook.pages.walk()
+		if need_tree and self.jobs and self.jobs > 1:
+			from concurrent.futures import ProcessPoolExecutor
+			logger.debug('Searching content using %i processes', self.jobs)
+			executor = ProcessPoolExecutor(max_workers=self.jobs)
+			generator = parallel_page_generator(paths, executor, self.jobs * 16)
 		else:
-			generator = page_generator(self.notebook.pages.walk())
+			executor = None
+			generator = page_generator(paths)
 
 		if results is None:
 			results = SearchSelection(None)
 
-		for page in generator:
-			#~ print('!! Search content', page)
-			try:
-				tree = page.get_parsetree()
-			except:
-				logger.exception('Exception reading: %s', page)
-				continue
+		try:
+			self._process_content_results(
+				generator, count, terms, results, operator, callback)
+		finally:
+			generator.close()
+			if executor is not None:
+				executor.shutdown(wait=True)
 
-			if tree is None:
-				continue # Assume need to have content even for negative query
+		self.stats['index_hits'] += len(skipped)
+		if operator == OPERATOR_AND:
+			for path in skipped:
+				if path.name in with_content:
+					results.discard(path)
+
+		return results
 
+	def _process_content_results(self, generator, count, terms, results, operator, callback):
+		# Score pages from the generator of _process_content(), adds
+		# matching pages to "results", for AND also removes pages that
+		# do not match
+		stats = self.stats
+		for page, data in generator:
 			path = Path(page.name)
+			stats['pages_scanned'] += 1
+			if data is None:
+				stats['index_hits'] += 1
+			else:
+				stats['pages_parsed'] += 1
+
 			if operator == OPERATOR_AND:
 				score = 0
-				for term in terms:
+				for i, term in enumerate(terms):
 					#~ print('!! Count AND %s' % term)
-					myscore = tree.countre(term.content_regex)
+					myscore = count(i, term, path, data)
 					if term.keyword == 'contentorname' \
 					and term.name_regex.match(path.name):
 						myscore += 1 # effective score going to 11
@@ -619,10 +1144,12 @@ class SearchSelection(PageSelection):
 				if score:
 					results.add(path)
 					self._count_score(path, score)
+				else:
+					results.discard(path)
 			else: # OPERATOR_OR
-				for term in terms:
+				for i, term in enumerate(terms):
 					#~ print('!! Count OR %s' % term)
-					score = tree.countre(term.content_regex)
+					score = count(i, term, path, data)
 					if term.keyword == 'contentorname' \
 					and term.name_regex.match(path.name):
 						score += 1 # effective score going to 11
@@ -639,8 +1166,6 @@ class SearchSelection(PageSelection):
 					self.cancelled = True
 					break
 
-		return results
-
 	def _name_regex(self, string, case=False):
 		# Build a regex for matching a glob against a page name
 		# Don't use word delimiters here, since page names could be in
@@ -675,6 +1200,56 @@ class SearchSelection(PageSelection):
 		else:
 			return re.compile(regex, re.I)
 
+	def _content_index_patterns(self, string):
+		# Translate a content search term into patterns for the words
+		# index, following the same rules as _content_regex().
+		# Returns a list of (regex, prefix) tuples, one for each word
+		# in the term, and a boolean that is True if the term is a
+		# single word so the counts from the index are the result.
+		# Otherwise the patterns only select pages that may match.
+		# Word boundaries are implicit for words in the index, except
+		# at the start or end of the term next to chinese characters.
+		# A wildcard matches any non-whitespace, so it can span
+		# multiple words in the index. For a wildcard at the start or
+		# end of a word this can only change the count, but for a
+		# wildcard in the middle we can only select on a part.
+		def is_cjk(c):
+			return '\u4e00' <= c <= '\u9fff'
+
+		string = string.lower()
+		segments = re.split(r'[^\w*]+', string, flags=re.U)
+		patterns = []
+		exact = len(segments) == 1
+		for i, segment in enumerate(segments):
+			if not segment.strip('*'):
+				continue
+
+			parts = segment.split('*')
+			anchor_start = not (i == 0 and is_cjk(segment[0]))
+			anchor_end = not (i == len(segments) - 1 and is_cjk(segment[-1]))
+			if '*' in segment.strip('*'):
+				exact = False
+				if parts[0] and anchor_start:
+					regex = '^' + re.escape(parts[0])
+					prefix = parts[0]
+				else:
+					regex = re.escape(max(parts, key=len))
+					prefix = None
+			else:
+				regex = r'\w*'.join(map(re.escape, parts))
+				prefix = parts[0] or None
+				if anchor_start:
+					regex = '^' + regex
+				else:
+					prefix = None
+				if anchor_end:
+					regex = regex + '$'
+
+			patterns.append((re.compile(regex, re.U | re.I), prefix))
+
+		exact = exact and len(patterns) == 1
+		return patterns, exact
+
 	def _content_regex(self, string, case=False):
 		# Build a regex for a content search term, expands wildcards
 		# and sets case sensitivity. Tries to guess if we look for
@@ -368,6 +368,29 @@ class SignalEmitter(object, metaclass=SignalEmitterMeta):
 			except:
 				logger.exception('Exception in signal handler for %s on %s', signal, self)
 
+	def emit_excluding(self, signal, excluded, *args):
+		'''Like L{emit()} but skips handlers that are bound methods of
+		any of the objects in C{excluded}. Used to re-emit a signal for
+		listeners when the objects in C{excluded} already handled it.
+		@param signal: the signal name
+		@param excluded: list of objects
+		@param args: signal arguments
+		'''
+		assert signal in self.__signals__, 'No such signal: %s::%s' % (self.__class__.__name__, signal)
+		assert self.__signals__[signal][1] is None, 'This signal expects return values'
+
+		if self._signal_blocks.get(signal):
+			return # ignore emit
+
+		excluded = set(map(id, excluded))
+		for c, i, handler in self._signal_handlers.get(signal, []):
+			if id(getattr(handler, '__self__', None)) in excluded:
+				continue
+			try:
+				r = handler(self, *args)
+			except:
+				logger.exception('Exception in signal handler for %s on %s', signal, self)
+
 	def emit_return_first(self, signal, *args):
 		'''Emits a signal and stops emission on the first handler that returns
 		a not-None value.
@@ -50,6 +50,8 @@ import logging
 
 logger = logging.getLogger('zim.templates')
 
+from functools import partial
+
 from zim.fs import adapt_from_oldfs
 from zim.newfs import FileNotFoundError, localFileOrFolder, File
 from zim.errors import Error
@@ -141,6 +143,48 @@ def _get_template_for_string(category, template, pwd):
 			return localFileOrFolder(template, pwd)
 
 
+_parse_cache = {} # file path -> (mtime, size, parts)
+_processor_cache = {} # (file path, resources path) -> (parts, processor)
+
+
+def _parse_template_file(file):
+	# Parse a template file, the result is re-used as long as the
+	# modification time and size of the file do not change
+	try:
+		key = (file.mtime(), file.size())
+	except FileNotFoundError:
+		_parse_cache.pop(file.path, None)
+		raise
+
+	cached = _parse_cache.get(file.path)
+	if cached and cached[:2] == key:
+		return cached[2]
+
+	try:
+		parts = TemplateParser().parse(file.read())
+	except Exception as error:
+		error.parser_file = file
+		raise
+
+	_parse_cache[file.path] = key + (parts,)
+	return parts
+
+
+def _parse_included_file(resources_dir, path):
+	file = resources_dir.file(path)
+	if not file.exists():
+		raise FileNotFoundError(file)
+	return _parse_template_file(file)
+
+
+class _IterOutput(list):
+	# Output object used by Template.process_iter(), the default
+	# handler only sets the processor, so the template is processed
+	# while iterating
+
+	processor = None
+
+
 class Template(SignalEmitter):
 	'''This class defines the main interface for templates
 	It takes care of parsing a template file and allows evaluating
@@ -151,6 +195,10 @@ class Template(SignalEmitter):
 
 	# On purpose a very thin class, allow to test all steps of parsing
 	# and processing as individual classes
+	#
+	# Parsed and compiled templates are cached by file path, so creating
+	# a new object for the same file is cheap as long as the file does
+	# not change.
 
 	# For templates that we define inline, use a file-like text buffer
 
@@ -166,11 +214,7 @@ class Template(SignalEmitter):
 		'''
 		file = adapt_from_oldfs(file)
 		self.filename = file.path
-		try:
-			self.parts = TemplateParser().parse(file.read())
-		except Exception as error:
-			error.parser_file = file
-			raise
+		self.parts = _parse_template_file(file)
 
 		self.resources_dir = None
 		if '.' in file.basename:
@@ -179,8 +223,6 @@ class Template(SignalEmitter):
 			if rdir.exists():
 				self.resources_dir = rdir
 
-		self._resources_cache = {}
-
 	def process(self, output, context):
 		'''Evaluate the template
 		@param output: an object that has an C{append()} method (e.g. a C{list})
@@ -194,23 +236,54 @@ class Template(SignalEmitter):
 		context.update(self.template_functions) # set builtins
 		self.emit('process', output, context)
 
+	def process_iter(self, context):
+		'''Evaluate the template, yielding the output text while the
+		template is processed. Use this instead of L{process()} to write
+		large output to a file or a network stream without keeping it
+		all in memory.
+
+		Handlers of the "process" signal are called before the first
+		text is yielded, text they append to the output is yielded
+		before the template output. Like for L{process()} errors while
+		processing the template are logged and end the output.
+
+		@param context: a C{dict} with a set of template parameters.
+		This dict is copied to prevent changes to the original dict when
+		processing the template
+		@returns: an iterator of strings
+		@emits: process
+		'''
+		context = TemplateContextDict(dict(context)) # COPY to keep changes local
+		context.update(self.template_functions) # set builtins
+		output = _IterOutput()
+		self.emit('process', output, context)
+		yield from output
+		if output.processor is not None:
+			try:
+				yield from output.processor.process_iter(context)
+			except Exception:
+				logger.exception('Error while processing template: %s', self.filename)
+
 	def do_process(self, output, context):
+		processor = self._get_processor()
+		if isinstance(output, _IterOutput):
+			output.processor = processor # see process_iter()
+		else:
+			processor.process(output, context)
+
+	def _get_processor(self):
+		key = (self.filename, self.resources_dir.path if self.resources_dir else None)
+		cached = _processor_cache.get(key)
+		if cached and cached[0] is self.parts:
+			return cached[1]
+
 		if self.resources_dir:
-			processor = TemplateProcessor(self.parts, self.parse_included_file)
+			processor = TemplateProcessor(self.parts,
+				partial(_parse_included_file, self.resources_dir))
 		else:
 			processor = TemplateProcessor(self.parts)
-		processor.process(output, context)
+		_processor_cache[key] = (self.parts, processor)
+		return processor
 
 	def parse_included_file(self, path):
-		if path not in self._resources_cache:
-			file = self.resources_dir.file(path)
-			if not file.exists():
-				raise FileNotFoundError(file)
-
-			try:
-				self._resources_cache[path] = TemplateParser().parse(file.read())
-			except Exception as error:
-				error.parser_file = file
-				raise
-
-		return self._resources_cache[path]
+		return _parse_included_file(self.resources_dir, path)
@@ -37,12 +37,16 @@ execution in expressions.
 
 import collections.abc as abc
 
-import inspect
+import types
 import logging
 
 logger = logging.getLogger('zim.templates')
 
 
+# Same as checking inspect.ismethod(), inspect.isfunction() and inspect.isbuiltin()
+_FUNCTION_TYPES = (types.MethodType, types.FunctionType, types.BuiltinFunctionType)
+
+
 class Expression(object):
 	'''Base class for all expressions'''
 
@@ -126,9 +130,7 @@ class ExpressionParameter(Expression):
 				logger.warning('No such parameter: %s', '.'.join(map(str, self.parts[:i + 1])))
 				return None
 
-			if inspect.ismethod(value) \
-			or inspect.isfunction(value) \
-			or inspect.isbuiltin(value):
+			if isinstance(value, _FUNCTION_TYPES):
 				raise AssertionError('Can not access parameter: %s' % self.name)
 
 		return value
@@ -241,7 +243,7 @@ class ExpressionFunctionCall(Expression):
 	the arguments and evaluates the function.
 	'''
 
-	__slots__ = ('param', 'args')
+	__slots__ = ('param', 'args', '_parent')
 
 	def __init__(self, param, args):
 		'''Constuctor
@@ -252,6 +254,7 @@ class ExpressionFunctionCall(Expression):
 		assert isinstance(args, ExpressionList)
 		self.param = param
 		self.args = args
+		self._parent = param.parent # parsed once, not for every call
 
 	def __eq__(self, other):
 		return (self.param, self.args) == (other.param, other.args)
@@ -259,7 +262,7 @@ class ExpressionFunctionCall(Expression):
 	def __call__(self, context):
 		## Lookup function:
 		## getitem dict / getattr objects / getattr on wrapper
-		obj = self.param.parent(context)
+		obj = self._parent(context)
 		name = self.param.key
 		if obj is None:
 			raise AssertionError('No such object: %s' % self.param.parent.name)
@@ -19,6 +19,11 @@ from zim.parse.simpletree import SimpleTreeElement
 from zim.templates.expression import ExpressionDictObject, ExpressionParameter
 
 
+_TEXT = 0 # opcodes for compiled templates, see TemplateProcessor._run()
+_GET = 1
+_CALL = 2
+
+
 class TemplateContextDict(ExpressionDictObject):
 	'''This class defines a dict with template parameters
 
@@ -35,6 +40,11 @@ class TemplateContextDict(ExpressionDictObject):
 class TemplateProcessor(object):
 	'''The template processor takes a parsed template and "executes" it
 	one or more times.
+
+	The parsed template is compiled once when the processor is
+	constructed, so re-use the processor object to process the same
+	template many times. The state of each run is kept apart, so the
+	same object can be used by multiple threads.
 	'''
 
 	# See Expression for remarks on safe eval of expressions.
@@ -70,6 +80,11 @@ class TemplateProcessor(object):
 		if self.main is None:
 			raise AssertionError('Missing main part of template')
 
+		self._main_code = self._compile(self.main)
+		self._blocks_code = dict(
+			(name, self._compile(block)) for name, block in self.blocks.items())
+		self._include_code = {} # path -> (parts, main code, blocks code)
+
 	def process(self, output, context):
 		'''Execute the template once
 		@param output: an object to receive the template output, can be
@@ -78,8 +93,20 @@ class TemplateProcessor(object):
 		@param context: a L{TemplateContextDict} object with the
 		template parameters
 		'''
+		for text in self.process_iter(context):
+			output.append(text)
+
+	def process_iter(self, context):
+		'''Execute the template once, yielding the output
+		Like L{process()} but the output is generated while iterating,
+		so it can be written out without keeping it all in memory.
+		@param context: a L{TemplateContextDict} object with the
+		template parameters
+		@returns: an iterator of strings
+		'''
 		assert isinstance(context, TemplateContextDict)
-		self.__call__(output, self.main, context)
+		blocks = dict(self._blocks_code) # INCLUDE can add blocks while running
+		return self._run(self._main_code, blocks, context)
 
 	@staticmethod
 	def _set(context, var, value):
@@ -98,108 +125,164 @@ class TemplateProcessor(object):
 		else:
 			raise AssertionError('Can not assign: %s' % var.name)
 
-	def __call__(self, output, elements, context):
+	# The template is compiled once into a list of instructions per
+	# part, each instruction is a 2-tuple of an opcode and either a
+	# string, an expression or a generator function. Generator functions
+	# take the blocks for the current run and the context as arguments.
+	# This way the element tree does not need to be interpreted again
+	# for each run.
+
+	def _run(self, code, blocks, context):
+		for op, arg in code:
+			if op == _TEXT:
+				yield arg
+			elif op == _GET:
+				yield str(arg(context))
+			else:
+				yield from arg(blocks, context)
+
+	def _compile(self, elements):
+		code = []
 		n = len(elements)
 		i = 0
 		while i < n:
-			try:
-				element = elements[i]
-				i += 1
-				if isinstance(element, str):
-					output.append(element)
-				elif element.tag == 'GET':
-					expr = element.attrib['expr']
-					value = expr(context)
-					output.append(str(value))
-				elif element.tag == 'SET':
-					var = element.attrib['var']
-					expr = element.attrib['expr']
-					value = expr(context)
-					self._set(context, var, value)
-				elif element.tag in ('IF', 'ELIF'):
-					expr = element.attrib['expr']
-					if bool(expr(context)):
-						self.__call__(output, element, context) # recurs
-						while i < n \
-						and isinstance(elements[i], SimpleTreeElement) \
-						and elements[i].tag in ('ELIF', 'ELSE'):
-							# Skip subsequent ELIF / ELSE clauses
-							i += 1
-				elif element.tag == 'ELSE':
-					self.__call__(output, element, context) # recurs
-				elif element.tag == 'FOR':
-					self._loop(output, element, context)
-				elif element.tag == 'INCLUDE':
-					expr = element.attrib['expr']
-					if isinstance(expr, ExpressionParameter) and expr.name in self.blocks:
-						# INCLUDE name - do not evaluate as an expression
-						self._include_block(output, expr.name, context)
-					else:
-						# INCLUDE expr - eval to either block name or file path
-						arg = expr(context)
-						if '/' in arg or '\\' in arg or '.' in arg:
-							self._include_file(output, arg, context)
-						else:
-							self._include_block(output, arg, context)
-				else:
-					raise AssertionError('Unknown instruction: %s' % element.tag)
-			except:
-				raise
+			element = elements[i]
+			i += 1
+			if isinstance(element, str):
+				code.append((_TEXT, element))
+			elif element.tag == 'GET':
+				code.append((_GET, element.attrib['expr']))
+			elif element.tag == 'SET':
+				code.append((_CALL, self._compile_set(element)))
+			elif element.tag in ('IF', 'ELIF', 'ELSE'):
+				branches = [element]
+				while i < n \
+				and isinstance(elements[i], SimpleTreeElement) \
+				and elements[i].tag in ('ELIF', 'ELSE'):
+					branches.append(elements[i])
+					i += 1
+				code.append((_CALL, self._compile_if(branches)))
+			elif element.tag == 'FOR':
+				code.append((_CALL, self._compile_loop(element)))
+			elif element.tag == 'INCLUDE':
+				code.append((_CALL, self._compile_include(element)))
+			else:
+				raise AssertionError('Unknown instruction: %s' % element.tag)
+		return code
 
-	def _loop(self, output, element, context):
+	def _compile_set(self, element):
 		var = element.attrib['var']
 		expr = element.attrib['expr']
-		items = expr(context)
-		if not isinstance(items, abc.Iterable):
-			raise TypeError('Can not iterate over: %s' % items)
-		elif not isinstance(items, abc.Sized):
-			# cast to list to ensure we have a len()
-			items = list(items)
-
-		# set "loop"
-		outer = context.get('loop')
-		if isinstance(outer, TemplateLoopState):
-			loop = TemplateLoopState(len(items), outer)
-		else:
-			loop = TemplateLoopState(len(items), None)
-		context['loop'] = loop
-
-		# do the iterations
-		myiter = MovingWindowIter(items)
-		for i, items in enumerate(myiter):
-			loop._update(i, myiter)
-			self._set(context, var, items[1]) # set var
-			self.__call__(output, element, context) # recurs
-
-		# restore "loop"
-		context['loop'] = outer
-
-	def _include_block(self, output, name, context):
-		if name in self.blocks:
-			self.__call__(output, self.blocks[name], context) # recurs
+
+		def run_set(blocks, context):
+			self._set(context, var, expr(context))
+			return ()
+
+		return run_set
+
+	def _compile_if(self, branches):
+		# An "IF" or "ELIF" that is true ends the sequence, an "ELSE"
+		# is always executed and continues with a following "ELIF"
+		compiled = [
+			(None if b.tag == 'ELSE' else b.attrib['expr'], self._compile(b))
+				for b in branches
+		]
+
+		def run_if(blocks, context):
+			for expr, code in compiled:
+				if expr is None:
+					yield from self._run(code, blocks, context)
+				elif bool(expr(context)):
+					yield from self._run(code, blocks, context)
+					break
+
+		return run_if
+
+	def _compile_loop(self, element):
+		var = element.attrib['var']
+		expr = element.attrib['expr']
+		code = self._compile(element)
+
+		def run_loop(blocks, context):
+			items = expr(context)
+			if not isinstance(items, abc.Iterable):
+				raise TypeError('Can not iterate over: %s' % items)
+			elif not isinstance(items, abc.Sized):
+				# cast to list to ensure we have a len()
+				items = list(items)
+
+			# set "loop"
+			outer = context.get('loop')
+			if isinstance(outer, TemplateLoopState):
+				loop = TemplateLoopState(len(items), outer)
+			else:
+				loop = TemplateLoopState(len(items), None)
+			context['loop'] = loop
+
+			# do the iterations
+			myiter = MovingWindowIter(items)
+			for i, items in enumerate(myiter):
+				loop._update(i, myiter)
+				self._set(context, var, items[1]) # set var
+				yield from self._run(code, blocks, context)
+
+			# restore "loop"
+			context['loop'] = outer
+
+		return run_loop
+
+	def _compile_include(self, element):
+		expr = element.attrib['expr']
+
+		def run_include(blocks, context):
+			if isinstance(expr, ExpressionParameter) and expr.name in blocks:
+				# INCLUDE name - do not evaluate as an expression
+				yield from self._include_block(expr.name, blocks, context)
+			else:
+				# INCLUDE expr - eval to either block name or file path
+				arg = expr(context)
+				if '/' in arg or '\\' in arg or '.' in arg:
+					yield from self._include_file(arg, blocks, context)
+				else:
+					yield from self._include_block(arg, blocks, context)
+
+		return run_include
+
+	def _include_block(self, name, blocks, context):
+		if name in blocks:
+			yield from self._run(blocks[name], blocks, context)
 		else:
 			raise AssertionError('No such block defined: %s' % name)
 
-	def _include_file(self, output, path, context):
+	def _include_file(self, path, blocks, context):
 		if self.parse_included_file_func is None:
 			raise AssertionError('No template resources provided')
 
 		try:
-			include_template = None
-			for item in self.parse_included_file_func(path):
-				if item.tag == 'MAIN':
-					include_template = item
-				elif item.tag == 'BLOCK':
-					self.blocks[item.get('name')] = item
-				else:
-					raise AssertionError('Unknown tag: %s' % item.tag)
+			parts = self.parse_included_file_func(path)
+			cached = self._include_code.get(path)
+			if cached is None or cached[0] is not parts:
+				# Compile again if the parse result changed
+				include_code = None
+				include_blocks = {}
+				for item in parts:
+					if item.tag == 'MAIN':
+						include_code = self._compile(item)
+					elif item.tag == 'BLOCK':
+						include_blocks[item.get('name')] = self._compile(item)
+					else:
+						raise AssertionError('Unknown tag: %s' % item.tag)
+				cached = (parts, include_code, include_blocks)
+				self._include_code[path] = cached
 		except FileNotFoundError:
 			raise AssertionError('No such file in template resources: %s' % path)
 		else:
-			if include_template is None:
+			parts, include_code, include_blocks = cached
+			blocks.update(include_blocks)
+			if include_code is None:
 				raise AssertionError('BUG: Error while parsing INCLUDE (!?)')
 			else:
-				self.__call__(output, include_template, context) # recurs
+				yield from self._run(include_code, blocks, context)
 
 
 class TemplateLoopState(object):
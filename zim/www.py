@@ -11,6 +11,10 @@ using the "WSGI" API.
 The main classes here are L{WWWInterface} which implements the interface
 (and is callable as a "WSGI" application) and L{Server} which implements
 the standalone server.
+
+The standalone server handles requests in a pool of threads, see
+L{ThreadPoolWSGIServer}. Each request thread gets its own read-only
+connection to the index.
 '''
 
 # TODO setting for doc_root_url when running in CGI mode
@@ -19,8 +23,12 @@ the standalone server.
 
 
 import logging
+import signal
+import threading
+import wsgiref.simple_server
 
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from wsgiref.headers import Headers
 import urllib.request
@@ -31,11 +39,12 @@ from zim.fs import adapt_from_oldfs
 from zim.newfs import SEP, FileNotFoundError
 from zim.errors import Error
 from zim.notebook import Notebook, Path, encode_filename, PageNotFoundError
+from zim.notebook.index import PagesView, LinksView, TagsView
 from zim.config import data_file
 from zim.parse.encode import url_encode
 
 from zim.templates import get_template
-from zim.export.linker import ExportLinker, StubLayout
+from zim.export.linker import ExportLinker, StubLayout, LinkCache
 from zim.export.template import ExportTemplateContext
 from zim.export.exporters import createIndexPage
 
@@ -123,11 +132,19 @@ class WWWInterface(object):
 			template = 'Default'
 
 		self.template = get_template('html', template)
-		self.linker_factory = partial(WWWLinker, self.notebook, self.template.resources_dir)
+		self.link_cache = LinkCache(self.notebook.index)
+		self.linker_factory = partial(WWWLinker, self.notebook,
+			self.template.resources_dir, cache=self.link_cache)
 		self.dumper_factory = get_format('html').Dumper # XXX
 
 		#~ self.notebook.indexer.check_and_update()
 
+	@property
+	def pages(self):
+		# Use a read-only connection, so requests do not wait for
+		# index updates to commit
+		return PagesView(self.notebook.index.get_readonly_connection())
+
 	def __call__(self, environ, start_response):
 		'''Main function for handling a single request. Follows the
 		WSGI API.
@@ -141,7 +158,9 @@ class WWWInterface(object):
 
 			start_response(200, [('Content-Type', 'text/plain')])
 
-		@returns: the html page content as a list of lines
+		@returns: the response body as an iterable of C{bytes}, for
+		pages this is an iterator that renders the page while the
+		response is sent
 		'''
 		if self.auth_creds:
 			import base64
@@ -201,7 +220,7 @@ class WWWInterface(object):
 
 			if path == '/':
 				headers.add_header('Content-Type', 'text/html', charset='utf-8')
-				content = self.render_index()
+				content = self.render_index_iter()
 			elif path.startswith('/+docs/'):
 				dir = self.notebook.document_root
 				if not dir:
@@ -243,17 +262,28 @@ class WWWInterface(object):
 				else:
 					raise WebPageNotFoundError(path)
 
-				path = self.notebook.pages.lookup_from_user_input(pagename)
+				path = self.pages.lookup_from_user_input(pagename)
 				try:
 					page = self.notebook.get_page(path)
 					if page.hascontent:
-						content = self.render_page(page)
+						content = self.render_page_iter(page)
 					elif page.haschildren:
-						content = self.render_index(page)
+						content = self.render_index_iter(page)
 					else:
 						raise WebPageNotFoundError(path)
 				except PageNotFoundError:
 					raise WebPageNotFoundError(path)
+
+			if not isinstance(content, list):
+				# Start rendering before sending the status, errors in the
+				# template or the page source still give an error response
+				chunks = _encode_chunks(content)
+				if environ['REQUEST_METHOD'] == 'HEAD':
+					for chunk in chunks:
+						pass
+					content = []
+				else:
+					content = _continue_chunks(next(chunks, None), chunks)
 		except Exception as error:
 			headerlist = []
 			headers = Headers(headerlist)
@@ -284,6 +314,8 @@ class WWWInterface(object):
 			start_response('200 OK', headerlist)
 			if environ['REQUEST_METHOD'] == 'HEAD':
 				return []
+			elif not isinstance(content, list):
+				return content
 			elif content and isinstance(content[0], str):
 				return [c.encode('UTF-8') for c in content]
 			else:
@@ -294,17 +326,31 @@ class WWWInterface(object):
 		@param namespace: the namespace L{Path}
 		@returns: html as a list of lines
 		'''
+		return list(self.render_index_iter(namespace))
+
+	def render_index_iter(self, namespace=None):
+		'''Like L{render_index()} but returns an iterator
+		@param namespace: the namespace L{Path}
+		@returns: html as an iterator of strings
+		'''
 		path = namespace or Path(':')
 		page = createIndexPage(self.notebook, path, namespace)
-		return self.render_page(page)
+		return self.render_page_iter(page)
 
 	def render_page(self, page):
 		'''Render a single page from the notebook
 		@param page: a L{Page} object
 		@returns: html as a list of lines
 		'''
-		lines = []
+		return list(self.render_page_iter(page))
 
+	def render_page_iter(self, page):
+		'''Like L{render_page()} but returns an iterator that renders
+		the page while iterating, so the response can be streamed to the
+		client.
+		@param page: a L{Page} object
+		@returns: html as an iterator of strings
+		'''
 		context = ExportTemplateContext(
 			self.notebook,
 			self.linker_factory,
@@ -313,14 +359,41 @@ class WWWInterface(object):
 			content=[page],
 			home=self.notebook.get_home_page(),
 			up=page.parent if page.parent and not page.parent.isroot else None,
-			prevpage=self.notebook.pages.get_previous(page) if not page.isroot else None,
-			nextpage=self.notebook.pages.get_next(page) if not page.isroot else None,
+			prevpage=self.pages.get_previous(page) if not page.isroot else None,
+			nextpage=self.pages.get_next(page) if not page.isroot else None,
 			links={'index': '/'},
-			index_generator=self.notebook.pages.walk,
+			index_generator=self.pages.walk,
 			index_page=page,
 		)
-		self.template.process(lines, context)
-		return lines
+		yield from self.template.process_iter(context)
+		self.link_cache.log_stats(logging.DEBUG)
+
+
+def _encode_chunks(content, size=8192):
+	# Encode an iterator of strings, combining small strings in chunks
+	# of at least "size" characters to avoid writing many small pieces
+	buffer = []
+	buffered = 0
+	for text in content:
+		buffer.append(text)
+		buffered += len(text)
+		if buffered >= size:
+			yield ''.join(buffer).encode('UTF-8')
+			buffer = []
+			buffered = 0
+	if buffer:
+		yield ''.join(buffer).encode('UTF-8')
+
+
+def _continue_chunks(first, chunks):
+	# Once the status is sent errors can only be logged, the client
+	# gets a truncated page
+	if first is not None:
+		yield first
+	try:
+		yield from chunks
+	except Exception:
+		logger.exception('Error while rendering page:')
 
 
 class WWWLinker(ExportLinker):
@@ -328,9 +401,9 @@ class WWWLinker(ExportLinker):
 	links for the way the server handles URLs.
 	'''
 
-	def __init__(self, notebook, resources_dir=None, source=None):
+	def __init__(self, notebook, resources_dir=None, source=None, cache=None):
 		layout = StubLayout(notebook, resources_dir)
-		ExportLinker.__init__(self, notebook, layout, source=source)
+		ExportLinker.__init__(self, notebook, layout, source=source, cache=cache)
 
 	def icon(self, name):
 		return url_encode('/+resources/%s.png' % name)
@@ -364,26 +437,108 @@ class WWWLinker(ExportLinker):
 			return file.uri
 
 
+DEFAULT_THREADS = 4 #: default number of request threads for L{make_server()}
+
+
+class ThreadPoolWSGIServer(wsgiref.simple_server.WSGIServer):
+	'''WSGI server that handles requests in a pool of threads, so one
+	slow request does not block other clients
+
+	Requests are accepted in the thread calling C{serve_forever()} or
+	C{handle_request()} and queued for the pool. Use C{shutdown()} to
+	stop accepting requests and L{server_close()} to wait for requests
+	that are being handled to finish.
+	'''
+
+	def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS):
+		'''Constructor
+		@param server_address: 2-tuple of host and port
+		@param handler_class: the request handler class
+		@param threads: number of request threads
+		'''
+		assert threads >= 1
+		wsgiref.simple_server.WSGIServer.__init__(self, server_address, handler_class)
+		self.threads = threads
+		self._executor = ThreadPoolExecutor(threads, thread_name_prefix='zim-www')
+
+	def process_request(self, request, client_address):
+		self._executor.submit(self._process_request_thread, request, client_address)
+
+	def _process_request_thread(self, request, client_address):
+		# Runs in a request thread, same as socketserver.ThreadingMixIn
+		try:
+			self.finish_request(request, client_address)
+		except Exception:
+			self.handle_error(request, client_address)
+		finally:
+			self.shutdown_request(request)
+
+	def server_close(self):
+		'''Close the server socket and wait for requests that are
+		being handled to finish
+		'''
+		wsgiref.simple_server.WSGIServer.server_close(self)
+		self._executor.shutdown(wait=True)
+
+
 def main(notebook, port=8080, public=True, **opts):
 	httpd = make_server(notebook, port, public, **opts)
 	logger.info("Serving HTTP on %s port %i...", httpd.server_name, httpd.server_port)
-	httpd.serve_forever()
+	serve_forever(httpd)
 
 
-def make_server(notebook, port=8080, public=True, auth_creds=None, **opts):
+def serve_forever(httpd):
+	'''Run the server until it is stopped with C{httpd.shutdown()},
+	a keyboard interrupt or a C{SIGTERM} signal. Requests that are being
+	handled are allowed to finish before returning.
+	@param httpd: the server object from L{make_server()}
+	'''
+	if threading.current_thread() is threading.main_thread():
+		# shutdown() waits for serve_forever() to return, so it can
+		# not be called from the signal handler directly
+		signal.signal(signal.SIGTERM,
+			lambda *a: threading.Thread(target=httpd.shutdown).start())
+
+	try:
+		httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		logger.info('Stopping server')
+		httpd.server_close()
+
+
+def make_server(notebook, port=8080, public=True, auth_creds=None, threads=DEFAULT_THREADS, **opts):
 	'''Create a simple http server
 	@param notebook: the notebook location
 	@param port: the http port to serve on
 	@param public: allow connections to the server from other
 	computers - if C{False} can only connect from localhost
 	@param auth_creds: credentials for HTTP-authentication
+	@param threads: number of threads to handle requests, or C{None}
+	to handle requests in the thread running the server
 	@param opts: options for L{WWWInterface.__init__()}
 	@returns: a C{WSGIServer} object
 	'''
-	import wsgiref.simple_server
-	app = WWWInterface(notebook, auth_creds=auth_creds, **opts) # FIXME make opts explicit
-	if public:
-		httpd = wsgiref.simple_server.make_server('', port, app)
+	if threads and notebook.index.dbpath == ':memory:':
+		logger.info('Index in memory, handling requests in the server thread')
+		threads = None
+
+	if threads:
+		_use_thread_connections(notebook)
+		server_class = partial(ThreadPoolWSGIServer, threads=threads)
 	else:
-		httpd = wsgiref.simple_server.make_server('localhost', port, app)
-	return httpd
+		server_class = wsgiref.simple_server.WSGIServer
+
+	app = WWWInterface(notebook, auth_creds=auth_creds, **opts) # FIXME make opts explicit
+	host = '' if public else 'localhost'
+	return wsgiref.simple_server.make_server(host, port, app, server_class=server_class)
+
+
+def _use_thread_connections(notebook):
+	# The index views of the notebook are used by all request threads,
+	# give each thread its own read-only connection
+	db = notebook.index.get_thread_connection()
+	notebook.pages = PagesView(db)
+	notebook.links = LinksView(db)
+	notebook.tags = TagsView(db)